@@ -0,0 +1,176 @@
+# type: ignore
+import re
+from .metrics import metrics
+from .segmenter import DEFAULT_MAX_TOKENS, get_token_counter
+from .translator import make_memory_key, translate_chunks
+
+# Every segment of a batch starts on its own line with a numbered marker
+SEGMENT_MARKER = "[[{}]]"
+SEGMENT_MARKER_PATTERN = re.compile(r"^\s*\[\[(\d+)\]\][ \t]*", re.MULTILINE)
+# Sent as a system message next to the translation prompt, never as text to translate
+BATCH_INSTRUCTIONS = (
+    "The text to translate is made of numbered segments, each starting with a "
+    "[[n]] marker. Translate each segment and keep every marker unchanged at the "
+    "start of its line, in the same order, without merging or splitting segments."
+)
+
+
+def pack_batches(segments, max_tokens=DEFAULT_MAX_TOKENS, count_tokens=None):
+    """Group segment indices into batches whose text fits within `max_tokens`."""
+    count_tokens = count_tokens or get_token_counter()
+    batches = []
+    current = []
+    current_tokens = 0
+    for index, segment in enumerate(segments):
+        # Account for the marker and newline added in front of each segment
+        tokens = count_tokens(segment) + 4
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_batch(texts):
+    return "\n".join(
+        f"{SEGMENT_MARKER.format(number)} {text}"
+        for number, text in enumerate(texts, start=1)
+    )
+
+
+def parse_batch(translated_text, expected_count):
+    """Split a translated batch back into its segments.
+
+    Returns None when the markers do not come back exactly as 1..n, in which
+    case the segments cannot be reliably mapped back to their slots.
+    """
+    matches = list(SEGMENT_MARKER_PATTERN.finditer(translated_text))
+    numbers = [int(match.group(1)) for match in matches]
+    if numbers != list(range(1, expected_count + 1)):
+        return None
+
+    segments = []
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(translated_text)
+        segment = translated_text[match.end() : end].strip()
+        if not segment:
+            return None
+        segments.append(segment)
+    return segments
+
+
+def translate_batched(
+    segments,
+    model,
+    source_lang="French",
+    target_lang="English",
+    glossary=None,
+    trace=None,
+    memory=None,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    count_tokens=None,
+    max_workers=4,
+    on_progress=None,
+    on_segment=None,
+    executor=None,
+):
+    """Translate many short segments with as few model requests as possible.
+
+    Segments are packed into numbered batches up to `max_tokens` and the
+    batches are translated concurrently, with BATCH_INSTRUCTIONS on the
+    marker protocol sent alongside the translation prompt. A batch whose
+    markers do not align with its segments is translated again one segment
+    per request. Results are returned in the order of `segments`, and
+    `on_segment(segment, translation)` is called for every unique segment as
+    soon as its batch is translated.
+    """
+    translated = [None] * len(segments)
+    options = {
+        "source_lang": source_lang,
+        "target_lang": target_lang,
+        "glossary": glossary,
+        "trace": trace,
+        "max_workers": max_workers,
+        "executor": executor,
+    }
+
+    # Segments already in the translation memory are not sent again
+    memory_keys = {}
+    if memory is not None:
+        for index, segment in enumerate(segments):
+            memory_keys[index] = make_memory_key(
+                memory, segment, model, source_lang, target_lang, glossary
+            )
+            translated[index] = memory.get(memory_keys[index])
+            if translated[index] is not None:
+                metrics.increment("translation_memory_hits")
+                if on_segment is not None:
+                    on_segment(segment, translated[index])
+    # Identical segments (repeated titles, footers...) are only translated once
+    pending = list(
+        dict.fromkeys(
+            segment for segment, value in zip(segments, translated) if value is None
+        )
+    )
+
+    batches = pack_batches(pending, max_tokens, count_tokens)
+    # A batch of one segment is sent as is, without markers
+    batch_texts = [
+        pending[batch[0]]
+        if len(batch) == 1
+        else format_batch([pending[position] for position in batch])
+        for batch in batches
+    ]
+    batch_segments = {
+        batch_text: [pending[position] for position in batch]
+        for batch, batch_text in zip(batches, batch_texts)
+    }
+
+    def report_batch(batch_text, translated_batch):
+        # Misaligned batches are reported by the fallback requests instead
+        batch = batch_segments[batch_text]
+        parsed = (
+            [translated_batch]
+            if len(batch) == 1
+            else parse_batch(translated_batch, len(batch))
+        )
+        for segment, translation in zip(batch, parsed or []):
+            on_segment(segment, translation)
+
+    translated_batches = translate_chunks(
+        batch_texts,
+        model,
+        instructions=BATCH_INSTRUCTIONS,
+        on_progress=on_progress,
+        on_segment=report_batch if on_segment is not None else None,
+        **options,
+    )
+
+    translations = {}
+    misaligned = []
+    for batch, translated_batch in zip(batches, translated_batches):
+        if len(batch) == 1:
+            parsed = [translated_batch]
+        else:
+            parsed = parse_batch(translated_batch, len(batch))
+        if parsed is None:
+            misaligned.extend(pending[position] for position in batch)
+            continue
+        for position, segment in zip(batch, parsed):
+            translations[pending[position]] = segment
+
+    # Fall back to one request per segment for batches that did not align
+    if misaligned:
+        fallback = translate_chunks(misaligned, model, on_segment=on_segment, **options)
+        translations.update(zip(misaligned, fallback))
+
+    for index, segment in enumerate(segments):
+        if translated[index] is None:
+            translated[index] = translations[segment]
+            if memory is not None:
+                memory.set(memory_keys[index], translated[index])
+
+    return translated
@@ -0,0 +1,73 @@
+# type: ignore
+import os
+from .docx_stream import iter_docx_segments, write_docx_translations
+from .utils import (
+    XLSX_STREAMING_BYTES,
+    read_excel_strings,
+    read_pptx,
+    write_excel_translations,
+    write_pptx,
+)
+
+DOCUMENT_EXTENSIONS = (".docx", ".pptx", ".xlsx")
+
+
+def parse_document(file_path):
+    """Return the layout and texts to translate of a .docx, .pptx or .xlsx file.
+
+    Only plain lists and strings are returned, so documents can be parsed in
+    worker processes. The layout is what `build_translated_content` needs to
+    map the translated texts back: the paragraph IDs of a .docx, the shape
+    indexes of every slide of a .pptx and nothing for a .xlsx, whose unique
+    cell texts are their own keys.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".docx":
+        segments = list(iter_docx_segments(file_path))
+        return [segment_id for segment_id, _ in segments], [
+            text for _, text in segments
+        ]
+    if extension == ".pptx":
+        slides_content = read_pptx(file_path)
+        layout = [
+            [shape_idx for shape_idx, _ in slide_texts]
+            for slide_texts in slides_content
+        ]
+        return layout, [
+            text for slide_texts in slides_content for _, text in slide_texts
+        ]
+    if extension == ".xlsx":
+        return None, read_excel_strings(file_path)
+    raise ValueError("Unsupported file format")
+
+
+def build_translated_content(file_path, layout, texts, translated_texts):
+    """Arrange translated texts the way the writer of the format expects them."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".docx":
+        return dict(zip(layout, translated_texts))
+    if extension == ".pptx":
+        translated = iter(translated_texts)
+        return [
+            [(shape_idx, next(translated)) for shape_idx in shape_indexes]
+            for shape_indexes in layout
+        ]
+    return dict(zip(texts, translated_texts))
+
+
+def write_document(
+    translated_content,
+    output_path,
+    template_path,
+    xlsx_streaming_bytes=XLSX_STREAMING_BYTES,
+):
+    """Write a translated copy of `template_path`, in a worker process or not."""
+    extension = os.path.splitext(template_path)[1].lower()
+    if extension == ".xlsx":
+        write_excel_translations(
+            translated_content, output_path, template_path, xlsx_streaming_bytes
+        )
+    else:
+        writers = {".docx": write_docx_translations, ".pptx": write_pptx}
+        writers[extension](translated_content, output_path, template_path)
+    return os.path.getsize(output_path)
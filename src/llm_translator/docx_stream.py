@@ -0,0 +1,144 @@
+# type: ignore
+import re
+import shutil
+import zipfile
+import xml.sax
+from xml.sax.handler import ContentHandler
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
+
+# Parts of the package holding translatable text: body, headers, footers and notes
+TEXT_PART_PATTERN = re.compile(
+    r"^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$"
+)
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class _ParagraphHandler(ContentHandler):
+    """SAX handler tracking the text of every <w:p> of a WordprocessingML part.
+
+    Paragraphs get a stable ID from their part name and their position in the
+    part. When `out` is given, the part is re-serialized as it is parsed and
+    the text of the paragraphs found in `translations` is replaced: the whole
+    translation goes into the first <w:t> of the paragraph, the following ones
+    are emptied, and every other node is written back untouched.
+    """
+
+    def __init__(self, part_name, translations=None, out=None):
+        super().__init__()
+        self.part_name = part_name
+        self.translations = translations or {}
+        self.writer = (
+            XMLGenerator(out, "utf-8", short_empty_elements=True) if out else None
+        )
+        self.paragraphs = []  # Stack of the open paragraphs, they can be nested
+        self.paragraph_count = 0
+        self.in_text = False
+        self.copy_text = True
+        self.segments = []
+
+    def startDocument(self):
+        if self.writer:
+            self.writer.startDocument()
+
+    def endDocument(self):
+        if self.writer:
+            self.writer.endDocument()
+
+    def startElement(self, name, attrs):
+        if name == "w:p":
+            segment_id = f"{self.part_name}:{self.paragraph_count}"
+            self.paragraph_count += 1
+            self.paragraphs.append({"id": segment_id, "texts": [], "written": False})
+        elif name == "w:t" and self.paragraphs:
+            self.in_text = True
+            paragraph = self.paragraphs[-1]
+            translation = self.translations.get(paragraph["id"])
+            self.copy_text = translation is None
+            if translation is not None and not paragraph["written"]:
+                attrs = AttributesImpl({**attrs, "xml:space": "preserve"})
+                if self.writer:
+                    self.writer.startElement(name, attrs)
+                    self.writer.characters(translation)
+                paragraph["written"] = True
+                return
+        if self.writer:
+            self.writer.startElement(name, attrs)
+
+    def endElement(self, name):
+        if name == "w:p" and self.paragraphs:
+            paragraph = self.paragraphs.pop()
+            text = "".join(paragraph["texts"])
+            if text.strip():
+                self.segments.append((paragraph["id"], text))
+        elif name == "w:t":
+            self.in_text = False
+            self.copy_text = True
+        if self.writer:
+            self.writer.endElement(name)
+
+    def characters(self, content):
+        if self.in_text and self.paragraphs:
+            self.paragraphs[-1]["texts"].append(content)
+        if self.writer and self.copy_text:
+            self.writer.characters(content)
+
+    def ignorableWhitespace(self, whitespace):
+        if self.writer:
+            self.writer.ignorableWhitespace(whitespace)
+
+    def processingInstruction(self, target, data):
+        if self.writer:
+            self.writer.processingInstruction(target, data)
+
+
+def _parse_part(stream, handler):
+    """Feed a part to `handler` block by block, yielding after each block."""
+    parser = xml.sax.make_parser()
+    parser.setFeature(xml.sax.handler.feature_namespaces, False)
+    parser.setContentHandler(handler)
+    while True:
+        block = stream.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        parser.feed(block)
+        yield
+    parser.close()
+    yield
+
+
+def iter_docx_segments(file_path: str):
+    """Yield (segment_id, text) for every non-empty paragraph of a .docx file.
+
+    The body, headers, footers and notes are streamed from the package, so
+    memory use does not grow with the size of the document.
+    """
+    with zipfile.ZipFile(file_path) as package:
+        for name in package.namelist():
+            if not TEXT_PART_PATTERN.match(name):
+                continue
+            handler = _ParagraphHandler(name)
+            with package.open(name) as stream:
+                for _ in _parse_part(stream, handler):
+                    yield from handler.segments
+                    handler.segments.clear()
+
+
+def write_docx_translations(translations: dict, file_path: str, template_path: str):
+    """Write a copy of `template_path` with translated paragraph texts.
+
+    `translations` maps the segment IDs of `iter_docx_segments` to their
+    translation. Only the text nodes of those paragraphs change, formatting,
+    tables, images, headers and footers are copied from the original.
+    """
+    with zipfile.ZipFile(template_path) as source, zipfile.ZipFile(
+        file_path, "w", zipfile.ZIP_DEFLATED
+    ) as target:
+        for info in source.infolist():
+            with source.open(info) as stream, target.open(info, "w") as out:
+                if TEXT_PART_PATTERN.match(info.filename):
+                    handler = _ParagraphHandler(info.filename, translations, out)
+                    for _ in _parse_part(stream, handler):
+                        handler.segments.clear()
+                else:
+                    shutil.copyfileobj(stream, out)
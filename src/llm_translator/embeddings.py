@@ -0,0 +1,243 @@
+# type: ignore
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from .segmenter import Segmenter, split_segments
+
+DEFAULT_EMBEDDING_MODEL = os.environ.get(
+    "EMBEDDING_MODEL", "openai:text-embedding-3-small"
+)
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 10_000))
+# OpenAI accepts up to 2048 inputs and 8191 tokens per input in one request
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 512))
+EMBEDDING_MAX_INPUT_TOKENS = 8000
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _openai_backend(model_name, **options):
+    from openai import OpenAI
+
+    # One client per backend, reused by every request
+    client = OpenAI(**options)
+
+    def embed(texts):
+        response = client.embeddings.create(input=texts, model=model_name)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    return embed
+
+
+def _local_backend(model_name, dimensions=256):
+    """Deterministic bag of words and character trigrams, hashed into `dimensions`.
+
+    Needs no network access and gives the same vectors in every process, so it
+    is used by the tests and the benchmarks. Texts sharing words score higher.
+    """
+
+    def features(text):
+        text = text.lower()
+        words = WORD_PATTERN.findall(text)
+        trigrams = [
+            word[i : i + 3] for word in words for i in range(max(1, len(word) - 2))
+        ]
+        return [f"w:{word}" for word in words] + [
+            f"t:{trigram}" for trigram in trigrams
+        ]
+
+    def embed(texts):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), dimensions))
+        for row, text in enumerate(texts):
+            for feature in features(text):
+                digest = hashlib.md5(feature.encode("utf-8")).digest()
+                index = int.from_bytes(digest[:4], "little") % dimensions
+                vectors[row, index] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+
+    return embed
+
+
+EMBEDDING_BACKENDS = {
+    "openai": _openai_backend,
+    "local": _local_backend,
+}
+
+
+def register_embedding_backend(name, factory):
+    """Register `factory(model_name, **options)` as the embedding backend `name`.
+
+    The factory returns a function embedding a list of texts in one request.
+    """
+    EMBEDDING_BACKENDS[name] = factory
+
+
+class EmbeddingService:
+    """Embeds texts in batched requests and caches the vectors by content hash.
+
+    `embed` returns one L2-normalized row per text, so cosine similarities are
+    plain dot products. Texts larger than the input limit of the model are
+    split and their vectors averaged, and empty texts get a zero vector.
+    """
+
+    def __init__(
+        self,
+        embed,
+        model_name,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        max_input_tokens=EMBEDDING_MAX_INPUT_TOKENS,
+        cache_size=EMBEDDING_CACHE_SIZE,
+    ):
+        self._embed = embed
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_input_tokens = max_input_tokens
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return vector
+
+    def _store(self, key, vector):
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def embed(self, texts):
+        import numpy as np
+
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self._cached(key)
+            if vector is not None:
+                vectors[key] = vector
+            elif text.strip():
+                missing[key] = text
+
+        if missing:
+            # Long texts are embedded piece by piece and averaged, the segmenter
+            # is per call as its stats grow with every text
+            segmenter = Segmenter(self.max_input_tokens, model=self.model_name)
+            pieces = {
+                key: list(segmenter.segment(text)) for key, text in missing.items()
+            }
+            inputs = [piece for key_pieces in pieces.values() for piece in key_pieces]
+            embedded = []
+            for start in range(0, len(inputs), self.batch_size):
+                with self._lock:
+                    self.requests += 1
+                embedded.extend(self._embed(inputs[start : start + self.batch_size]))
+            embedded = iter(np.asarray(embedded, dtype=float))
+            for key, key_pieces in pieces.items():
+                vector = np.mean([next(embedded) for _ in key_pieces], axis=0)
+                norm = np.linalg.norm(vector)
+                vectors[key] = vector / norm if norm else vector
+                self._store(key, vectors[key])
+
+        dimensions = len(next(iter(vectors.values()))) if vectors else 0
+        zero = np.zeros(dimensions)
+        return np.array([vectors.get(key, zero) for key in keys]).reshape(
+            len(texts), -1
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "requests": self.requests,
+                "cached": len(self._cache),
+            }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(spec=None, **options):
+    """Return the long-lived embedding service for `spec`, e.g. "local:test".
+
+    `spec` is "<backend>:<model name>" and defaults to the `EMBEDDING_MODEL`
+    environment variable. A bare model name uses the OpenAI backend.
+    """
+    spec = spec or DEFAULT_EMBEDDING_MODEL
+    backend, _, model_name = spec.partition(":")
+    if not model_name or backend not in EMBEDDING_BACKENDS:
+        backend, model_name = "openai", spec
+
+    key = (backend, model_name, tuple(sorted(options.items())))
+    with _services_lock:
+        if key not in _services:
+            embed = EMBEDDING_BACKENDS[backend](model_name, **options)
+            _services[key] = EmbeddingService(embed, model_name)
+        return _services[key]
+
+
+def segment_similarity(reference_text, predicted_text, service=None):
+    """Compare two texts paragraph by paragraph, see `similarity_scores`."""
+    return similarity_scores(
+        split_segments(reference_text), split_segments(predicted_text), service
+    )
+
+
+def similarity_scores(references, predictions, service=None):
+    """Compare reference and predicted segments, e.g. paragraphs.
+
+    Every segment is embedded in one batch. When both sides have the same
+    number of segments they are compared pairwise, otherwise each reference
+    segment is matched with its most similar predicted segment. Returns the
+    aggregate score, the average of the segment scores weighted by reference
+    length, and the score of every segment.
+    """
+    import numpy as np
+
+    service = service or get_embedding_service()
+    if not references or not predictions:
+        return {"score": 0.0, "segments": []}
+
+    vectors = service.embed(references + predictions)
+    similarities = vectors[: len(references)] @ vectors[len(references) :].T
+    if len(references) == len(predictions):
+        matches = np.arange(len(references))
+    else:
+        matches = similarities.argmax(axis=1)
+    scores = similarities[np.arange(len(references)), matches]
+
+    weights = np.array([len(reference) for reference in references], dtype=float)
+    return {
+        "score": float(np.average(scores, weights=weights)),
+        "segments": [
+            {
+                "index": index,
+                "reference": reference,
+                "prediction": predictions[match],
+                "score": float(score),
+            }
+            for index, (reference, match, score) in enumerate(
+                zip(references, matches, scores)
+            )
+        ],
+    }
@@ -0,0 +1,127 @@
+# type: ignore
+import re
+from collections import deque
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Endings removed in turn before matching, so "invoice" also matches "invoices"
+# and "taxes" matches "tax" (plural, then mute or feminine "e")
+INFLECTION_SUFFIXES = ("s", "e")
+MIN_STEM_LENGTH = 3
+
+
+def normalize_token(token):
+    """Matching key of a word: acronyms as is, other words case-folded and stemmed.
+
+    Words written in capitals (e.g. "IT", "CEO") only match the same capitals,
+    so an acronym does not match the common word it spells.
+    """
+    if len(token) > 1 and token.isupper():
+        return token
+    token = token.casefold()
+    for suffix in INFLECTION_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            token = token[: -len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [normalize_token(token) for token in TOKEN_PATTERN.findall(text)]
+
+
+class _TermMatcher:
+    """Aho-Corasick automaton over the normalized words of a set of phrases.
+
+    Phrases are matched on whole words, and every phrase found in a text is
+    reported in one pass over the text, whatever the number of phrases.
+    """
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for index, phrase in enumerate(phrases):
+            tokens = tokenize(phrase)
+            if not tokens:
+                continue
+            node = 0
+            for token in tokens:
+                if token not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[node][token] = len(self.goto) - 1
+                node = self.goto[node][token]
+            self.outputs[node].append(index)
+
+        # Breadth-first, so the failure link of a node is computed before its children
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.outputs[child] = (
+                    self.outputs[child] + self.outputs[self.fail[child]]
+                )
+
+    def find(self, text):
+        """Return the indexes of the phrases found in `text`."""
+        found = set()
+        node = 0
+        for token in tokenize(text):
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            found.update(self.outputs[node])
+        return found
+
+
+class GlossaryIndex:
+    """Glossary compiled once per job to find the terms used by a text.
+
+    `terms_in` returns the entries whose term occurs in a chunk, so a prompt
+    only carries the part of the glossary it needs. `missing_terms` checks a
+    translation against its source and returns the entries whose term is in
+    the source but whose translation is not in the output.
+    """
+
+    def __init__(self, glossary):
+        self.glossary = dict(glossary or {})
+        self.terms = list(self.glossary)
+        self._terms = _TermMatcher(self.terms)
+        self._translations = _TermMatcher([self.glossary[term] for term in self.terms])
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def terms_in(self, text):
+        """Return the glossary entries occurring in `text`, in glossary order."""
+        return {
+            self.terms[index]: self.glossary[self.terms[index]]
+            for index in sorted(self._terms.find(text))
+        }
+
+    def missing_terms(self, source_text, translated_text):
+        applied = self._translations.find(translated_text)
+        return [
+            {"term": self.terms[index], "translation": self.glossary[self.terms[index]]}
+            for index in sorted(self._terms.find(source_text))
+            if index not in applied
+        ]
+
+
+def resolve_glossary(glossary, text):
+    """Return the glossary entries to send with `text`, or None when there are none.
+
+    `glossary` is either a plain {term: translation} mapping, sent whole, or a
+    `GlossaryIndex`, of which only the terms found in `text` are sent.
+    """
+    if isinstance(glossary, GlossaryIndex):
+        glossary = glossary.terms_in(text)
+    return glossary or None
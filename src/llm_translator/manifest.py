@@ -0,0 +1,141 @@
+# type: ignore
+import hashlib
+import sqlite3
+import threading
+import time
+from .revisions import RevisionStore, fingerprint
+
+DONE = "done"
+FAILED = "failed"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranslationManifest:
+    """Progress of a batch translation or job, kept in a SQLite file to resume it.
+
+    Every file is recorded with the digest of its content once it is
+    translated or has failed, and every segment as soon as it is translated.
+    A resumed run skips the files already done with the same content, and
+    passes this manifest as the store of a `DocumentRevision` so the
+    segments of unfinished files are not sent to the model again. Such a
+    revision only loads from the manifest and is never saved: segments are
+    recorded one by one as they come, with `add_segment`.
+    """
+
+    make_context = staticmethod(RevisionStore.make_context)
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manifest_files (
+                    name TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    output_path TEXT,
+                    segments INTEGER,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, context)
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS manifest_segments (
+                    name TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    PRIMARY KEY (name, context, fingerprint)
+                )
+                """
+            )
+
+    def is_done(self, name, context, digest):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest, status FROM manifest_files "
+                "WHERE name = ? AND context = ?",
+                (name, context),
+            ).fetchone()
+        return row == (digest, DONE)
+
+    def add_segment(self, name, context, source, translation):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest_segments VALUES (?, ?, ?, ?)",
+                (name, context, fingerprint(source), translation),
+            )
+
+    def load(self, name, context):
+        """Return {fingerprint: translation} of the segments done for a file."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint, translation FROM manifest_segments "
+                "WHERE name = ? AND context = ?",
+                (name, context),
+            ).fetchall()
+        return dict(rows)
+
+    def finish(
+        self, name, context, digest, status, output_path=None, segments=None, error=None
+    ):
+        """Record the outcome of a file, dropping its segments once it is done."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest_files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    name,
+                    context,
+                    digest,
+                    status,
+                    output_path,
+                    segments,
+                    error,
+                    time.time(),
+                ),
+            )
+            if status == DONE:
+                self._conn.execute(
+                    "DELETE FROM manifest_segments WHERE name = ? AND context = ?",
+                    (name, context),
+                )
+
+    def discard(self, name):
+        """Forget everything recorded for `name`, e.g. a job that has succeeded."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM manifest_segments WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM manifest_files WHERE name = ?", (name,))
+
+    def files(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, context, status, output_path, segments, error "
+                "FROM manifest_files ORDER BY name"
+            ).fetchall()
+        return [
+            dict(
+                zip(
+                    ("name", "context", "status", "output_path", "segments", "error"),
+                    row,
+                )
+            )
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
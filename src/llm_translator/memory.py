@@ -0,0 +1,126 @@
+# type: ignore
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class TranslationMemory:
+    """Persistent cache of translated segments backed by a local SQLite file.
+
+    Entries are keyed by a hash of the segment and everything that can change
+    its translation (languages, glossary, model and prompt version). Entries
+    older than `max_age` seconds are dropped, and once the store holds more than
+    `max_entries` rows the least recently used ones are evicted.
+    """
+
+    def __init__(
+        self, path, max_entries=100_000, max_age=30 * 24 * 3600, evict_every=500
+    ):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translation_memory (
+                    key TEXT PRIMARY KEY,
+                    translation TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS translation_memory_last_used "
+                "ON translation_memory (last_used)"
+            )
+        self.evict()
+
+    @staticmethod
+    def make_key(
+        text,
+        source_lang,
+        target_lang,
+        glossary=None,
+        model_name=None,
+        prompt_version=None,
+    ):
+        glossary_hash = hashlib.sha256(
+            json.dumps(glossary or {}, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        segment_hash = hashlib.sha256(text.encode()).hexdigest()
+        parts = [
+            segment_hash,
+            source_lang,
+            target_lang,
+            glossary_hash,
+            str(model_name),
+            str(prompt_version),
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT translation, created_at FROM translation_memory WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE translation_memory SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, translation):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translation_memory VALUES (?, ?, ?, ?)",
+                (key, translation, now, now),
+            )
+            self._writes += 1
+            should_evict = self._writes % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM translation_memory WHERE created_at < ?",
+                (time.time() - self.max_age,),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM translation_memory WHERE key IN (
+                    SELECT key FROM translation_memory
+                    ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM translation_memory"
+            ).fetchone()[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
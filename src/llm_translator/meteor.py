@@ -0,0 +1,239 @@
+# type: ignore
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .segmenter import split_segments
+
+logger = logging.getLogger(__name__)
+
+METEOR_WORKERS = int(os.environ.get("METEOR_WORKERS", min(4, os.cpu_count() or 1)))
+# Below this many segments, starting the pool costs more than it saves
+METEOR_MIN_PARALLEL_SEGMENTS = int(os.environ.get("METEOR_MIN_PARALLEL_SEGMENTS", 32))
+METEOR_CHUNK_SIZE = 16
+# WordNet is read from disk and never downloaded: from WORDNET_DATA_PATH when
+# set, then from the default NLTK locations
+WORDNET_DATA_PATH = os.environ.get("WORDNET_DATA_PATH")
+
+# Alignment costs, relative to the mismatch of two aligned paragraphs (0 to 1)
+SKIP_COST = 0.5
+MERGE_COST = 0.4
+ALIGNMENT_BAND = 20
+
+
+class MemoizedWordNet:
+    """WordNet reader caching the synsets of every word it has looked up.
+
+    METEOR looks up the synonyms of every hypothesis word, and the same
+    words come back in every paragraph of a document.
+    """
+
+    def __init__(self, wordnet):
+        self.wordnet = wordnet
+        self.synsets = functools.lru_cache(maxsize=100_000)(wordnet.synsets)
+
+
+class NoSynonyms:
+    """Stand-in for WordNet when its corpus is missing: exact and stem matches only."""
+
+    def synsets(self, word):
+        return []
+
+
+class MemoizedStemmer:
+    def __init__(self, stemmer):
+        self.stem = functools.lru_cache(maxsize=100_000)(stemmer.stem)
+
+
+_scorer = None
+
+
+def load_wordnet():
+    import nltk
+    from nltk.corpus import wordnet
+
+    if WORDNET_DATA_PATH and WORDNET_DATA_PATH not in nltk.data.path:
+        nltk.data.path.insert(0, WORDNET_DATA_PATH)
+    try:
+        wordnet.ensure_loaded()
+    except LookupError:
+        logger.warning("WordNet is not installed, METEOR will not match synonyms.")
+        return NoSynonyms()
+    return wordnet
+
+
+def init_scorer(wordnet=None):
+    """Build the memoized WordNet and stemmer of this process."""
+    global _scorer
+    from nltk.stem.porter import PorterStemmer
+
+    _scorer = {
+        "wordnet": MemoizedWordNet(wordnet or load_wordnet()),
+        "stemmer": MemoizedStemmer(PorterStemmer()),
+    }
+
+
+def score_segment(pair):
+    from nltk.translate.meteor_score import single_meteor_score
+
+    if _scorer is None:
+        init_scorer()
+    reference, hypothesis = pair
+    if not reference or not hypothesis:
+        return 0.0
+    return single_meteor_score(
+        reference.split(),
+        hypothesis.split(),
+        stemmer=_scorer["stemmer"],
+        wordnet=_scorer["wordnet"],
+    )
+
+
+def align_segments(references, hypotheses, band=ALIGNMENT_BAND):
+    """Pair reference and hypothesis paragraphs in document order.
+
+    Paragraphs are aligned on their lengths and shared words, allowing a
+    paragraph to be split in two or two to be merged by the translation, and
+    paragraphs to be left out on either side. Returns (reference, hypothesis)
+    pairs, with an empty string for a paragraph missing on one side.
+    """
+    n, m = len(references), len(hypotheses)
+    reference_words = [set(text.lower().split()) for text in references]
+    hypothesis_words = [set(text.lower().split()) for text in hypotheses]
+
+    def mismatch(i, di, j, dj):
+        reference_length = sum(len(text) for text in references[i - di : i])
+        hypothesis_length = sum(len(text) for text in hypotheses[j - dj : j])
+        length = abs(reference_length - hypothesis_length) / (
+            reference_length + hypothesis_length + 1
+        )
+        words = (
+            reference_words[i - 1]
+            if di == 1
+            else set().union(*reference_words[i - di : i])
+        )
+        other_words = (
+            hypothesis_words[j - 1]
+            if dj == 1
+            else set().union(*hypothesis_words[j - dj : j])
+        )
+        overlap = len(words & other_words) / (len(words | other_words) or 1)
+        return (length + 1 - overlap) / 2
+
+    moves = ((1, 1), (1, 2), (2, 1), (1, 0), (0, 1))
+    # Only cells near the diagonal are computed, paragraphs do not move far
+    costs = {(0, 0): (0.0, None)}
+    for i in range(n + 1):
+        center = i * m // max(n, 1)
+        for j in range(max(0, center - band), min(m, center + band) + 1):
+            if (i, j) == (0, 0):
+                continue
+            best = None
+            for di, dj in moves:
+                previous = costs.get((i - di, j - dj))
+                if previous is None:
+                    continue
+                if not di or not dj:
+                    cost = SKIP_COST
+                else:
+                    cost = mismatch(i, di, j, dj)
+                    if di + dj > 2:
+                        cost += MERGE_COST
+                if best is None or previous[0] + cost < best[0]:
+                    best = (previous[0] + cost, (di, dj))
+            if best is not None:
+                costs[(i, j)] = best
+
+    if (n, m) not in costs:
+        # Paragraph counts too far apart for the band, align on the whole grid
+        return align_segments(references, hypotheses, band=max(n, m))
+
+    pairs = []
+    i, j = n, m
+    while (i, j) != (0, 0):
+        di, dj = costs[(i, j)][1]
+        reference = " ".join(references[i - di : i])
+        hypothesis = " ".join(hypotheses[j - dj : j])
+        # A translated paragraph without a reference does not get a score
+        if reference:
+            pairs.append((reference, hypothesis))
+        i, j = i - di, j - dj
+    return pairs[::-1]
+
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=METEOR_WORKERS):
+    """Return the process pool shared by every scoring request of this process.
+
+    The pool is started again when asked for another number of `workers`.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            # Requests already sent to the old pool still finish there
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            # Processes are spawned, forking a threaded web worker is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_scorer,
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def meteor_scores(
+    reference_text,
+    hypothesis_text,
+    workers=METEOR_WORKERS,
+    min_parallel_segments=METEOR_MIN_PARALLEL_SEGMENTS,
+):
+    """Score a translation against its reference paragraph by paragraph.
+
+    Paragraphs are aligned first, then every pair is scored with METEOR, on
+    a process pool for large documents. Returns the corpus score, the average
+    of the paragraph scores weighted by the words of each reference
+    paragraph, and the score of every paragraph.
+    """
+    pairs = align_segments(
+        split_segments(reference_text), split_segments(hypothesis_text)
+    )
+    if not pairs:
+        return {"score": 0.0, "segments": []}
+
+    scores = None
+    if workers > 1 and len(pairs) >= min_parallel_segments:
+        try:
+            scores = list(
+                get_pool(workers).map(score_segment, pairs, chunksize=METEOR_CHUNK_SIZE)
+            )
+        except BrokenProcessPool:
+            global _pool
+            logger.exception("METEOR process pool failed, scoring in this process.")
+            with _pool_lock:
+                _pool = None
+    if scores is None:
+        scores = [score_segment(pair) for pair in pairs]
+
+    weights = [len(reference.split()) for reference, _ in pairs]
+    return {
+        "score": sum(w * s for w, s in zip(weights, scores)) / sum(weights),
+        "segments": [
+            {
+                "index": index,
+                "reference": reference,
+                "hypothesis": hypothesis,
+                "score": score,
+            }
+            for index, ((reference, hypothesis), score) in enumerate(zip(pairs, scores))
+        ],
+    }
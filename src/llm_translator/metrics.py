@@ -0,0 +1,53 @@
+# type: ignore
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Thread-safe in-process counters and stage timers.
+
+    Counters add up values such as requests or tokens, and every timed stage
+    (parse, segment, translate, write, evaluate...) keeps its count, total
+    and maximum duration in seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(float)
+            self.timers = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers[name]
+            timer["count"] += 1
+            timer["total"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {name: dict(timer) for name, timer in self.timers.items()},
+            }
+
+
+# Process-wide metrics shared by the translator and the web app
+metrics = Metrics()
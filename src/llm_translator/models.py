@@ -0,0 +1,136 @@
+# type: ignore
+import os
+import threading
+import time
+from typing import Any, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+from .prompts import INPUT_DELIMITER
+from .segmenter import estimate_tokens
+
+DEFAULT_BACKEND = "openai"
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 20))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 120))
+
+
+class FakeTranslationModel(BaseChatModel):
+    """Deterministic local chat model for tests and load testing.
+
+    It answers with the text to translate unchanged (everything after the
+    last "Text:" line of the prompt, or the whole prompt), after waiting
+    `latency` seconds to simulate a network round trip. No network access or
+    API key is needed.
+    """
+
+    model_name: str = "fake-translator"
+    temperature: float = 0
+    max_tokens: Optional[int] = None
+    latency: float = 0.0
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _calls: int = PrivateAttr(default=0)
+    _prompt_tokens: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self):
+        return "fake-translator"
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def prompt_tokens(self):
+        return self._prompt_tokens
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        translation = prompt.rsplit(INPUT_DELIMITER, 1)[-1]
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(translation)
+        with self._lock:
+            self._calls += 1
+            self._prompt_tokens += input_tokens
+        if self.latency:
+            time.sleep(self.latency)
+        message = AIMessage(
+            content=translation,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _openai_model(model_name, base_url=None, api_key=None, **options):
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    # One pooled HTTP client per model, reused by every request of the worker
+    limits = httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+    )
+    if base_url:
+        options["base_url"] = base_url
+    if api_key:
+        options["api_key"] = api_key
+    # Retries are left to the request scheduler, which knows the shared budgets
+    options.setdefault("max_retries", 0)
+    return ChatOpenAI(
+        temperature=0,
+        model=model_name,
+        http_client=httpx.Client(limits=limits, timeout=OPENAI_TIMEOUT),
+        **options,
+    )
+
+
+def _openai_compatible_model(model_name, **options):
+    # Any server implementing the OpenAI chat API (vLLM, Ollama, Azure proxies...)
+    options.setdefault("base_url", os.environ.get("OPENAI_COMPATIBLE_BASE_URL"))
+    options.setdefault(
+        "api_key", os.environ.get("OPENAI_COMPATIBLE_API_KEY", "not-needed")
+    )
+    return _openai_model(model_name, **options)
+
+
+def _fake_model(model_name, **options):
+    options.setdefault("latency", float(os.environ.get("FAKE_MODEL_LATENCY", 0)))
+    return FakeTranslationModel(model_name=model_name, **options)
+
+
+MODEL_BACKENDS = {
+    "openai": _openai_model,
+    "openai-compatible": _openai_compatible_model,
+    "fake": _fake_model,
+}
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Register `factory(model_name, **options)` as the backend `name`."""
+    MODEL_BACKENDS[name] = factory
+
+
+def get_model(spec="gpt-4o", **options):
+    """Return the long-lived chat model for `spec`, creating it on first use.
+
+    `spec` is "<backend>:<model name>", e.g. "openai-compatible:llama3" or
+    "fake:translator". A bare model name uses the OpenAI backend. Models are
+    created once per process and shared by every request.
+    """
+    backend, _, model_name = spec.partition(":")
+    if not model_name or backend not in MODEL_BACKENDS:
+        # Model names can contain colons too (e.g. fine-tuned OpenAI models)
+        backend, model_name = DEFAULT_BACKEND, spec
+
+    key = (backend, model_name, tuple(sorted(options.items())))
+    with _models_lock:
+        if key not in _models:
+            _models[key] = MODEL_BACKENDS[backend](model_name, **options)
+        return _models[key]
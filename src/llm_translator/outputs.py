@@ -0,0 +1,189 @@
+# type: ignore
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+class OutputStore:
+    """Translated files, stored once under a key of everything that produced them.
+
+    Files are kept in `root` under their key, with a SQLite index of their
+    download name, size and last access. Job results are indexed the same
+    way, without a file of their own, and list the keys of their files: a
+    result whose files are gone is a miss. Entries older than `max_age`
+    seconds expire, and the least recently used files are evicted once they
+    take more than `max_bytes` (0 for no limit on either).
+    """
+
+    def __init__(self, root, max_bytes=0, max_age=0):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite3"),
+            check_same_thread=False,
+            timeout=30,
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outputs (
+                    key TEXT PRIMARY KEY,
+                    name TEXT,
+                    size INTEGER NOT NULL,
+                    result TEXT,
+                    files TEXT,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS outputs_accessed_at "
+                "ON outputs (accessed_at)"
+            )
+
+    @staticmethod
+    def make_key(**parts):
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    @contextlib.contextmanager
+    def staging(self, name):
+        """Yield a new path in the store to write a file to, before `put` adds it.
+
+        The file is removed when writing it fails.
+        """
+        fd, path = tempfile.mkstemp(
+            dir=self.root, prefix=".staging-", suffix=f"-{name}"
+        )
+        os.close(fd)
+        try:
+            yield path
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def _expired(self, created_at):
+        return bool(self.max_age) and created_at < time.time() - self.max_age
+
+    def put(self, key, file_path, name):
+        """Move `file_path` into the store, unless the same output is already there."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        now = time.time()
+        with self._lock, self._conn:
+            stored = self._conn.execute(
+                "SELECT 1 FROM outputs WHERE key = ? AND name IS NOT NULL", (key,)
+            ).fetchone()
+            if stored is not None and os.path.exists(path):
+                os.remove(file_path)
+                self._conn.execute(
+                    "UPDATE outputs SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+            else:
+                os.replace(file_path, path)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, NULL, NULL, ?, ?)",
+                    (key, name, os.path.getsize(path), now, now),
+                )
+        self.evict()
+        return key
+
+    def get(self, key):
+        """Return the name, path and size of a stored file, or None."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT name, size, created_at FROM outputs "
+                "WHERE key = ? AND name IS NOT NULL",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            name, size, created_at = row
+            path = self.path(key)
+            if self._expired(created_at) or not os.path.exists(path):
+                self._conn.execute("DELETE FROM outputs WHERE key = ?", (key,))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                return None
+            self._conn.execute(
+                "UPDATE outputs SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return {"key": key, "name": name, "path": path, "size": size}
+
+    def put_result(self, key, result, files):
+        """Record the result of a job, valid as long as the files it lists are kept."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outputs VALUES (?, NULL, 0, ?, ?, ?, ?)",
+                (key, json.dumps(result), json.dumps(files), now, now),
+            )
+
+    def get_result(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, files, created_at FROM outputs "
+                "WHERE key = ? AND result IS NOT NULL",
+                (key,),
+            ).fetchone()
+        if row is None or self._expired(row[2]):
+            return None
+        if any(self.get(file_key) is None for file_key in json.loads(row[1])):
+            return None
+        return json.loads(row[0])
+
+    def evict(self):
+        """Drop the expired entries, then the least recently used files over budget."""
+        removed = []
+        with self._lock, self._conn:
+            if self.max_age:
+                removed += self._conn.execute(
+                    "SELECT key FROM outputs WHERE created_at < ?",
+                    (time.time() - self.max_age,),
+                ).fetchall()
+            if self.max_bytes:
+                expired = {key for (key,) in removed}
+                total = 0
+                # Most recently used first, the files past the budget are evicted
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM outputs WHERE name IS NOT NULL "
+                    "ORDER BY accessed_at DESC"
+                ):
+                    if key in expired:
+                        continue
+                    total += size
+                    if total > self.max_bytes:
+                        removed.append((key,))
+            self._conn.executemany("DELETE FROM outputs WHERE key = ?", removed)
+        for (key,) in removed:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path(key))
+        return len(removed)
+
+    def stats(self):
+        with self._lock:
+            files, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs "
+                "WHERE name IS NOT NULL"
+            ).fetchone()
+            results = self._conn.execute(
+                "SELECT COUNT(*) FROM outputs WHERE result IS NOT NULL"
+            ).fetchone()[0]
+        return {"files": files, "bytes": size, "results": results}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
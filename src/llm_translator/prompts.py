@@ -0,0 +1,163 @@
+# type: ignore
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRANSLATION_PROMPT_NAMES = ("translation_no_glossary", "Translation_with_glossary")
+
+PROMPT_CACHE_TTL = float(os.environ.get("PROMPT_CACHE_TTL", 300))
+PROMPT_FETCH_TIMEOUT = int(os.environ.get("PROMPT_FETCH_TIMEOUT", 5))
+
+# Marks the start of the text to translate in the bundled prompts
+INPUT_DELIMITER = "Text:\n"
+
+# Bundled copies of the Langfuse prompts, used when Langfuse cannot be reached
+FALLBACK_PROMPTS = {
+    "translation_no_glossary": (
+        "You are a professional translator. Translate the following text from "
+        "{{source_lang}} to {{target_lang}}. Keep the line breaks and any markup "
+        "of the original, and answer with the translation only.\n\n"
+        f"{INPUT_DELIMITER}{{{{input}}}}"
+    ),
+    "Translation_with_glossary": (
+        "You are a professional translator. Translate the following text from "
+        "{{source_lang}} to {{target_lang}}. Keep the line breaks and any markup "
+        "of the original, and answer with the translation only.\n"
+        "Always translate the terms of this glossary as given: {{glossary}}\n\n"
+        f"{INPUT_DELIMITER}{{{{input}}}}"
+    ),
+}
+
+VARIABLE_PATTERN = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class FallbackPrompt:
+    """Minimal stand-in for a Langfuse text prompt, compiled the same way."""
+
+    def __init__(self, name, prompt, version="fallback"):
+        self.name = name
+        self.prompt = prompt
+        self.version = version
+
+    def compile(self, **variables):
+        return VARIABLE_PATTERN.sub(
+            lambda match: str(variables.get(match.group(1), match.group(0))),
+            self.prompt,
+        )
+
+
+class PromptRegistry:
+    """Process-local cache of the Langfuse prompts used by the translator.
+
+    A prompt is fetched from Langfuse once and served from memory until `ttl`
+    seconds have passed. An expired prompt keeps being served while a
+    background thread fetches the new version, so a translation never waits
+    on Langfuse once the prompt has been loaded. When Langfuse cannot be
+    reached and no copy is cached yet, the bundled fallback prompt is used.
+    Concurrent callers of a prompt that is not cached yet share one fetch.
+    `langfuse` is a Langfuse client, or a function returning one which is
+    only called on the first fetch.
+    """
+
+    def __init__(self, langfuse, ttl=PROMPT_CACHE_TTL, fallbacks=FALLBACK_PROMPTS):
+        self._langfuse = langfuse
+        self.ttl = ttl
+        self.fallbacks = fallbacks
+        self.hits = 0
+        self.misses = 0
+        self.fetch_errors = 0
+        self.fetch_seconds = 0.0
+        self.fetches = 0
+        self._prompts = {}  # name -> (prompt, fetched_at)
+        self._refreshing = set()
+        self._fetch_locks = {}  # name -> lock held while the first copy is fetched
+        self._lock = threading.Lock()
+
+    @property
+    def langfuse(self):
+        if not hasattr(self._langfuse, "get_prompt"):
+            self._langfuse = self._langfuse()
+        return self._langfuse
+
+    def _fetch(self, name):
+        start = time.perf_counter()
+        try:
+            prompt = self.langfuse.get_prompt(
+                name,
+                cache_ttl_seconds=0,  # Caching is done here
+                max_retries=1,  # Used by Langfuse as the number of tries
+                fetch_timeout_seconds=PROMPT_FETCH_TIMEOUT,
+            )
+        except Exception:
+            logger.warning("Could not fetch prompt %s from Langfuse.", name)
+            prompt = None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.fetches += 1
+            self.fetch_seconds += elapsed
+            self._refreshing.discard(name)
+            cached = self._prompts.get(name)
+            if prompt is None:
+                self.fetch_errors += 1
+                if cached is not None:
+                    # Keep the copy we have and try again after another ttl
+                    prompt = cached[0]
+                else:
+                    prompt = FallbackPrompt(name, self.fallbacks[name])
+            elif cached is not None and getattr(cached[0], "version", None) != getattr(
+                prompt, "version", None
+            ):
+                logger.info(
+                    "Prompt %s updated to version %s.",
+                    name,
+                    getattr(prompt, "version", None),
+                )
+            self._prompts[name] = (prompt, time.monotonic())
+        return prompt
+
+    def get(self, name):
+        with self._lock:
+            cached = self._prompts.get(name)
+            if cached is not None:
+                self.hits += 1
+                prompt, fetched_at = cached
+                expired = time.monotonic() - fetched_at > self.ttl
+                if expired and name not in self._refreshing:
+                    self._refreshing.add(name)
+                    threading.Thread(
+                        target=self._fetch, args=(name,), daemon=True
+                    ).start()
+                return prompt
+            self.misses += 1
+            fetch_lock = self._fetch_locks.setdefault(name, threading.Lock())
+        # Callers missing the same prompt wait for one fetch, not one each
+        with fetch_lock:
+            with self._lock:
+                cached = self._prompts.get(name)
+            if cached is not None:
+                return cached[0]
+            return self._fetch(name)
+
+    def preload(self, names=TRANSLATION_PROMPT_NAMES):
+        """Fetch `names` ahead of the first translation, e.g. at worker startup."""
+        for name in names:
+            self._fetch(name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors,
+                "fetch_seconds": self.fetch_seconds,
+                "versions": {
+                    name: getattr(prompt, "version", None)
+                    for name, (prompt, _) in self._prompts.items()
+                },
+            }
@@ -0,0 +1,152 @@
+# type: ignore
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from .glossary import GlossaryIndex
+
+
+def fingerprint(text):
+    # Whitespace changes alone do not make a segment new
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+class RevisionStore:
+    """Segments of the last translated revision of every document lineage.
+
+    A lineage is a name given by the user to the successive revisions of one
+    document. For each lineage and translation context (languages and
+    glossary) the store keeps the fingerprint and translation of every
+    segment of the last successful job, in a local SQLite file.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS revision_segments (
+                    lineage TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    job_id TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (lineage, context, fingerprint)
+                )
+                """
+            )
+
+    @staticmethod
+    def make_context(source_lang, target_lang, glossary=None):
+        if isinstance(glossary, GlossaryIndex):
+            glossary = glossary.glossary
+        glossary_hash = hashlib.sha256(
+            json.dumps(glossary or {}, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        return "\x1f".join([source_lang, target_lang, glossary_hash])
+
+    def load(self, lineage, context):
+        """Return {fingerprint: translation} for the last revision of `lineage`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT fingerprint, translation FROM revision_segments "
+                "WHERE lineage = ? AND context = ?",
+                (lineage, context),
+            ).fetchall()
+        return dict(rows)
+
+    def replace(self, lineage, context, segments, job_id=None):
+        """Store `segments`, {fingerprint: translation}, as the last revision."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM revision_segments WHERE lineage = ? AND context = ?",
+                (lineage, context),
+            )
+            self._conn.executemany(
+                "INSERT INTO revision_segments "
+                "(lineage, context, fingerprint, translation, job_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (lineage, context, key, translation, job_id, now)
+                    for key, translation in segments.items()
+                ],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DocumentRevision:
+    """Diffs a new revision of a document against the last translated one.
+
+    `translate(texts, translate_changed)` reuses the translation of every
+    text unchanged since the last revision and only passes the changed or
+    new texts to `translate_changed`. Once the job has succeeded, `save`
+    makes this revision the reference of the next one.
+
+    Checkpoints of an interrupted job hold the chunks a long text was split
+    into, not the text. With the `segmenter` that split it, a text whose
+    chunks are all known is rebuilt from them instead of being translated
+    again.
+    """
+
+    def __init__(self, store, lineage, source_lang, target_lang, glossary=None):
+        self.store = store
+        self.lineage = lineage
+        self.context = store.make_context(source_lang, target_lang, glossary)
+        self.previous = store.load(lineage, self.context)
+        self.current = {}
+        self.reused = 0
+        self.translated = 0
+
+    def _lookup(self, text, key, segmenter):
+        if key in self.previous:
+            return self.previous[key]
+        if segmenter is None:
+            return None
+        chunks = list(segmenter.segment_with_separators(text))
+        if len(chunks) < 2:
+            return None
+        translations = [self.previous.get(fingerprint(chunk)) for chunk, _ in chunks]
+        if None in translations:
+            return None
+        return "".join(
+            translation + separator
+            for translation, (_, separator) in zip(translations, chunks)
+        ).strip()
+
+    def translate(self, texts, translate_changed, on_segment=None, segmenter=None):
+        fingerprints = [fingerprint(text) for text in texts]
+        known = [
+            self._lookup(text, key, segmenter) for text, key in zip(texts, fingerprints)
+        ]
+        changed = [
+            text for text, translation in zip(texts, known) if translation is None
+        ]
+        translated_changed = iter(translate_changed(changed) if changed else [])
+
+        translations = []
+        for text, key, translation in zip(texts, fingerprints, known):
+            if translation is not None:
+                self.reused += 1
+                if on_segment is not None:
+                    on_segment(text, translation)
+            else:
+                translation = next(translated_changed)
+                self.translated += 1
+            self.current[key] = translation
+            translations.append(translation)
+        return translations
+
+    def stats(self):
+        return {"reused_segments": self.reused, "translated_segments": self.translated}
+
+    def save(self, job_id=None):
+        self.store.replace(self.lineage, self.context, self.current, job_id)
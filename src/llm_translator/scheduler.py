@@ -0,0 +1,292 @@
+# type: ignore
+import email.utils
+import logging
+import random
+import sqlite3
+import threading
+import time
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate_per_minute`, holding at most `capacity`.
+
+    `reserve` takes tokens right away, letting the balance go negative, and
+    returns how long the caller has to wait for its reservation to be covered.
+    Callers are thereby served in the order they reserved.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens, updated_at, now):
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def reserve(self, amount):
+        # A request larger than the bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = self.clock()
+            self.tokens = self._refill(self.tokens, self.updated_at, now) - amount
+            self.updated_at = now
+            return max(0.0, -self.tokens / self.rate)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """Token bucket whose balance is kept in a SQLite file shared by processes."""
+
+    def __init__(self, path, name, rate_per_minute, capacity=None):
+        # Wall clock time, monotonic clocks are not comparable between processes
+        super().__init__(rate_per_minute, capacity, clock=time.time)
+        self.path = str(path)
+        self.name = name
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO rate_limit_buckets VALUES (?, ?, ?)",
+                (name, self.capacity, self.clock()),
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def reserve(self, amount):
+        amount = min(amount, self.capacity)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, updated_at = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limit_buckets WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            now = self.clock()
+            tokens = self._refill(tokens, updated_at, now) - amount
+            conn.execute(
+                "UPDATE rate_limit_buckets SET tokens = ?, updated_at = ? "
+                "WHERE name = ?",
+                (tokens, now, self.name),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return max(0.0, -tokens / self.rate)
+
+
+def get_status_code(error):
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def get_retry_after(error):
+    """Seconds to wait given by the Retry-After headers of a failed response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time()) if retry_at else None
+
+
+def is_retryable(error):
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    # Connection errors and timeouts of the OpenAI and httpx clients
+    return type(error).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "ConnectError",
+        "ReadTimeout",
+        "ConnectTimeout",
+    )
+
+
+class RequestScheduler:
+    """Paces the model requests of a worker to stay within the provider limits.
+
+    Every request first reserves one request from the requests-per-minute
+    bucket and its estimated tokens from the tokens-per-minute bucket, and
+    waits until both reservations are covered. Rate limited (429) and other
+    transient failures are retried with jittered exponential backoff, or
+    after the delay given by Retry-After, and a 429 pauses every request of
+    the scheduler until then. `stats` reports the queue depth and waits.
+    Budgets of 0 are not limited, and with `shared_path`, a SQLite file, the
+    budgets are shared by the worker processes of a node.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=0,
+        tokens_per_minute=0,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        shared_path=None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_bucket = self._make_bucket(
+            "requests", requests_per_minute, shared_path
+        )
+        self.token_bucket = self._make_bucket("tokens", tokens_per_minute, shared_path)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._backing_off = 0
+        self._requests = 0
+        self._throttled = 0
+        self._retries = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    @staticmethod
+    def _make_bucket(name, rate_per_minute, shared_path):
+        if not rate_per_minute:
+            return None
+        if shared_path:
+            return SQLiteTokenBucket(shared_path, name, rate_per_minute)
+        return TokenBucket(rate_per_minute)
+
+    def _wait_for_budget(self, estimated_tokens):
+        with self._lock:
+            self._queued += 1
+        start = time.monotonic()
+        try:
+            wait = 0.0
+            if self.request_bucket is not None:
+                wait = self.request_bucket.reserve(1)
+            if self.token_bucket is not None and estimated_tokens:
+                wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+            wait = max(wait, self._paused_until - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            waited = time.monotonic() - start
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+                self._wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+            metrics.observe("rate_limit_wait", waited)
+
+    def _backoff(self, attempt, error):
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter, so throttled requests do not retry all at once
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def call(self, request, estimated_tokens=0):
+        """Run `request()` within the budgets, retrying transient failures."""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_budget(estimated_tokens)
+            try:
+                return request()
+            except Exception as error:
+                if attempt == self.max_retries or not is_retryable(error):
+                    raise
+                delay = self._backoff(attempt, error)
+                metrics.increment("model_retries")
+                with self._lock:
+                    self._retries += 1
+                    if get_status_code(error) == 429:
+                        metrics.increment("rate_limited")
+                        self._throttled += 1
+                        # Hold back every request, not only this one
+                        self._paused_until = max(
+                            self._paused_until, time.monotonic() + delay
+                        )
+                logger.warning(
+                    "Model request failed (%s), retrying in %.1fs.", error, delay
+                )
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._requests += 1
+            # Waiting to retry, the request is no longer in flight
+            with self._lock:
+                self._backing_off += 1
+            try:
+                time.sleep(delay)
+            finally:
+                with self._lock:
+                    self._backing_off -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "backing_off": self._backing_off,
+                "requests": self._requests,
+                "throttled": self._throttled,
+                "retries": self._retries,
+                "wait_seconds": self._wait_seconds,
+                "max_wait_seconds": self._max_wait_seconds,
+                "average_wait_seconds": self._wait_seconds / max(1, self._requests),
+            }
+
+
+_scheduler = None
+_scheduler_factory = RequestScheduler
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the scheduler shared by every translation request of this process.
+
+    It is built on first use by the factory of `set_scheduler_factory`,
+    without any limit by default.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = _scheduler_factory()
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    """Replace the shared scheduler, None to build a new one on next use."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+
+def set_scheduler_factory(factory):
+    """Build the shared scheduler with `factory()`, e.g. from the Django settings."""
+    global _scheduler, _scheduler_factory
+    with _scheduler_lock:
+        _scheduler_factory = factory
+        _scheduler = None
@@ -0,0 +1,169 @@
+# type: ignore
+import functools
+import re
+
+DEFAULT_MAX_TOKENS = 3000
+
+# Captured, so the pieces of a split paragraph are joined back with their own spacing
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;:。！？…])(\s+)")
+WORD_BOUNDARY = re.compile(r"(\s+)")
+
+
+def estimate_tokens(text):
+    # Rough OpenAI rule of thumb (~4 characters per token), without a tokenizer
+    return -(-len(text) // 4)
+
+
+def split_segments(text):
+    """Return the non-empty paragraphs of `text`, stripped."""
+    return [line.strip() for line in text.split("\n") if line.strip()]
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model="gpt-4o"):
+    """Return a function counting the tokens of a text for `model`.
+
+    Falls back to a character based estimate when tiktoken or the model's
+    encoding is not available (e.g. no network access to fetch it).
+    """
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception:
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class SegmenterStats:
+    def __init__(self):
+        self.tokens_per_chunk = []
+
+    @property
+    def chunks(self):
+        return len(self.tokens_per_chunk)
+
+    @property
+    def total_tokens(self):
+        return sum(self.tokens_per_chunk)
+
+    def as_dict(self):
+        return {
+            "chunks": self.chunks,
+            "total_tokens": self.total_tokens,
+            "tokens_per_chunk": list(self.tokens_per_chunk),
+        }
+
+
+class Segmenter:
+    """Packs paragraphs into chunks of at most `max_tokens` model tokens.
+
+    Paragraphs are kept whole and joined with a single newline whenever they
+    fit. A paragraph larger than the budget is split on sentence boundaries,
+    then on words, and as a last resort on characters. `segment` is a
+    generator, and `stats` records the size of every chunk it produced.
+    """
+
+    def __init__(
+        self, max_tokens=DEFAULT_MAX_TOKENS, model="gpt-4o", count_tokens=None
+    ):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or get_token_counter(model)
+        self.stats = SegmenterStats()
+
+    def segment(self, text):
+        """Yield chunks from `text`, either a string or an iterable of paragraphs."""
+        for chunk, _ in self.segment_with_separators(text):
+            yield chunk
+
+    def segment_with_separators(self, text):
+        """Yield (chunk, separator) pairs, `separator` being what followed the chunk.
+
+        It is a newline between paragraphs, and the original whitespace
+        between the pieces of a split paragraph, so joining every chunk with
+        its separator gives the paragraphs back with their own spacing.
+        """
+        paragraphs = text.split("\n") if isinstance(text, str) else text
+        separator_tokens = self.count_tokens("\n")
+        pending = []
+        pending_tokens = 0
+
+        for paragraph in paragraphs:
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = self.count_tokens(paragraph)
+
+            if tokens > self.max_tokens:
+                if pending:
+                    yield self._emit(pending, pending_tokens), "\n"
+                pieces = list(self._split_oversized(paragraph))
+                for piece, piece_tokens, separator in pieces[:-1]:
+                    yield self._emit([piece], piece_tokens), separator
+                # The tail of the paragraph can still share a chunk with what follows
+                piece, tokens, _ = pieces[-1]
+                pending, pending_tokens = [piece], tokens
+                continue
+
+            if pending and pending_tokens + separator_tokens + tokens > self.max_tokens:
+                yield self._emit(pending, pending_tokens), "\n"
+                pending, pending_tokens = [], 0
+            if pending:
+                pending_tokens += separator_tokens
+            pending.append(paragraph)
+            pending_tokens += tokens
+
+        if pending:
+            yield self._emit(pending, pending_tokens), "\n"
+
+    def _emit(self, parts, tokens):
+        self.stats.tokens_per_chunk.append(tokens)
+        return "\n".join(parts)
+
+    def _split_oversized(self, paragraph):
+        """Yield the (piece, tokens, separator) of a paragraph, each within the budget.
+
+        `separator` is the whitespace that followed the piece in the paragraph.
+        """
+        parts = SENTENCE_BOUNDARY.split(paragraph)
+        if len(parts) == 1:
+            parts = WORD_BOUNDARY.split(paragraph)
+            if len(parts) == 1:
+                yield from self._split_characters(paragraph)
+                return
+
+        current = []  # (unit, separator) pairs of the next piece
+        current_tokens = 0
+        for unit, separator in zip(parts[0::2], parts[1::2] + [""]):
+            unit_tokens = self.count_tokens(unit)
+            if unit_tokens > self.max_tokens:
+                if current:
+                    yield self._join_units(current, current_tokens)
+                    current, current_tokens = [], 0
+                pieces = list(self._split_oversized(unit))
+                yield from pieces[:-1]
+                piece, tokens, _ = pieces[-1]
+                yield piece, tokens, separator
+                continue
+            join_tokens = self.count_tokens(current[-1][1]) if current else 0
+            if current and current_tokens + join_tokens + unit_tokens > self.max_tokens:
+                yield self._join_units(current, current_tokens)
+                current, current_tokens, join_tokens = [], 0, 0
+            current.append((unit, separator))
+            current_tokens += join_tokens + unit_tokens
+        if current:
+            yield self._join_units(current, current_tokens)
+
+    @staticmethod
+    def _join_units(units, tokens):
+        text = (
+            "".join(unit + separator for unit, separator in units[:-1]) + units[-1][0]
+        )
+        return text, tokens, units[-1][1]
+
+    def _split_characters(self, text):
+        tokens = self.count_tokens(text)
+        size = max(1, len(text) * self.max_tokens // tokens)
+        for start in range(0, len(text), size):
+            piece = text[start : start + size]
+            yield piece, self.count_tokens(piece), ""
@@ -1,10 +1,32 @@
 # type: ignore
 from .utils import read_docx, write_docx, read_excel, write_excel, read_pptx, write_pptx
-from .translator import initialize_model, translate_text
+from .translator import initialize_model, translate_text, translate_chunks
+from .memory import TranslationMemory
+from .segmenter import Segmenter
+from .batching import BATCH_INSTRUCTIONS, translate_batched
+from .prompts import FALLBACK_PROMPTS, INPUT_DELIMITER, FallbackPrompt, PromptRegistry
+from .models import get_model, register_backend, FakeTranslationModel
+from .meteor import align_segments, meteor_scores
+from .glossary import GlossaryIndex, resolve_glossary
+from .scheduler import RequestScheduler, TokenBucket, set_scheduler
+from .tracing import compact_payload, start_trace
+from . import meteor, tracing
+from .embeddings import (
+    get_embedding_service,
+    register_embedding_backend,
+    segment_similarity,
+)
+from . import translator
 from langfuse import Langfuse
 from pptx import Presentation
 import os
 import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
 
 model = initialize_model()
 
@@ -31,6 +53,235 @@ def test_translate_text_with_glossary():
     ), "Translation result should match the expected translation"
 
 
+def test_translate_chunks_preserves_order_and_leaves_retries_to_the_scheduler(
+    monkeypatch,
+):
+    attempts = {}
+
+    def fake_translate_text(text, model, **kwargs):
+        attempts[text] = attempts.get(text, 0) + 1
+        if text == "invalid":
+            raise ValueError("invalid request")
+        return text.upper()
+
+    monkeypatch.setattr(translator, "translate_text", fake_translate_text)
+    chunks = [f"chunk {i}" for i in range(8)]
+
+    result = translate_chunks(chunks, model, max_workers=4)
+
+    assert result == [chunk.upper() for chunk in chunks]
+    # An error the scheduler did not retry is not sent again
+    with pytest.raises(ValueError):
+        translate_chunks(["invalid"], model)
+    assert attempts["invalid"] == 1
+
+
+def test_translation_memory_hit_skips_model(monkeypatch, tmp_path):
+    class FakePrompt:
+        version = 3
+
+        def compile(self, **kwargs):
+            return kwargs["input"]
+
+    class UnreachableModel:
+        model_name = "gpt-4o"
+
+        def __or__(self, other):
+            raise AssertionError("The model should not be called on a memory hit")
+
+    monkeypatch.setattr(
+        translator, "get_translation_prompt", lambda glossary=None: FakePrompt()
+    )
+    memory = TranslationMemory(tmp_path / "memory.sqlite3")
+    key = memory.make_key(
+        sample_text, "French", "English", model_name="gpt-4o", prompt_version=3
+    )
+    memory.set(key, reference_translation)
+
+    result = translate_text(sample_text, UnreachableModel(), trace=trace, memory=memory)
+
+    assert result == reference_translation
+    assert memory.stats()["hits"] == 1
+
+
+def test_translation_memory_eviction(tmp_path):
+    memory = TranslationMemory(tmp_path / "memory.sqlite3", max_entries=2)
+    for i in range(3):
+        memory.set(f"key{i}", f"value{i}")
+    memory.get("key0")  # Refresh key0 so key1 becomes the least recently used
+    memory.evict()
+
+    assert len(memory) == 2
+    assert memory.get("key1") is None
+    assert memory.get("key0") == "value0"
+
+    expired = TranslationMemory(tmp_path / "memory.sqlite3", max_age=-1)
+    assert len(expired) == 0, "Entries older than max_age should be evicted"
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_segmenter_packs_paragraphs_within_budget():
+    segmenter = Segmenter(max_tokens=6, count_tokens=count_words)
+    text = "\none two\nthree four\n\nfive six seven\neight"
+
+    chunks = list(segmenter.segment(text))
+
+    assert chunks == ["one two\nthree four", "five six seven\neight"]
+    assert segmenter.stats.chunks == 2
+    assert segmenter.stats.tokens_per_chunk == [4, 4]
+
+
+def test_segmenter_splits_oversized_paragraphs():
+    segmenter = Segmenter(max_tokens=5, count_tokens=count_words)
+    paragraph = "First sentence is here. Second one is a bit longer than that."
+
+    chunks = list(segmenter.segment(iter([paragraph, "Tail."])))
+
+    assert all(count_words(chunk) <= 5 for chunk in chunks)
+    assert " ".join(chunks).replace("\n", " ") == paragraph + " Tail."
+    assert max(segmenter.stats.tokens_per_chunk) <= 5
+
+
+def test_translate_batched_maps_segments_back(monkeypatch):
+    requests = []
+
+    def fake_translate_text(text, model, **kwargs):
+        requests.append(text)
+        # Drop the markers of the batch containing "broken" to force a fallback
+        if "[[" in text and "broken" in text:
+            return "garbled output"
+        return text.upper()
+
+    monkeypatch.setattr(translator, "translate_text", fake_translate_text)
+    segments = ["title", "bullet one", "title", "broken", "label"]
+    reported = []
+
+    result = translate_batched(
+        segments,
+        model,
+        max_tokens=12,
+        count_tokens=count_words,
+        max_workers=1,
+        on_segment=lambda source, translation: reported.append((source, translation)),
+    )
+
+    assert result == ["TITLE", "BULLET ONE", "TITLE", "BROKEN", "LABEL"]
+    # Every unique segment is reported once, the misaligned ones after the fallback
+    assert reported == [
+        ("title", "TITLE"),
+        ("bullet one", "BULLET ONE"),
+        ("broken", "BROKEN"),
+        ("label", "LABEL"),
+    ]
+    # Two batches (the repeated title is sent once), then one request per
+    # segment of the misaligned batch
+    assert len(requests) == 4
+    assert requests[-2:] == ["broken", "label"]
+
+
+def test_batch_instructions_are_sent_apart_from_the_text(monkeypatch):
+    class RecordingModel(FakeTranslationModel):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            requests.append([message.content for message in messages])
+            return super()._generate(messages, stop, run_manager, **kwargs)
+
+    requests = []
+    monkeypatch.setattr(
+        translator.prompt_registry,
+        "get",
+        lambda name: FallbackPrompt(name, FALLBACK_PROMPTS[name]),
+    )
+    segments = ["Bonjour", "Merci beaucoup", "Au revoir"]
+
+    result = translate_batched(
+        segments, RecordingModel(), max_tokens=100, max_workers=1
+    )
+
+    assert result == segments
+    assert len(requests) == 1
+    system, prompt = requests[0]
+    assert system == BATCH_INSTRUCTIONS
+    assert BATCH_INSTRUCTIONS not in prompt
+    numbered = prompt.rsplit(INPUT_DELIMITER, 1)[-1]
+    assert numbered == "[[1]] Bonjour\n[[2]] Merci beaucoup\n[[3]] Au revoir"
+
+
+def test_prompt_registry_caches_and_falls_back():
+    class FakeLangfuse:
+        def __init__(self):
+            self.calls = 0
+            self.reachable = True
+
+        def get_prompt(self, name, **kwargs):
+            self.calls += 1
+            if not self.reachable:
+                raise ConnectionError("Langfuse is unreachable")
+            return FallbackPrompt(name, "Translate {{input}}", version=self.calls)
+
+    client = FakeLangfuse()
+    registry = PromptRegistry(client, ttl=60)
+    registry.preload(["translation_no_glossary"])
+    for _ in range(3):
+        prompt = registry.get("translation_no_glossary")
+
+    assert client.calls == 1, "The prompt should only be fetched once"
+    assert prompt.compile(input="Bonjour") == "Translate Bonjour"
+    assert registry.stats()["hits"] == 3
+
+    client.reachable = False
+    fallback = registry.get("Translation_with_glossary")
+    assert fallback.version == "fallback"
+    assert "Bonjour" in fallback.compile(
+        source_lang="French", target_lang="English", input="Bonjour", glossary={}
+    )
+    assert registry.stats()["fetch_errors"] == 1
+
+
+def test_prompt_registry_fetches_a_missing_prompt_once_for_concurrent_callers():
+    class SlowLangfuse:
+        def __init__(self):
+            self.calls = 0
+
+        def get_prompt(self, name, **kwargs):
+            self.calls += 1
+            time.sleep(0.1)
+            return FallbackPrompt(name, "Translate {{input}}", version=1)
+
+    client = SlowLangfuse()
+    registry = PromptRegistry(client, ttl=60)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        prompts = list(
+            executor.map(lambda _: registry.get("translation_no_glossary"), range(8))
+        )
+
+    assert client.calls == 1
+    assert all(prompt is prompts[0] for prompt in prompts)
+
+
+def test_model_registry_pools_models_and_runs_fake_backend(monkeypatch):
+    monkeypatch.setattr(
+        translator,
+        "get_translation_prompt",
+        lambda glossary=None: FallbackPrompt(
+            "translation_no_glossary", "Translate to {{target_lang}}.\nText:\n{{input}}"
+        ),
+    )
+    fake_model = get_model("fake:translator")
+
+    assert get_model("fake:translator") is fake_model, "Models should be reused"
+    assert translate_text(sample_text, fake_model, trace=trace) == sample_text
+    assert fake_model.calls == 1 and fake_model.prompt_tokens > 0
+
+    register_backend(
+        "custom", lambda name, **options: FakeTranslationModel(model_name=name)
+    )
+    assert get_model("custom:my-model").model_name == "my-model"
+    assert get_model("gpt-4o") is model
+
+
 # Test read and write docx functions
 def test_read_write_docx(tmp_path):
     docx_file = tmp_path / "test.docx"
@@ -78,3 +329,314 @@ def test_read_write_excel(tmp_path):
     read_text = read_excel(str(excel_file))
     assert "Col1\tCol2" in read_text, "Read content should include column headers"
     assert "Val1\tVal2" in read_text, "Read content should include cell values"
+
+
+def test_large_workbooks_are_translated_part_by_part(tmp_path):
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill
+    from . import utils
+
+    workbook = openpyxl.Workbook()
+    first = workbook.active
+    first.title = "Clients"
+    first["B2"] = "Bonjour"
+    first["B2"].font = Font(bold=True)
+    first["C2"] = 12.5
+    first["C2"].number_format = "0.00"
+    first["A4"] = "=C2*2"
+    first["D6"].fill = PatternFill("solid", fgColor="FFFF00")
+    first.merge_cells("B8:D8")
+    first["B8"] = "Total des ventes"
+    first.column_dimensions["B"].width = 42
+    workbook.create_sheet("Notes")["A1"] = "Merci"
+    workbook.save(tmp_path / "input.xlsx")
+
+    # Every workbook is above the threshold, so it is streamed
+    utils.write_excel_translations(
+        {"Bonjour": "Hello", "Merci": "Thanks", "Total des ventes": "Total sales"},
+        str(tmp_path / "output.xlsx"),
+        str(tmp_path / "input.xlsx"),
+        streaming_bytes=0,
+    )
+
+    translated = openpyxl.load_workbook(tmp_path / "output.xlsx")
+    assert translated.sheetnames == ["Clients", "Notes"]
+    clients = translated["Clients"]
+    assert (clients["B2"].value, clients["B2"].font.b) == ("Hello", True)
+    assert (clients["C2"].value, clients["C2"].number_format) == (12.5, "0.00")
+    assert clients["A4"].value == "=C2*2"
+    assert translated["Notes"]["A1"].value == "Thanks"
+    # Merged cells, column widths and the styles of empty cells are kept
+    assert clients["B8"].value == "Total sales"
+    assert [str(merged) for merged in clients.merged_cells.ranges] == ["B8:D8"]
+    assert clients.column_dimensions["B"].width == 42
+    assert clients["D6"].fill.fgColor.rgb == "00FFFF00"
+
+
+def test_embedding_service_batches_caches_and_scores_segments():
+    requests = []
+    local_embed = get_embedding_service("local:test")._embed
+
+    def counting_backend(model_name, **options):
+        def embed(texts):
+            requests.append(list(texts))
+            return local_embed(texts)
+
+        return embed
+
+    register_embedding_backend("counting", counting_backend)
+    service = get_embedding_service("counting:test")
+    reference = "The contract starts today.\nPayment is due in thirty days.\nThank you."
+    translation = "The contract starts today.\nThe cat sleeps on the sofa.\nThank you."
+
+    result = segment_similarity(reference, translation, service)
+
+    # The unique paragraphs of both texts are embedded in a single request
+    assert requests == [
+        [
+            "The contract starts today.",
+            "Payment is due in thirty days.",
+            "Thank you.",
+            "The cat sleeps on the sofa.",
+        ]
+    ]
+    scores = [segment["score"] for segment in result["segments"]]
+    assert abs(scores[0] - 1) < 1e-9 and abs(scores[2] - 1) < 1e-9
+    assert min(result["segments"], key=lambda segment: segment["score"])["index"] == 1
+    assert 0 < result["score"] < 1
+
+    # The second comparison is served from the cache
+    segment_similarity(reference, translation, service)
+    assert len(requests) == 1
+    assert service.stats()["hits"] == 4
+
+
+def test_align_segments_handles_split_and_missing_paragraphs():
+    references = [
+        "The board met on Monday to approve the budget.",
+        "Thank you.",
+        "Annex",
+    ]
+    hypotheses = ["The board met on Monday", "to approve the budget.", "Thank you."]
+
+    assert align_segments(references, hypotheses) == [
+        (references[0], "The board met on Monday to approve the budget."),
+        ("Thank you.", "Thank you."),
+        ("Annex", ""),
+    ]
+
+
+def test_align_segments_with_very_different_paragraph_counts():
+    for references, hypotheses in ((["a b c"], ["a"] * 50), (["a"] * 50, ["a b c"])):
+        pairs = align_segments(references, hypotheses)
+        # Every reference paragraph is kept, in order, the extra paragraphs are skipped
+        assert (
+            " ".join(reference for reference, _ in pairs).split()
+            == " ".join(references).split()
+        )
+        assert "a b c" in " ".join(text for pair in pairs for text in pair)
+
+
+def test_meteor_scores_segments_on_a_process_pool():
+    reference = "The contract starts today.\nPayment is due in thirty days.\nThank you."
+    hypothesis = "The contract starts today.\nThe cat sleeps on the sofa.\nThank you."
+
+    pooled = meteor_scores(reference, hypothesis, workers=2, min_parallel_segments=1)
+    inline = meteor_scores(reference, hypothesis, workers=1)
+
+    assert pooled == inline
+    scores = [segment["score"] for segment in pooled["segments"]]
+    assert scores[1] < scores[0] and scores[1] < scores[2]
+    assert min(scores) < pooled["score"] < max(scores)
+    # Another number of workers starts another pool
+    assert meteor.get_pool(2) is meteor.get_pool(2)
+    assert meteor.get_pool(3)._max_workers == 3
+
+
+def test_glossary_index_finds_terms_and_missing_translations():
+    index = GlossaryIndex(
+        {
+            "facture": "invoice",
+            "bon de commande": "purchase order",
+            "TVA": "VAT",
+            "commande": "order",
+            "Casablanca": "Casablanca",
+        }
+    )
+    text = "Les Factures et le bon de commande sont joints. La tva est due."
+
+    # Plural and case variants match, the acronym only in capitals
+    assert index.terms_in(text) == {
+        "facture": "invoice",
+        "bon de commande": "purchase order",
+        "commande": "order",
+    }
+    assert resolve_glossary(index, "Rien à traduire") is None
+    assert index.missing_terms(
+        text, "The invoices and the order form are attached. VAT is due."
+    ) == [{"term": "bon de commande", "translation": "purchase order"}]
+
+
+def test_token_bucket_spaces_requests_over_the_minute():
+    now = [0.0]
+    bucket = TokenBucket(60, capacity=2, clock=lambda: now[0])
+
+    # The burst is served at once, then one request per second
+    assert [bucket.reserve(1) for _ in range(4)] == [0.0, 0.0, 1.0, 2.0]
+    now[0] = 10.0
+    assert bucket.reserve(1) == 0.0
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    """Fake OpenAI chat endpoint answering 429 to the first two requests."""
+
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests += 1
+        if type(self).requests <= 2:
+            payload = {"error": {"message": "Rate limit reached", "type": "requests"}}
+            self.send_response(429)
+            self.send_header("Retry-After", "0.2")
+        else:
+            text = body["messages"][-1]["content"].rsplit("Text:\n", 1)[-1]
+            payload = {
+                "id": "chatcmpl-test",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": 5,
+                    "total_tokens": 15,
+                },
+            }
+            self.send_response(200)
+        data = json.dumps(payload).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_scheduler_retries_rate_limited_requests_after_retry_after(monkeypatch):
+    monkeypatch.setattr(
+        translator,
+        "get_translation_prompt",
+        lambda glossary=None: FallbackPrompt(
+            "translation_no_glossary", "Translate to {{target_lang}}.\nText:\n{{input}}"
+        ),
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheduler = RequestScheduler(requests_per_minute=600, max_retries=3)
+    set_scheduler(scheduler)
+    try:
+        rate_limited_model = get_model(
+            "openai-compatible:rate-limited",
+            base_url=f"http://127.0.0.1:{server.server_port}/v1",
+            api_key="test",
+        )
+        start = time.monotonic()
+        result = translate_text(sample_text, rate_limited_model)
+        elapsed = time.monotonic() - start
+    finally:
+        set_scheduler(None)
+        server.shutdown()
+
+    # The client does not retry on its own, the scheduler waits as told
+    assert result == sample_text
+    assert RateLimitedHandler.requests == 3
+    assert elapsed >= 0.4
+    stats = scheduler.stats()
+    assert stats["throttled"] == 2 and stats["retries"] == 2
+    assert stats["requests"] == 3 and stats["queue_depth"] == 0
+
+
+def test_requests_waiting_to_retry_are_not_in_flight():
+    class Unavailable(Exception):
+        status_code = 503
+        response = type("Response", (), {"headers": {"retry-after": "0.3"}})
+
+    scheduler = RequestScheduler(max_retries=1)
+    attempts = []
+
+    def request():
+        attempts.append(scheduler.stats())
+        if len(attempts) == 1:
+            raise Unavailable()
+        return "ok"
+
+    worker = threading.Thread(target=scheduler.call, args=(request,))
+    worker.start()
+    while not attempts:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    backing_off = scheduler.stats()
+    worker.join()
+
+    assert attempts[0]["in_flight"] == 1
+    assert backing_off["in_flight"] == 0 and backing_off["backing_off"] == 1
+    assert len(attempts) == 2 and attempts[1]["in_flight"] == 1
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0 and stats["backing_off"] == 0
+
+
+def test_trace_payloads_are_bounded_and_jobs_sampled():
+    document = "Bonjour tout le monde. " * 1000
+    payload = compact_payload(
+        {"input": document, "segments": list(range(100)), "method": "none"},
+        max_chars=100,
+        max_items=10,
+    )
+
+    assert payload["input"].startswith(document[:100])
+    assert f"[{len(document)} chars, sha256:" in payload["input"]
+    assert len(payload["input"]) < 200
+    assert payload["segments"] == list(range(10)) + ["... [90 more items]"]
+    assert payload["method"] == "none"
+    assert start_trace("Unsampled job", sample_rate=0) is None
+
+
+def test_trace_payloads_are_compacted_before_reaching_the_client(monkeypatch):
+    class RecordingObservation:
+        def __init__(self, calls):
+            self.calls = calls
+
+        def __getattr__(self, method):
+            def record(**fields):
+                self.calls.append((method, fields))
+                return RecordingObservation(self.calls)
+
+            return record
+
+    calls = []
+    monkeypatch.setattr(tracing, "get_langfuse", lambda: RecordingObservation(calls))
+    document = "Bonjour tout le monde. " * 1000
+
+    job_trace = start_trace("Job", sample_rate=1, input=document)
+    span = job_trace.span(name="Evaluating translation", input={"text": document})
+    span.generation(name="translation", input=document).end(output=document)
+    span.end(output=0.9, metadata={"worst_segments": [document]})
+
+    assert [method for method, _ in calls] == [
+        "trace",
+        "span",
+        "generation",
+        "end",
+        "end",
+    ]
+    for _, fields in calls:
+        assert len(json.dumps(fields)) < len(document)
+    assert calls[0][1]["name"] == "Job" and calls[-1][1]["output"] == 0.9
@@ -0,0 +1,116 @@
+# type: ignore
+import functools
+import hashlib
+import os
+import random
+from .metrics import metrics
+
+# Longer strings in trace inputs and outputs keep their start, length and hash
+TRACE_MAX_PAYLOAD_CHARS = int(os.environ.get("TRACE_MAX_PAYLOAD_CHARS", 2000))
+TRACE_MAX_PAYLOAD_ITEMS = int(os.environ.get("TRACE_MAX_PAYLOAD_ITEMS", 50))
+# Events are sent by the client's background thread, in batches
+TRACE_FLUSH_AT = int(os.environ.get("TRACE_FLUSH_AT", 50))
+TRACE_FLUSH_INTERVAL = float(os.environ.get("TRACE_FLUSH_INTERVAL", 5.0))
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()
+
+
+def text_digest(text):
+    """Length and SHA-256 of a text, which stand for a whole document in a trace."""
+    if text is None:
+        return None
+    return {"chars": len(text), "sha256": _sha256(text)}
+
+
+def compact_payload(
+    data, max_chars=TRACE_MAX_PAYLOAD_CHARS, max_items=TRACE_MAX_PAYLOAD_ITEMS
+):
+    """Bound the size of a trace payload, e.g. a prompt or a whole document.
+
+    A string longer than `max_chars` is cut and tagged with its length and
+    SHA-256, so identical payloads can still be recognized, and lists keep
+    their first `max_items` items.
+    """
+    if isinstance(data, str):
+        if len(data) <= max_chars:
+            return data
+        return f"{data[:max_chars]}... [{len(data)} chars, sha256:{_sha256(data)[:16]}]"
+    if isinstance(data, dict):
+        return {
+            key: compact_payload(value, max_chars, max_items)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        items = [
+            compact_payload(item, max_chars, max_items) for item in data[:max_items]
+        ]
+        if len(data) > max_items:
+            items.append(f"... [{len(data) - max_items} more items]")
+        return items
+    return data
+
+
+# Keyword arguments of the Langfuse objects that carry payloads
+_PAYLOAD_FIELDS = ("input", "output", "metadata")
+
+
+class _CompactTrace:
+    """A Langfuse trace, span or generation whose payloads are compacted.
+
+    Compacting is done here rather than by the client's `mask`, which older
+    clients run when the event is queued, and this also keeps the payloads of
+    the spans, generations and events started from it bounded.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @staticmethod
+    def _compact(fields):
+        return {
+            key: compact_payload(value) if key in _PAYLOAD_FIELDS else value
+            for key, value in fields.items()
+        }
+
+    def span(self, **fields):
+        return _CompactTrace(self._client.span(**self._compact(fields)))
+
+    def generation(self, **fields):
+        return _CompactTrace(self._client.generation(**self._compact(fields)))
+
+    def event(self, **fields):
+        return _CompactTrace(self._client.event(**self._compact(fields)))
+
+    def update(self, **fields):
+        return self._client.update(**self._compact(fields))
+
+    def end(self, **fields):
+        return self._client.end(**self._compact(fields))
+
+
+@functools.lru_cache(maxsize=None)
+def get_langfuse():
+    """Return the process-wide Langfuse client, created on first use."""
+    from langfuse import Langfuse
+
+    return Langfuse(flush_at=TRACE_FLUSH_AT, flush_interval=TRACE_FLUSH_INTERVAL)
+
+
+def start_trace(name, sample_rate, **fields):
+    """Start a Langfuse trace for a `sample_rate` fraction of the calls.
+
+    Returns None for the calls left out, which every traced function accepts
+    in place of a trace, so an unsampled job builds no trace payload at all.
+    """
+    if sample_rate < 1 and random.random() >= sample_rate:
+        metrics.increment("traces_dropped")
+        return None
+    metrics.increment("traces_sampled")
+    return _CompactTrace(
+        get_langfuse().trace(name=name, **_CompactTrace._compact(fields))
+    )
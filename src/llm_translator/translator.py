@@ -1,27 +1,65 @@
 # type: ignore
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.callbacks import get_openai_callback
-from langfuse import Langfuse
+from .glossary import resolve_glossary
+from .metrics import metrics
+from .models import get_model
+from .prompts import PromptRegistry
+from .scheduler import get_scheduler
+from .segmenter import estimate_tokens
+from .tracing import get_langfuse
 
-langfuse = Langfuse()
+# The Langfuse client is only created when the first prompt is fetched
+prompt_registry = PromptRegistry(get_langfuse)
 
 
 def initialize_model(model: str = "gpt-4o"):
-    if model == "gpt-4o":
-        from langchain_openai import ChatOpenAI
+    # Models are pooled by the registry, so this is cheap to call for every job
+    return get_model(model)
 
-        return ChatOpenAI(temperature=0, model="gpt-4o")
-    else:
-        print("Model Not Supported Yet")
+
+def get_translation_prompt(glossary=None):
+    if glossary:
+        return prompt_registry.get("Translation_with_glossary")
+    return prompt_registry.get("translation_no_glossary")
+
+
+def make_memory_key(
+    memory, text, model, source_lang, target_lang, glossary=None, prompt=None
+):
+    """Key of `text` in the translation memory for the given model and prompt."""
+    glossary = resolve_glossary(glossary, text)
+    prompt = prompt or get_translation_prompt(glossary)
+    return memory.make_key(
+        text,
+        source_lang,
+        target_lang,
+        glossary=glossary,
+        model_name=getattr(model, "model_name", None),
+        prompt_version=getattr(prompt, "version", None),
+    )
 
 
 def translate_text(
-    text, model, source_lang="French", target_lang="English", glossary=None, trace=None
+    text,
+    model,
+    source_lang="French",
+    target_lang="English",
+    glossary=None,
+    trace=None,
+    memory=None,
+    instructions=None,
 ):
+    from langchain_community.callbacks import get_openai_callback
+
     parser = StrOutputParser()
 
+    # With a GlossaryIndex, only the entries found in this text go in the prompt
+    glossary = resolve_glossary(glossary, text)
+    prompt = get_translation_prompt(glossary)
     if glossary:
-        prompt = langfuse.get_prompt("Translation_with_glossary")
         prompt_template = prompt.compile(
             source_lang=source_lang,
             target_lang=target_lang,
@@ -29,33 +67,134 @@ def translate_text(
             glossary=glossary,
         )
     else:
-        prompt = langfuse.get_prompt("translation_no_glossary")
         prompt_template = prompt.compile(
             source_lang=source_lang,
             target_lang=target_lang,
             input=text,
         )
 
+    # Serve repeated segments from the translation memory without calling the model
+    if memory is not None:
+        memory_key = make_memory_key(
+            memory, text, model, source_lang, target_lang, glossary, prompt
+        )
+        cached_translation = memory.get(memory_key)
+        if cached_translation is not None:
+            metrics.increment("translation_memory_hits")
+            return cached_translation
+
+    # Instructions on the shape of the text go in a system message, not in the text
+    messages = prompt_template
+    if instructions:
+        messages = [SystemMessage(instructions), HumanMessage(prompt_template)]
     chain = model | parser
-    generation = trace.generation(
-        name="translation",
-        model=model.model_name,
-        model_parameters={
-            "maxTokens": model.max_tokens,
-            "temperature": model.temperature,
-        },
-        input=prompt_template,
+    generation = None
+    if trace is not None:
+        generation = trace.generation(
+            name="translation",
+            model=model.model_name,
+            model_parameters={
+                "maxTokens": model.max_tokens,
+                "temperature": model.temperature,
+            },
+            input=(
+                prompt_template
+                if not instructions
+                else [
+                    {"role": "system", "content": instructions},
+                    {"role": "user", "content": prompt_template},
+                ]
+            ),
+        )
+    # The answer is about as long as the text, count both against the budget
+    estimated_tokens = (
+        estimate_tokens(str(prompt_template))
+        + estimate_tokens(instructions or "")
+        + estimate_tokens(text)
     )
     with get_openai_callback() as cb:
-        translated_text = chain.invoke(prompt_template)
-        generation.end(
-            output=translated_text,
-            usage={
-                "input": cb.prompt_tokens,
-                "output": cb.completion_tokens,
-                "unit": "TOKENS",  # any of: "TOKENS", "CHARACTERS", "MILLISECONDS", "SECONDS", "IMAGES"
-                "total_cost": cb.total_cost,
-            },
+        translated_text = get_scheduler().call(
+            lambda: chain.invoke(messages), estimated_tokens
         )
-    generation.end()
-    return translated_text.strip()
+        if generation is not None:
+            generation.end(
+                output=translated_text,
+                usage={
+                    "input": cb.prompt_tokens,
+                    "output": cb.completion_tokens,
+                    "unit": "TOKENS",  # any of: "TOKENS", "CHARACTERS", "MILLISECONDS", "SECONDS", "IMAGES"
+                    "total_cost": cb.total_cost,
+                },
+            )
+    metrics.increment("translation_requests")
+    metrics.increment("prompt_tokens", cb.prompt_tokens)
+    metrics.increment("completion_tokens", cb.completion_tokens)
+    translated_text = translated_text.strip()
+    if memory is not None:
+        memory.set(memory_key, translated_text)
+    return translated_text
+
+
+def translate_chunks(
+    chunks,
+    model,
+    source_lang="French",
+    target_lang="English",
+    glossary=None,
+    trace=None,
+    memory=None,
+    max_workers=4,
+    on_progress=None,
+    on_segment=None,
+    executor=None,
+    instructions=None,
+):
+    """Translate chunks concurrently and return the results in input order.
+
+    Each chunk goes through `translate_text` on its own. Rate limits and
+    transient errors are retried by the scheduler, request by request, so a
+    chunk failing here fails the document.
+    `on_progress(done, total)` is called every time a chunk completes, and
+    `on_segment(chunk, translated_chunk)` as soon as its translation is known.
+    Chunks run on `executor` when one is given, e.g. to share one concurrency
+    budget between the target languages of a document, else on a pool of
+    `max_workers` threads. `instructions` are sent with every chunk as a
+    system message, e.g. on the format of a batch of segments.
+    """
+    total = len(chunks)
+    done = 0
+    progress_lock = threading.Lock()
+
+    def report_progress():
+        nonlocal done
+        if on_progress is None:
+            return
+        with progress_lock:
+            done += 1
+            on_progress(done, total)
+
+    def translate_chunk(chunk):
+        translated_chunk = translate_text(
+            chunk,
+            model,
+            source_lang=source_lang,
+            target_lang=target_lang,
+            glossary=glossary,
+            trace=trace,
+            memory=memory,
+            instructions=instructions,
+        )
+        if on_segment is not None:
+            on_segment(chunk, translated_chunk)
+        report_progress()
+        return translated_chunk
+
+    if executor is not None:
+        return list(executor.map(translate_chunk, chunks))
+
+    if max_workers <= 1 or len(chunks) <= 1:
+        return [translate_chunk(chunk) for chunk in chunks]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        # executor.map yields results in submission order, i.e. document order
+        return list(executor.map(translate_chunk, chunks))
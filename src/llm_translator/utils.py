@@ -1,19 +1,16 @@
 # type: ignore
-import docx
-from pptx import Presentation
-import openpyxl
-import nltk
-from nltk.translate.meteor_score import meteor_score
-import numpy as np
-
-try:
-    nltk.data.find("corpora/wordnet")
-except LookupError:
-    nltk.download("wordnet")
+# The format libraries are imported by the functions using them, so importing
+# this module stays cheap for workers that never open a given format
+import os
+from .embeddings import get_embedding_service, segment_similarity
+from .meteor import meteor_scores
+from .xlsx_stream import is_translatable_cell, stream_excel_translations
 
 
 # Functions to read and write .docx files
 def read_docx(file_path: str):
+    import docx
+
     doc = docx.Document(file_path)
     full_text = []
     for para in doc.paragraphs:
@@ -23,6 +20,8 @@ def read_docx(file_path: str):
 
 
 def write_docx(text: str, file_path: str):
+    import docx
+
     doc = docx.Document()
     for line in text.split("\n"):
         doc.add_paragraph(line)
@@ -30,6 +29,8 @@ def write_docx(text: str, file_path: str):
 
 
 def read_pptx(file_path: str):
+    from pptx import Presentation
+
     prs = Presentation(file_path)
     slides_content = []
     for slide in prs.slides:
@@ -44,6 +45,8 @@ def read_pptx(file_path: str):
 
 
 def write_pptx(slides_texts: list, file_path: str, template_path: str):
+    from pptx import Presentation
+
     prs = Presentation(template_path)
     for slide_idx, slide in enumerate(prs.slides):
         if slide_idx < len(slides_texts):
@@ -59,39 +62,100 @@ def write_pptx(slides_texts: list, file_path: str, template_path: str):
 
 
 # Functions to read and write Excel (.xlsx) files
+
+# Workbooks larger than this are rewritten part by part in streaming mode, see
+# `stream_excel_translations` (TRANSLATION_XLSX_STREAMING_BYTES in the app)
+XLSX_STREAMING_BYTES = 10 * 1024 * 1024
+
+
 def read_excel(file_path: str):
-    workbook = openpyxl.load_workbook(file_path)
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
     full_text = []
-    for sheet in workbook.sheetnames:
-        ws = workbook[sheet]
-        for row in ws.iter_rows(values_only=True):
-            row_text = [str(cell) if cell is not None else "" for cell in row]
-            full_text.append("\t".join(row_text))
+    try:
+        for ws in workbook.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                row_text = [str(cell) if cell is not None else "" for cell in row]
+                full_text.append("\t".join(row_text))
+    finally:
+        workbook.close()
     return "\n".join(full_text)
 
 
-def write_excel(rows: list, file_path: str):
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    for row in rows:
-        sheet.append(row)
+def write_excel(rows, file_path: str):
+    """Write rows of values to a workbook, one sheet per key when `rows` is a dict."""
+    import openpyxl
+
+    sheets = rows if isinstance(rows, dict) else {"Sheet": rows}
+    workbook = openpyxl.Workbook(write_only=True)
+    for title, sheet_rows in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in sheet_rows:
+            sheet.append(row)
+    workbook.save(file_path)
+
+
+def read_excel_strings(file_path: str):
+    """Return the unique translatable text cells of a workbook, in reading order."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    strings = {}
+    try:
+        for ws in workbook.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                for value in row:
+                    if is_translatable_cell(value):
+                        strings[value] = None
+    finally:
+        workbook.close()
+    return list(strings)
+
+
+def write_excel_translations(
+    translations: dict,
+    file_path: str,
+    template_path: str,
+    streaming_bytes=XLSX_STREAMING_BYTES,
+):
+    """Copy the workbook at `template_path`, replacing the text of translated cells.
+
+    Sheets, formatting and formulas of the original workbook are kept.
+    Workbooks larger than `streaming_bytes` are streamed instead.
+    """
+    import openpyxl
+
+    if os.path.getsize(template_path) > streaming_bytes:
+        return stream_excel_translations(translations, file_path, template_path)
+    workbook = openpyxl.load_workbook(template_path)
+    for ws in workbook.worksheets:
+        for row in ws.iter_rows():
+            for cell in row:
+                if is_translatable_cell(cell.value) and cell.value in translations:
+                    cell.value = translations[cell.value]
     workbook.save(file_path)
 
 
 def calculate_meteor_score(reference_translation: str, predicted_translation: str):
-    return meteor_score([reference_translation.split()], predicted_translation.split())
+    """Corpus METEOR score of a translation, scored paragraph by paragraph.
 
+    See `meteor_scores` for the score of every paragraph.
+    """
+    return meteor_scores(reference_translation, predicted_translation)["score"]
 
-def get_embedding(text, model="text-embedding-3-small"):
-    from openai import OpenAI
 
-    client = OpenAI()
-    text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=model).data[0].embedding
+def get_embedding(text, model="text-embedding-3-small"):
+    return get_embedding_service(model).embed([text])[0]
 
 
-def embedding_similarity(reference_translation: str, predicted_translation: str):
-    A = get_embedding(reference_translation)
-    B = get_embedding(predicted_translation)
+def embedding_similarity(
+    reference_translation: str, predicted_translation: str, service=None
+):
+    """Embedding similarity of two texts, compared paragraph by paragraph.
 
-    return np.dot(A, B) / (np.linalg.norm(A) * np.linalg.norm(B))
+    See `segment_similarity` for the score of every paragraph.
+    """
+    return segment_similarity(reference_translation, predicted_translation, service)[
+        "score"
+    ]
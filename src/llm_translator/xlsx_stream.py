@@ -0,0 +1,140 @@
+# type: ignore
+import re
+import shutil
+import zipfile
+from xml.sax.handler import ContentHandler
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
+from .docx_stream import _parse_part
+
+# Parts of the package holding cell strings: the shared strings and the sheets,
+# whose cells can also have inline strings
+STRING_PART_PATTERN = re.compile(r"^xl/(sharedStrings|worksheets/sheet\d+)\.xml$")
+# Shared string items and inline strings
+STRING_ELEMENTS = ("si", "is")
+
+
+def is_translatable_cell(value):
+    # Only text cells are translated, formulas and numbers stored as text are kept
+    return (
+        isinstance(value, str)
+        and not value.startswith("=")
+        and any(char.isalpha() for char in value)
+    )
+
+
+def _local_name(name):
+    return name.rsplit(":", 1)[-1]
+
+
+class _StringHandler(ContentHandler):
+    """SAX handler re-serializing a part, with its translated strings replaced.
+
+    The nodes of a string (<si> or <is>) are buffered until it ends. Its text
+    is the one of its <t> nodes outside phonetic runs (<rPh>), as openpyxl
+    reads it, and when that text is in `translations` the whole translation
+    goes into its first <t> and the following ones are emptied, like the
+    paragraphs of a .docx. Every other node is written back untouched.
+    """
+
+    def __init__(self, translations, out):
+        super().__init__()
+        self.translations = translations
+        self.writer = XMLGenerator(out, "utf-8", short_empty_elements=True)
+        self.events = None  # Buffered nodes of the open string
+
+    def startDocument(self):
+        self.writer.startDocument()
+
+    def endDocument(self):
+        self.writer.endDocument()
+
+    def startElement(self, name, attrs):
+        if self.events is None and _local_name(name) in STRING_ELEMENTS:
+            self.events = []
+        if self.events is None:
+            self.writer.startElement(name, attrs)
+        else:
+            self.events.append(("start", name, AttributesImpl(dict(attrs))))
+
+    def endElement(self, name):
+        if self.events is None:
+            self.writer.endElement(name)
+            return
+        self.events.append(("end", name, None))
+        if _local_name(name) in STRING_ELEMENTS:
+            events, self.events = self.events, None
+            self._write_string(events)
+
+    def characters(self, content):
+        if self.events is None:
+            self.writer.characters(content)
+        else:
+            self.events.append(("text", content, None))
+
+    def ignorableWhitespace(self, whitespace):
+        self.characters(whitespace)
+
+    def processingInstruction(self, target, data):
+        self.writer.processingInstruction(target, data)
+
+    @staticmethod
+    def _text_nodes(events):
+        # Yield every event with whether it is inside a <t> read as the string's text
+        in_text = False
+        phonetic = 0
+        for kind, value, attrs in events:
+            name = _local_name(value) if kind != "text" else None
+            if kind == "start" and name == "rPh":
+                phonetic += 1
+            elif kind == "end" and name == "rPh":
+                phonetic -= 1
+            elif name == "t" and not phonetic:
+                in_text = kind == "start"
+            yield kind, value, attrs, in_text
+
+    def _write_string(self, events):
+        text = "".join(
+            value
+            for kind, value, _, in_text in self._text_nodes(events)
+            if kind == "text" and in_text
+        )
+        translation = None
+        if is_translatable_cell(text):
+            translation = self.translations.get(text)
+        written = False
+        for kind, value, attrs, in_text in self._text_nodes(events):
+            if kind == "start":
+                if in_text and translation is not None:
+                    attrs = AttributesImpl({**attrs, "xml:space": "preserve"})
+                    self.writer.startElement(value, attrs)
+                    if not written:
+                        self.writer.characters(translation)
+                        written = True
+                else:
+                    self.writer.startElement(value, attrs)
+            elif kind == "end":
+                self.writer.endElement(value)
+            elif not in_text or translation is None:
+                self.writer.characters(value)
+
+
+def stream_excel_translations(translations: dict, file_path: str, template_path: str):
+    """Write a copy of a workbook with its translated text cells, without loading it.
+
+    `translations` maps cell texts to their translation. The shared strings
+    and the sheets are streamed node by node and only their strings change,
+    every other part of the package (styles, column widths, merged cells,
+    charts, images...) is copied from the original, so memory use does not
+    grow with the size of the workbook.
+    """
+    with zipfile.ZipFile(template_path) as source, zipfile.ZipFile(
+        file_path, "w", zipfile.ZIP_DEFLATED
+    ) as target:
+        for info in source.infolist():
+            with source.open(info) as stream, target.open(info, "w") as out:
+                if STRING_PART_PATTERN.match(info.filename):
+                    for _ in _parse_part(stream, _StringHandler(translations, out)):
+                        pass
+                else:
+                    shutil.copyfileobj(stream, out)
@@ -0,0 +1,13 @@
+# type: ignore
+from django.apps import AppConfig
+
+
+class TranslatingAppConfig(AppConfig):
+    name = "translating_app"
+
+    def ready(self):
+        from src.llm_translator.scheduler import set_scheduler_factory
+        from .utils import make_request_scheduler
+
+        # Model requests of every job are paced with the budgets of the settings
+        set_scheduler_factory(make_request_scheduler)
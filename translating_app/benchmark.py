@@ -0,0 +1,292 @@
+# type: ignore
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+import docx
+from openpyxl import Workbook
+from pptx import Presentation
+from pptx.util import Inches
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, override_settings
+from django.urls import reverse
+from src.llm_translator.metrics import metrics
+from src.llm_translator.models import FakeTranslationModel, get_model, register_backend
+from .jobs import get_job_queue, DONE, FAILED
+from .utils import (
+    evaluate_translation,
+    process_document_file,
+    write_translated_document,
+)
+
+SAMPLE_SENTENCES = [
+    "Le présent contrat prend effet à la date de sa signature par les deux parties.",
+    "Les informations contenues dans ce document sont strictement confidentielles.",
+    "Le chiffre d'affaires du trimestre a progressé de douze pour cent.",
+    "Toute modification doit faire l'objet d'un avenant écrit.",
+    "Les résultats seront présentés lors de la prochaine réunion du comité.",
+    "Le fournisseur s'engage à livrer les marchandises dans un délai de trente jours.",
+]
+
+STAGES = ("parse", "segment", "translate", "write", "evaluate")
+
+# Only imported when a request needs them, never when a worker starts
+LAZY_MODULES = (
+    "docx",
+    "pptx",
+    "openpyxl",
+    "nltk",
+    "numpy",
+    "langfuse",
+    "langchain_community",
+)
+
+# Run in a fresh interpreter, so nothing is imported yet
+STARTUP_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "translating_app.settings")
+import django
+django.setup()
+import translating_app.urls
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+
+def sample_text(index, sentences=3):
+    return " ".join(
+        SAMPLE_SENTENCES[(index + offset) % len(SAMPLE_SENTENCES)]
+        for offset in range(sentences)
+    )
+
+
+def make_docx(file_path, size):
+    """Write a .docx file with `size` paragraphs, a table and a header."""
+    doc = docx.Document()
+    doc.sections[0].header.paragraphs[0].text = "Document confidentiel"
+    for index in range(size):
+        doc.add_paragraph(sample_text(index))
+    table = doc.add_table(rows=max(1, size // 10), cols=2)
+    for index, row in enumerate(table.rows):
+        row.cells[0].text = f"Article {index + 1}"
+        row.cells[1].text = sample_text(index, sentences=1)
+    doc.save(file_path)
+
+
+def make_pptx(file_path, size):
+    """Write a .pptx deck with `size` slides of a title, bullets and a label."""
+    prs = Presentation()
+    for index in range(size):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = f"Diapositive {index + 1}"
+        slide.placeholders[1].text = "\n".join(
+            SAMPLE_SENTENCES[(index + offset) % len(SAMPLE_SENTENCES)]
+            for offset in range(3)
+        )
+        label = slide.shapes.add_textbox(Inches(1), Inches(6.5), Inches(4), Inches(0.5))
+        label.text = "Confidentiel"
+    prs.save(file_path)
+
+
+def make_xlsx(file_path, size):
+    """Write a workbook with `size` rows of repeated labels, text and numbers."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Catégorie", "Description", "Montant", "Statut"])
+    for index in range(size):
+        ws.append(
+            [
+                f"Catégorie {index % 5}",
+                sample_text(index, sentences=1),
+                index * 10.5,
+                "Validé" if index % 2 else "En attente",
+            ]
+        )
+    ws.append(["Total", None, f"=SUM(C2:C{size + 1})", None])
+    wb.save(file_path)
+
+
+GENERATORS = {".docx": make_docx, ".pptx": make_pptx, ".xlsx": make_xlsx}
+
+
+def _fake_model_spec(latency):
+    # A new model name per run, so the call counters of each run start at zero
+    register_backend(
+        "benchmark",
+        lambda name, **options: FakeTranslationModel(model_name=name, latency=latency),
+    )
+    return f"benchmark:{uuid.uuid4().hex}"
+
+
+def _measure(run):
+    metrics.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        run()
+    finally:
+        wall_seconds = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    return {
+        "wall_seconds": wall_seconds,
+        "calls": int(counters.get("translation_requests", 0)),
+        "prompt_tokens": int(counters.get("prompt_tokens", 0)),
+        "completion_tokens": int(counters.get("completion_tokens", 0)),
+        "rate_limited": int(counters.get("rate_limited", 0)),
+        "rate_limit_wait_seconds": snapshot["timers"]
+        .get("rate_limit_wait", {})
+        .get("total", 0.0),
+        "peak_memory_bytes": peak_memory,
+        "stages": {
+            stage: snapshot["timers"].get(stage, {}).get("total", 0.0)
+            for stage in STAGES
+        },
+    }
+
+
+def benchmark_functions(input_path, output_path, model_spec):
+    """Run a document through `process_document_file` and its writer."""
+    model = get_model(model_spec)
+
+    def run():
+        results = process_document_file(
+            input_path, model, None, "French", ["English"], None
+        )
+        translated_content, original_input, translated_output_text = results["English"]
+        with metrics.stage("write"):
+            write_translated_document(translated_content, output_path, input_path)
+        with metrics.stage("evaluate"):
+            evaluate_translation(
+                "no_evaluation",
+                original_input,
+                translated_output_text,
+                "French",
+                "English",
+                model,
+                None,
+            )
+
+    return _measure(run)
+
+
+def benchmark_view(input_path, model_spec, timeout=600):
+    """Upload a document through upload_and_translate and wait for its job."""
+    client = Client()
+
+    def run():
+        with open(input_path, "rb") as input_file:
+            uploaded_file = SimpleUploadedFile(
+                os.path.basename(input_path), input_file.read()
+            )
+        response = client.post(
+            reverse("upload_and_translate"),
+            {
+                "document": uploaded_file,
+                "source_language": "French",
+                "target_language": "English",
+                "evaluation_method": "no_evaluation",
+            },
+            HTTP_ACCEPT="application/json",
+        )
+        job_id = response.json()["job_id"]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = get_job_queue().get(job_id)
+            if job["status"] == DONE:
+                return
+            if job["status"] == FAILED:
+                raise RuntimeError(f"Benchmark job failed: {job['error']}")
+            time.sleep(0.01)
+        raise TimeoutError(f"Benchmark job {job_id} did not finish in time")
+
+    # The test client sends its requests to the "testserver" host
+    with override_settings(
+        TRANSLATION_MODEL=model_spec,
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+    ):
+        return _measure(run)
+
+
+def measure_startup(runs=3):
+    """Time the import of the application by a new worker process.
+
+    Returns the fastest of `runs` imports and the modules of `LAZY_MODULES`
+    which were loaded by it, which should be none.
+    """
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=root_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+
+    loaded = set(result["modules"])
+    return {
+        "import_seconds": min(timings),
+        "runs": timings,
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in loaded],
+    }
+
+
+def run_benchmarks(
+    work_dir, formats=("docx", "pptx", "xlsx"), size=50, latency=0.0, runs=1, view=False
+):
+    """Benchmark every format against the fake model and return a JSON-able report.
+
+    Each result holds the wall time, model calls, tokens sent, peak memory and
+    the time spent in each stage of the pipeline.
+    """
+    results = []
+    # The translation memory would turn every run after the first into cache hits
+    with override_settings(TRANSLATION_MEMORY_ENABLED=False, MEDIA_ROOT=str(work_dir)):
+        for file_format in formats:
+            extension = f".{file_format}"
+            input_path = os.path.join(work_dir, f"benchmark_{size}{extension}")
+            GENERATORS[extension](input_path, size)
+            modes = ["functions", "view"] if view else ["functions"]
+            for mode in modes:
+                for run in range(runs):
+                    model_spec = _fake_model_spec(latency)
+                    if mode == "functions":
+                        output_path = os.path.join(work_dir, f"translated{extension}")
+                        result = benchmark_functions(
+                            input_path, output_path, model_spec
+                        )
+                    else:
+                        # The view deletes its upload, the generated file is kept
+                        result = benchmark_view(input_path, model_spec)
+                    results.append(
+                        {
+                            "format": file_format,
+                            "mode": mode,
+                            "size": size,
+                            "latency": latency,
+                            "run": run,
+                            "input_bytes": os.path.getsize(input_path),
+                            **result,
+                        }
+                    )
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
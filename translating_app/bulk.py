@@ -0,0 +1,284 @@
+# type: ignore
+import json
+import logging
+import multiprocessing
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from src.llm_translator.documents import (
+    DOCUMENT_EXTENSIONS,
+    build_translated_content,
+    parse_document,
+    write_document,
+)
+from src.llm_translator.glossary import GlossaryIndex
+from src.llm_translator.metrics import metrics
+from src.llm_translator.tracing import start_trace
+from src.llm_translator.translator import initialize_model
+from .utils import translate_texts
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+READ_BLOCK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_document_pool():
+    """Return the process pool parsing and writing the documents of bulk jobs."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Processes are spawned, forking a threaded web worker is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.TRANSLATION_BULK_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _run_in_pool(function, *args):
+    global _pool
+    try:
+        return get_document_pool().submit(function, *args).result()
+    except BrokenProcessPool:
+        # A crashed worker takes the pool down, the next call starts a new one
+        logger.exception(
+            "Document process pool failed, running %s here.", function.__name__
+        )
+        with _pool_lock:
+            _pool = None
+        return function(*args)
+
+
+def extract_archive(archive_path, directory):
+    """Extract the documents of a zip archive into `directory`.
+
+    Returns the (name, path) of every supported document and the names of
+    the other files, which are skipped. Entries with absolute or parent
+    paths are refused, and so are entries extracted to the same path as an
+    earlier one and archives larger than TRANSLATION_BULK_MAX_BYTES once
+    uncompressed.
+    """
+    documents = []
+    skipped = []
+    # Case-folded, as "a.docx" and "A.docx" are one file on some file systems
+    extracted = set()
+    with zipfile.ZipFile(archive_path) as archive:
+        entries = [info for info in archive.infolist() if not info.is_dir()]
+        if (
+            sum(info.file_size for info in entries)
+            > settings.TRANSLATION_BULK_MAX_BYTES
+        ):
+            raise ValueError("Archive is too large once uncompressed")
+        for info in entries:
+            name = posixpath.normpath(info.filename.replace("\\", "/"))
+            base_name = posixpath.basename(name)
+            # macOS resource forks and hidden files are not documents
+            if name.startswith("__MACOSX/") or base_name.startswith("."):
+                continue
+            if name.startswith(("/", "../")) or name == "..":
+                raise ValueError(f"Unsafe path in archive: {info.filename}")
+            if posixpath.splitext(name)[1].lower() not in DOCUMENT_EXTENSIONS:
+                skipped.append(name)
+                continue
+            if name.casefold() in extracted:
+                raise ValueError(f"Duplicate path in archive: {info.filename}")
+            extracted.add(name.casefold())
+            path = os.path.join(directory, *name.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.open(info) as source, open(path, "wb") as target:
+                for block in iter(lambda: source.read(READ_BLOCK_SIZE), b""):
+                    target.write(block)
+            documents.append((name, path))
+    return documents, skipped
+
+
+def run_bulk_pipeline(params, progress=None, on_segment=None):
+    """Translate every document of an uploaded zip archive.
+
+    Documents are parsed and written on a process pool, while their texts are
+    translated by threads of this process that share one pool of
+    TRANSLATION_MAX_CONCURRENCY requests. A failing document is reported in
+    the manifest and does not stop the others. The translated documents and
+    the manifest are kept in `params["output_dir"]`, served as one zip by
+    `bulk_archive`.
+    """
+    archive_path = default_storage.path(params["input_path"])
+    output_dir = os.path.join(settings.MEDIA_ROOT, params["output_dir"])
+    source_lang = params["source_lang"]
+    target_lang = params["target_lang"]
+    glossary = GlossaryIndex(params["glossary"]) if params.get("glossary") else None
+    progress_lock = threading.Lock()
+    file_progress = {}
+
+    def document_progress(name):
+        if progress is None:
+            return None
+
+        def report(done, total):
+            with progress_lock:
+                file_progress[name] = (done, total)
+                progress(
+                    sum(done for done, _ in file_progress.values()),
+                    sum(total for _, total in file_progress.values()),
+                )
+
+        return report
+
+    try:
+        model = initialize_model(settings.TRANSLATION_MODEL)
+        trace = start_trace(
+            "AI Document Translator (bulk)",
+            sample_rate=settings.TRANSLATION_TRACE_SAMPLE_RATE,
+        )
+        metrics.increment("input_bytes", os.path.getsize(archive_path))
+
+        with tempfile.TemporaryDirectory() as input_dir, ThreadPoolExecutor(
+            max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+            thread_name_prefix="translation",
+        ) as executor, ThreadPoolExecutor(
+            max_workers=settings.TRANSLATION_BULK_DOCUMENTS,
+            thread_name_prefix="bulk-document",
+        ) as document_workers:
+            documents, skipped = extract_archive(archive_path, input_dir)
+
+            def translate_document(name, input_path):
+                try:
+                    with metrics.stage("parse"):
+                        layout, texts = _run_in_pool(parse_document, input_path)
+                    translated_texts = translate_texts(
+                        texts,
+                        model,
+                        glossary,
+                        source_lang,
+                        target_lang,
+                        trace,
+                        document_progress(name),
+                        None,
+                        executor,
+                    )
+                    translated_content = build_translated_content(
+                        input_path, layout, texts, translated_texts
+                    )
+                    output_path = os.path.join(output_dir, *name.split("/"))
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    with metrics.stage("write"):
+                        size = _run_in_pool(
+                            write_document,
+                            translated_content,
+                            output_path,
+                            input_path,
+                            settings.TRANSLATION_XLSX_STREAMING_BYTES,
+                        )
+                    metrics.increment("output_bytes", size)
+                except Exception as e:
+                    logger.exception("Bulk document %s failed.", name)
+                    return {"name": name, "status": "failed", "error": str(e)}
+                return {
+                    "name": name,
+                    "status": "done",
+                    "segments": len(texts),
+                    "bytes": size,
+                }
+
+            manifest = list(
+                document_workers.map(
+                    lambda document: translate_document(*document), documents
+                )
+            )
+        manifest += [
+            {"name": name, "status": "skipped", "error": "Unsupported file format"}
+            for name in skipped
+        ]
+        with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "source_lang": source_lang,
+                    "target_lang": target_lang,
+                    "files": manifest,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+    except Exception:
+        # Partial outputs are dropped, the archive is kept to retry the job
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+    default_storage.delete(params["input_path"])
+
+    statuses = [entry["status"] for entry in manifest]
+    return {
+        "result_url": reverse("bulk_archive", args=[os.path.basename(output_dir)]),
+        "score": None,
+        "report": {
+            "files": manifest,
+            "translated_files": statuses.count("done"),
+            "failed_files": statuses.count("failed"),
+            "skipped_files": statuses.count("skipped"),
+        },
+    }
+
+
+class _ZipStream:
+    """Write-only file object buffering what `zipfile` writes, to stream it out."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_archive(output_dir):
+    """Yield a zip of the translated documents and manifest of a bulk job.
+
+    The archive is built while it is sent, one block at a time, so it is
+    never held in memory or written to disk. Documents are already zip
+    packages and are stored without compressing them again.
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as archive:
+        archive.writestr(
+            MANIFEST_NAME,
+            json.dumps(manifest, ensure_ascii=False, indent=2),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+        yield stream.pop()
+        for entry in manifest["files"]:
+            if entry["status"] != "done":
+                continue
+            path = os.path.join(output_dir, *entry["name"].split("/"))
+            with open(path, "rb") as source, archive.open(entry["name"], "w") as target:
+                for block in iter(lambda: source.read(READ_BLOCK_SIZE), b""):
+                    target.write(block)
+                    yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,393 @@
+# type: ignore
+import abc
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Longest pause of a job worker after its database failed, in seconds
+MAX_WORKER_BACKOFF = 30
+
+JOB_FIELDS = (
+    "id",
+    "status",
+    "chunks_done",
+    "chunks_total",
+    "result_url",
+    "score",
+    "error",
+    "report",
+)
+
+
+class BaseJobQueue(abc.ABC):
+    """Runs translation jobs on a pool of local workers and tracks their status.
+
+    Subclasses only decide where jobs and their status are stored. `handler` is
+    called as `handler(params, progress, on_segment)` and returns the fields
+    stored on the job once it is done (e.g. `result_url`, `score` and a
+    `report` dict of details about the translation). The
+    segments passed to `on_segment(source, translation)` are kept on the job
+    so the browser can preview the translation while it is running.
+    """
+
+    def __init__(self, handler, workers=2):
+        self.handler = handler
+        self.workers = workers
+
+    @classmethod
+    def from_settings(cls, handler):
+        return cls(handler, workers=settings.TRANSLATION_JOB_WORKERS)
+
+    @abc.abstractmethod
+    def submit(self, params):
+        """Queue a job and return its ID."""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """Return the fields of a job, or None when it is unknown."""
+
+    @abc.abstractmethod
+    def update(self, job_id, **fields):
+        """Set fields of a job, and touch its update time."""
+
+    @abc.abstractmethod
+    def add_segment(self, job_id, source, translation):
+        """Keep a translated segment of a running job."""
+
+    @abc.abstractmethod
+    def get_segments(self, job_id, after=0):
+        """Return the translated segments of a job with an ID above `after`."""
+
+    @abc.abstractmethod
+    def retry(self, job_id):
+        """Queue a failed job again, returning False when it has not failed."""
+
+    def run(self, job_id, params):
+        self.update(job_id, status=RUNNING)
+        # The handler checkpoints its work under the job ID, to resume a retried job
+        params = {**params, "job_id": job_id}
+
+        def progress(done, total):
+            self.update(job_id, chunks_done=done, chunks_total=total)
+
+        def on_segment(source, translation):
+            self.add_segment(job_id, source, translation)
+
+        try:
+            result = self.handler(params, progress, on_segment)
+        except Exception as e:
+            logger.exception("Translation job %s failed.", job_id)
+            self.update(job_id, status=FAILED, error=str(e))
+        else:
+            self.update(job_id, status=DONE, **(result or {}))
+
+
+class InProcessJobQueue(BaseJobQueue):
+    """Keeps jobs in memory and runs them on a thread pool of this process."""
+
+    def __init__(self, handler, workers=2):
+        super().__init__(handler, workers)
+        self._jobs = {}
+        self._params = {}
+        self._segments = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="translation-job"
+        )
+
+    def submit(self, params):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": QUEUED,
+                "chunks_done": 0,
+                "chunks_total": None,
+                "result_url": None,
+                "score": None,
+                "error": None,
+                "report": None,
+            }
+            self._params[job_id] = params
+        self._executor.submit(self.run, job_id, params)
+        return job_id
+
+    def retry(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != FAILED:
+                return False
+            job.update(status=QUEUED, error=None, chunks_done=0)
+            self._segments.pop(job_id, None)
+        self._executor.submit(self.run, job_id, self._params[job_id])
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def add_segment(self, job_id, source, translation):
+        with self._lock:
+            segments = self._segments.setdefault(job_id, [])
+            segments.append(
+                {"id": len(segments) + 1, "source": source, "translation": translation}
+            )
+
+    def get_segments(self, job_id, after=0):
+        with self._lock:
+            return list(self._segments.get(job_id, [])[after:])
+
+
+class SQLiteJobQueue(BaseJobQueue):
+    """Stores jobs in a SQLite file so every worker process of a node shares them.
+
+    Each process runs its own pool of worker threads which claim queued jobs
+    from the table, so a job can be picked up by any process and its status
+    read from any other.
+    """
+
+    def __init__(self, handler, path, workers=2, poll_interval=0.5, stale_after=300):
+        super().__init__(handler, workers)
+        self.path = str(path)
+        self.poll_interval = poll_interval
+        # Running jobs touch their row at least every third of this delay
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translation_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    chunks_done INTEGER NOT NULL DEFAULT 0,
+                    chunks_total INTEGER,
+                    result_url TEXT,
+                    score REAL,
+                    error TEXT,
+                    report TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # Tables created before the report column was added
+            columns = [
+                row[1] for row in conn.execute("PRAGMA table_info(translation_jobs)")
+            ]
+            if "report" not in columns:
+                conn.execute("ALTER TABLE translation_jobs ADD COLUMN report TEXT")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translation_job_segments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    translation TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS translation_job_segments_job "
+                "ON translation_job_segments (job_id, id)"
+            )
+
+    @classmethod
+    def from_settings(cls, handler):
+        queue = cls(
+            handler,
+            settings.TRANSLATION_JOB_DB_PATH,
+            workers=settings.TRANSLATION_JOB_WORKERS,
+            stale_after=settings.TRANSLATION_JOB_STALE_SECONDS,
+        )
+        # Jobs left queued or running by a previous process are picked up
+        # without waiting for the next upload
+        queue._start_workers()
+        return queue
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _start_workers(self):
+        with self._threads_lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"translation-job-{len(self._threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _claim(self):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Running jobs whose worker died are claimed again, they resume
+            # from their checkpoints
+            row = conn.execute(
+                "SELECT id, params FROM translation_jobs "
+                "WHERE status = ? OR (status = ? AND updated_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, time.time() - self.stale_after),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE translation_jobs SET status = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (RUNNING, time.time(), row[0]),
+                )
+            conn.commit()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def run(self, job_id, params):
+        # Keep the job from looking stale while it runs
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self.stale_after / 3):
+                self.update(job_id)
+
+        thread = threading.Thread(
+            target=heartbeat, name=f"heartbeat-{job_id}", daemon=True
+        )
+        thread.start()
+        try:
+            super().run(job_id, params)
+        finally:
+            stopped.set()
+
+    def _work(self):
+        failures = 0
+        while True:
+            try:
+                claimed = self._claim()
+                failures = 0
+                if claimed is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self.run(*claimed)
+            except Exception:
+                # A locked or unreadable database must not stop the worker for good
+                logger.exception("Translation job worker failed, retrying.")
+                failures += 1
+                time.sleep(min(self.poll_interval * 2**failures, MAX_WORKER_BACKOFF))
+
+    def submit(self, params):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO translation_jobs "
+                "(id, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), now, now),
+            )
+        self._start_workers()
+        self._wakeup.set()
+        return job_id
+
+    def retry(self, job_id):
+        with contextlib.closing(self._connect()) as conn, conn:
+            retried = conn.execute(
+                "UPDATE translation_jobs "
+                "SET status = ?, error = NULL, chunks_done = 0, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, FAILED),
+            ).rowcount
+            if retried:
+                conn.execute(
+                    "DELETE FROM translation_job_segments WHERE job_id = ?", (job_id,)
+                )
+        if retried:
+            self._start_workers()
+            self._wakeup.set()
+        return bool(retried)
+
+    def get(self, job_id):
+        with contextlib.closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM translation_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["report"] = json.loads(job["report"]) if job["report"] else None
+        return job
+
+    def update(self, job_id, **fields):
+        if "report" in fields:
+            fields["report"] = json.dumps(fields["report"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"UPDATE translation_jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+
+    def add_segment(self, job_id, source, translation):
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO translation_job_segments (job_id, source, translation) "
+                "VALUES (?, ?, ?)",
+                (job_id, source, translation),
+            )
+
+    def get_segments(self, job_id, after=0):
+        # Segment IDs are shared by all jobs, they only grow within a job
+        with contextlib.closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT id, source, translation FROM translation_job_segments "
+                "WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after),
+            ).fetchall()
+        return [{"id": row[0], "source": row[1], "translation": row[2]} for row in rows]
+
+
+JOB_BACKENDS = {
+    "inprocess": InProcessJobQueue,
+    "sqlite": SQLiteJobQueue,
+}
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the job queue configured by `TRANSLATION_JOB_BACKEND`.
+
+    The setting is either one of the built-in backends or the dotted path of a
+    `BaseJobQueue` subclass.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            from .pipeline import run_job
+
+            backend = settings.TRANSLATION_JOB_BACKEND
+            queue_class = JOB_BACKENDS.get(backend) or import_string(backend)
+            _job_queue = queue_class.from_settings(run_job)
+    return _job_queue
@@ -0,0 +1,63 @@
+# type: ignore
+import json
+import tempfile
+from django.core.management.base import BaseCommand
+from translating_app.benchmark import measure_startup, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the translation pipeline on synthetic documents against a "
+        "local fake model, and print the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--formats",
+            nargs="+",
+            default=["docx", "pptx", "xlsx"],
+            choices=["docx", "pptx", "xlsx"],
+        )
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=50,
+            help="Paragraphs, slides or rows of each generated document.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds the fake model waits before answering each request.",
+        )
+        parser.add_argument("--runs", type=int, default=1)
+        parser.add_argument(
+            "--view",
+            action="store_true",
+            help="Also run every document through the upload_and_translate view.",
+        )
+        parser.add_argument(
+            "--startup",
+            action="store_true",
+            help="Also time the import of the application by a new worker.",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run_benchmarks(
+                work_dir,
+                formats=options["formats"],
+                size=options["size"],
+                latency=options["latency"],
+                runs=options["runs"],
+                view=options["view"],
+            )
+        if options["startup"]:
+            report["startup"] = measure_startup(runs=max(options["runs"], 3))
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(report, output_file, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,65 @@
+# type: ignore
+import json
+from django.core.management.base import BaseCommand, CommandError
+from translating_app.offline import translate_tree
+
+
+class Command(BaseCommand):
+    help = (
+        "Translate every .docx, .pptx and .xlsx document of a directory tree. "
+        "Run it again with the same arguments to resume an interrupted run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input_dir")
+        parser.add_argument("output_dir")
+        parser.add_argument("--source", default="French", help="Source language.")
+        parser.add_argument(
+            "--target",
+            nargs="+",
+            default=["English"],
+            help="Target languages, each written to output_dir/<language>/.",
+        )
+        parser.add_argument("--glossary", help="JSON file of {term: translation}.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Documents translated at the same time.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Model requests in flight per document "
+            "(default: TRANSLATION_MAX_CONCURRENCY).",
+        )
+        parser.add_argument(
+            "--manifest",
+            help="SQLite manifest of the run (default: in output_dir).",
+        )
+
+    def handle(self, *args, **options):
+        glossary = None
+        if options["glossary"]:
+            with open(options["glossary"], encoding="utf-8") as glossary_file:
+                glossary = json.load(glossary_file)
+
+        counts = translate_tree(
+            options["input_dir"],
+            options["output_dir"],
+            options["source"],
+            options["target"],
+            glossary=glossary,
+            workers=options["workers"],
+            concurrency=options["concurrency"],
+            manifest_path=options["manifest"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            f"{counts['done']} translated, {counts['skipped']} already done, "
+            f"{counts['failed']} failed."
+        )
+        if counts["failed"]:
+            raise CommandError(
+                "Some documents failed, run the command again to retry them."
+            )
@@ -0,0 +1,145 @@
+# type: ignore
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from src.llm_translator.documents import DOCUMENT_EXTENSIONS
+from src.llm_translator.glossary import GlossaryIndex
+from src.llm_translator.manifest import DONE, FAILED, TranslationManifest, file_digest
+from src.llm_translator.revisions import DocumentRevision
+from src.llm_translator.translator import initialize_model
+from .utils import process_document_file, write_translated_document
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "translation_manifest.sqlite3"
+
+
+def find_documents(input_dir):
+    """Return the relative paths of the supported documents under `input_dir`."""
+    names = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for file_name in sorted(files):
+            extension = os.path.splitext(file_name)[1].lower()
+            # "~$" files are the lock files of open Office documents
+            if extension in DOCUMENT_EXTENSIONS and not file_name.startswith(
+                ("~$", ".")
+            ):
+                names.append(os.path.relpath(os.path.join(root, file_name), input_dir))
+    return names
+
+
+def translate_tree(
+    input_dir,
+    output_dir,
+    source_lang,
+    target_langs,
+    glossary=None,
+    workers=4,
+    concurrency=None,
+    manifest_path=None,
+    log=None,
+):
+    """Translate every document under `input_dir` into `output_dir/<language>/`.
+
+    Documents are translated `workers` at a time with the same
+    `process_document_file` as the web app, into every target language
+    after one parse, each with `concurrency` model requests in flight
+    (TRANSLATION_MAX_CONCURRENCY by default). A `TranslationManifest`, in
+    `output_dir` by default, records every translated segment and finished
+    file, so running the same command again after an interruption skips the
+    files already done and only sends the missing segments to the model.
+    Returns the count of files done, skipped and failed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = TranslationManifest(
+        manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    )
+    glossary = GlossaryIndex(glossary) if glossary else None
+    model = initialize_model(settings.TRANSLATION_MODEL)
+    log = log or logger.info
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+
+    def translate_document(name):
+        input_path = os.path.join(input_dir, name)
+        digest = file_digest(input_path)
+        contexts = {
+            lang: manifest.make_context(source_lang, lang, glossary)
+            for lang in target_langs
+        }
+        pending = [
+            lang
+            for lang in target_langs
+            if not manifest.is_done(name, contexts[lang], digest)
+        ]
+        if not pending:
+            log(f"skipped  {name}")
+            return {"skipped": len(target_langs)}
+
+        revisions = {
+            lang: DocumentRevision(manifest, name, source_lang, lang, glossary)
+            for lang in pending
+        }
+        on_segment = {
+            lang: functools.partial(manifest.add_segment, name, contexts[lang])
+            for lang in pending
+        }
+        try:
+            with ThreadPoolExecutor(
+                max_workers=concurrency or settings.TRANSLATION_MAX_CONCURRENCY,
+                thread_name_prefix="translation",
+            ) as executor:
+                results = process_document_file(
+                    input_path,
+                    model,
+                    glossary,
+                    source_lang,
+                    pending,
+                    None,
+                    on_segment=on_segment,
+                    revision=revisions,
+                    executor=executor,
+                )
+        except Exception as e:
+            logger.exception("Translation of %s failed.", name)
+            for lang in pending:
+                manifest.finish(name, contexts[lang], digest, FAILED, error=str(e))
+            log(f"failed   {name}: {e}")
+            return {"failed": len(pending), "skipped": len(target_langs) - len(pending)}
+
+        outcome = {"done": 0, "failed": 0, "skipped": len(target_langs) - len(pending)}
+        for lang in pending:
+            output_path = os.path.join(output_dir, lang, name)
+            try:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                write_translated_document(results[lang][0], output_path, input_path)
+            except Exception as e:
+                logger.exception("Writing %s failed.", output_path)
+                manifest.finish(name, contexts[lang], digest, FAILED, error=str(e))
+                outcome["failed"] += 1
+                continue
+            stats = revisions[lang].stats()
+            manifest.finish(
+                name,
+                contexts[lang],
+                digest,
+                DONE,
+                output_path=output_path,
+                segments=stats["reused_segments"] + stats["translated_segments"],
+            )
+            outcome["done"] += 1
+        log(f"done     {name} ({', '.join(pending)})")
+        return outcome
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="document"
+        ) as executor:
+            for outcome in executor.map(translate_document, find_documents(input_dir)):
+                for key, value in outcome.items():
+                    counts[key] += value
+    finally:
+        manifest.close()
+    return counts
@@ -0,0 +1,307 @@
+# type: ignore
+import functools
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from src.llm_translator.glossary import GlossaryIndex
+from src.llm_translator.manifest import file_digest
+from src.llm_translator.revisions import DocumentRevision
+from src.llm_translator.metrics import metrics
+from src.llm_translator.tracing import start_trace
+from src.llm_translator.translator import initialize_model
+from src.llm_translator.documents import DOCUMENT_EXTENSIONS
+from src.llm_translator.utils import read_docx, read_pptx, read_excel
+from .bulk import run_bulk_pipeline
+from .utils import (
+    BackTranslator,
+    get_checkpoint_store,
+    get_output_store,
+    get_revision_store,
+    process_document_file,
+    evaluate_translation,
+    write_translated_document,
+    output_key,
+)
+
+
+def read_reference_content(file_path):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == ".docx":
+        return read_docx(file_path)
+    elif file_extension == ".pptx":
+        slides_content = read_pptx(file_path)
+        reference_texts = [text for slide in slides_content for _, text in slide]
+        return "\n".join(reference_texts)
+    elif file_extension == ".xlsx":
+        return read_excel(file_path)
+    raise ValueError("Unsupported reference file format")
+
+
+def _call_all(callbacks, source, translation):
+    for callback in callbacks:
+        callback(source, translation)
+
+
+def _chain_callbacks(*callbacks):
+    callbacks = [callback for callback in callbacks if callback is not None]
+    return functools.partial(_call_all, callbacks) if callbacks else None
+
+
+def zip_outputs(outputs, zip_path):
+    """Bundle the (path, name) translated files of a document into one zip archive."""
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, name in outputs:
+            archive.write(path, name)
+
+
+def run_translation_pipeline(params, progress=None, on_segment=None):
+    """Parse, translate, write and evaluate an uploaded document.
+
+    `params` holds the storage names of the uploaded files and the form options
+    saved by `upload_and_translate`. `progress(done, total)` and
+    `on_segment(source, translation)` report the translation as it goes.
+    Returns the fields stored on the job.
+
+    The document is parsed once and translated into every language of
+    `params["target_langs"]` at once, one output file per language
+    (zipped together when `params["output"]` is "zip"). With more than one
+    language, the result of every language is in `report["targets"]` and
+    the preview follows the first language.
+
+    Every translated segment is checkpointed under `params["job_id"]`: when
+    a failed or interrupted job runs again, the segments it already
+    translated are not sent to the model again. The checkpoints, and the
+    uploaded files, are deleted once the job succeeds.
+
+    Output files are kept in the output store under a key of the input and
+    options (see `output_key`), and the result of the job under
+    `params["cache_key"]` when given, so the same upload is not translated
+    twice.
+    """
+    input_path = default_storage.path(params["input_path"])
+    file_name = params["file_name"]
+    source_lang = params["source_lang"]
+    target_langs = params["target_langs"]
+    multiple_targets = len(target_langs) > 1
+    # Compiled once, each request only carries the terms found in its text
+    glossary = GlossaryIndex(params["glossary"]) if params.get("glossary") else None
+    evaluation_method = params["evaluation_method"]
+    file_extension = os.path.splitext(file_name)[1].lower()
+    back_translators = {}
+    # One pool of model requests for the forward pass and the back-translation
+    executor = ThreadPoolExecutor(
+        max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+        thread_name_prefix="translation",
+    )
+
+    try:
+        if file_extension not in DOCUMENT_EXTENSIONS:
+            raise ValueError("Unsupported file format")
+
+        # Initialize model, its requests paced by the worker's shared budgets
+        model = initialize_model(settings.TRANSLATION_MODEL)
+
+        # Only a sample of the jobs is traced, the others pass trace=None along
+        trace = start_trace(
+            "AI Document Translator", sample_rate=settings.TRANSLATION_TRACE_SAMPLE_RATE
+        )
+        metrics.increment("input_bytes", os.path.getsize(input_path))
+        store = get_output_store()
+        input_digest = params.get("input_digest") or file_digest(input_path)
+
+        job_id = params.get("job_id")
+        checkpoints = get_checkpoint_store() if job_id else None
+        segment_callbacks = {}
+        revisions = {}
+        resumed_segments = {}
+        for lang in target_langs:
+            callbacks = []
+            # Self-evaluation back-translates each segment as soon as it is translated
+            if evaluation_method == "self_evaluation":
+                back_translator = BackTranslator(
+                    model, source_lang, lang, trace, executor=executor
+                )
+                back_translators[lang] = back_translator
+                callbacks.append(back_translator.add)
+
+            # Revisions of a document lineage only send their changed segments
+            revision = None
+            if params.get("lineage"):
+                revision = DocumentRevision(
+                    get_revision_store(), params["lineage"], source_lang, lang, glossary
+                )
+            if checkpoints is not None:
+                context = checkpoints.make_context(source_lang, lang, glossary)
+                checkpointed = checkpoints.load(job_id, context)
+                # Segments translated by an earlier run of this job are reused
+                if checkpointed:
+                    resumed_segments[lang] = len(checkpointed)
+                    if revision is None:
+                        revision = DocumentRevision(
+                            checkpoints, job_id, source_lang, lang, glossary
+                        )
+                    else:
+                        revision.previous.update(checkpointed)
+                callbacks.append(
+                    functools.partial(checkpoints.add_segment, job_id, context)
+                )
+            if revision is not None:
+                revisions[lang] = revision
+
+            if lang == target_langs[0]:
+                callbacks.append(on_segment)
+            segment_callbacks[lang] = _chain_callbacks(*callbacks)
+
+        results = process_document_file(
+            input_path,
+            model,
+            glossary,
+            source_lang,
+            target_langs,
+            trace,
+            on_progress=progress,
+            on_segment=segment_callbacks,
+            revision=revisions,
+            executor=executor,
+        )
+
+        # Handle evaluation method
+        reference_content = None
+        if evaluation_method == "reference_file":
+            reference_content = read_reference_content(
+                default_storage.path(params["reference_path"])
+            )
+        elif evaluation_method == "reference_text":
+            reference_content = params["reference_text"]
+
+        targets = {}
+        output_keys = {}
+        for lang in target_langs:
+            translated_content, original_input, translated_output_text = results[lang]
+            output_file_name = f"translated_{lang}_{file_name}"
+            with store.staging(output_file_name) as output_file_path, metrics.stage(
+                "write"
+            ):
+                write_translated_document(
+                    translated_content, output_file_path, input_path
+                )
+            metrics.increment("output_bytes", os.path.getsize(output_file_path))
+            output_keys[lang] = store.put(
+                output_key(input_digest, source_lang, lang, params.get("glossary")),
+                output_file_path,
+                output_file_name,
+            )
+
+            report = {}
+            if params.get("lineage"):
+                report.update(revisions[lang].stats())
+            if resumed_segments.get(lang):
+                report["resumed_segments"] = resumed_segments[lang]
+            if glossary:
+                report["glossary_terms"] = len(glossary)
+                report["missing_glossary_terms"] = glossary.missing_terms(
+                    original_input, translated_output_text
+                )
+                if trace is not None:
+                    trace.event(
+                        name="Glossary check",
+                        output=report["missing_glossary_terms"],
+                        metadata={"target_lang": lang},
+                    )
+
+            # Evaluate translation
+            back_translator = back_translators.get(lang)
+            with metrics.stage("evaluate"):
+                score = evaluate_translation(
+                    evaluation_method,
+                    original_input,
+                    translated_output_text,
+                    source_lang,
+                    lang,
+                    model,
+                    trace,
+                    reference_content=reference_content,
+                    back_translations=back_translator.results()
+                    if back_translator
+                    else None,
+                )
+
+            if trace is not None:
+                trace.score(name=evaluation_method, value=score, comment=lang)
+            if params.get("lineage"):
+                revisions[lang].save()
+            targets[lang] = {
+                "result_url": reverse(
+                    "translation_output", args=[output_keys[lang], output_file_name]
+                ),
+                "score": score,
+                "report": report,
+            }
+    finally:
+        for back_translator in back_translators.values():
+            back_translator.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Clean up temporary files and checkpoints, a failed job keeps them to be retried
+    # Note: the output file is kept, as it's needed for download
+    default_storage.delete(params["input_path"])
+    if params.get("reference_path"):
+        default_storage.delete(params["reference_path"])
+    if checkpoints is not None:
+        checkpoints.discard(job_id)
+
+    files = list(output_keys.values())
+    if not multiple_targets:
+        target = targets[target_langs[0]]
+        result = {
+            "result_url": target["result_url"],
+            "score": target["score"],
+            "report": target["report"],
+        }
+    else:
+        result_url = None
+        if params.get("output") == "zip":
+            zip_file_name = f"translated_{os.path.splitext(file_name)[0]}.zip"
+            with store.staging(zip_file_name) as zip_path, metrics.stage("write"):
+                zip_outputs(
+                    [
+                        (
+                            store.path(output_keys[lang]),
+                            f"translated_{lang}_{file_name}",
+                        )
+                        for lang in target_langs
+                    ],
+                    zip_path,
+                )
+            zip_key = store.put(
+                output_key(
+                    input_digest,
+                    source_lang,
+                    target_langs,
+                    params.get("glossary"),
+                    output="zip",
+                ),
+                zip_path,
+                zip_file_name,
+            )
+            files.append(zip_key)
+            result_url = reverse("translation_output", args=[zip_key, zip_file_name])
+        result = {
+            "result_url": result_url,
+            "score": None,
+            "report": {"targets": targets},
+        }
+
+    if params.get("cache_key"):
+        store.put_result(params["cache_key"], result, files)
+    return result
+
+
+def run_job(params, progress=None, on_segment=None):
+    """Handler of the job queue, for a single document or a bulk archive."""
+    if params.get("bulk"):
+        return run_bulk_pipeline(params, progress, on_segment)
+    return run_translation_pipeline(params, progress, on_segment)
@@ -136,3 +136,125 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
+
+# Translation pipeline
+# Model used for translations, as "<backend>:<model name>" (e.g. "fake:translator"
+# for load tests) or a bare OpenAI model name
+TRANSLATION_MODEL = os.environ.get("TRANSLATION_MODEL", "gpt-4o")
+# Number of chunks sent to the model in parallel for a single document
+TRANSLATION_MAX_CONCURRENCY = int(os.environ.get("TRANSLATION_MAX_CONCURRENCY", 4))
+# Maximum number of model tokens of text sent in a single translation request
+TRANSLATION_CHUNK_TOKENS = int(os.environ.get("TRANSLATION_CHUNK_TOKENS", 3000))
+# Pack many short segments (e.g. the shapes of a deck) into a single request
+TRANSLATION_BATCHING = os.environ.get("TRANSLATION_BATCHING", "1") == "1"
+# Model provider budgets shared by every job of a worker, 0 = no limit
+TRANSLATION_RATE_LIMIT_RPM = float(os.environ.get("TRANSLATION_RATE_LIMIT_RPM", 0))
+TRANSLATION_RATE_LIMIT_TPM = float(os.environ.get("TRANSLATION_RATE_LIMIT_TPM", 0))
+# Retries of a rate limited (429) or transiently failing model request
+TRANSLATION_RATE_LIMIT_RETRIES = int(
+    os.environ.get("TRANSLATION_RATE_LIMIT_RETRIES", 5)
+)
+# SQLite file sharing the budgets between the worker processes of a node
+TRANSLATION_RATE_LIMIT_SHARED_PATH = os.environ.get(
+    "TRANSLATION_RATE_LIMIT_SHARED_PATH"
+)
+# Persistent translation memory, used to skip the model for already translated segments
+TRANSLATION_MEMORY_ENABLED = os.environ.get("TRANSLATION_MEMORY_ENABLED", "1") == "1"
+TRANSLATION_MEMORY_PATH = os.environ.get(
+    "TRANSLATION_MEMORY_PATH", os.path.join(BASE_DIR, "translation_memory.sqlite3")
+)
+TRANSLATION_MEMORY_MAX_ENTRIES = int(
+    os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", 100_000)
+)
+TRANSLATION_MEMORY_MAX_AGE_DAYS = int(
+    os.environ.get("TRANSLATION_MEMORY_MAX_AGE_DAYS", 30)
+)
+# Fraction of the jobs traced in Langfuse (see src/llm_translator/tracing.py)
+TRANSLATION_TRACE_SAMPLE_RATE = float(
+    os.environ.get("TRANSLATION_TRACE_SAMPLE_RATE", 1.0)
+)
+# Clients allowed to read /metrics/, the process counters and stage timers
+TRANSLATION_METRICS_ALLOWED_IPS = os.environ.get(
+    "TRANSLATION_METRICS_ALLOWED_IPS", "127.0.0.1,::1"
+).split(",")
+# Background translation jobs
+# Either "sqlite", "inprocess" or the dotted path of a BaseJobQueue subclass.
+# "inprocess" jobs are only visible to the process that runs them, so it needs
+# a single worker process
+TRANSLATION_JOB_BACKEND = os.environ.get("TRANSLATION_JOB_BACKEND", "sqlite")
+TRANSLATION_JOB_WORKERS = int(os.environ.get("TRANSLATION_JOB_WORKERS", 2))
+TRANSLATION_JOB_DB_PATH = os.environ.get(
+    "TRANSLATION_JOB_DB_PATH", os.path.join(BASE_DIR, "translation_jobs.sqlite3")
+)
+# Bulk archives: processes parsing and writing documents, documents translated at
+# once, and maximum uploaded and uncompressed sizes
+TRANSLATION_BULK_PROCESSES = int(
+    os.environ.get("TRANSLATION_BULK_PROCESSES", min(4, os.cpu_count() or 1))
+)
+TRANSLATION_BULK_DOCUMENTS = int(os.environ.get("TRANSLATION_BULK_DOCUMENTS", 8))
+TRANSLATION_BULK_MAX_UPLOAD_BYTES = int(
+    os.environ.get("TRANSLATION_BULK_MAX_UPLOAD_BYTES", 100 * 1024 * 1024)
+)
+TRANSLATION_BULK_MAX_BYTES = int(
+    os.environ.get("TRANSLATION_BULK_MAX_BYTES", 1024 * 1024 * 1024)
+)
+# Segments translated by every running job, so a retried job resumes where it stopped
+TRANSLATION_CHECKPOINTS_PATH = os.environ.get(
+    "TRANSLATION_CHECKPOINTS_PATH",
+    os.path.join(BASE_DIR, "translation_checkpoints.sqlite3"),
+)
+# A running job not updated for this long lost its worker and is queued again
+TRANSLATION_JOB_STALE_SECONDS = float(
+    os.environ.get("TRANSLATION_JOB_STALE_SECONDS", 300)
+)
+# Translated files, stored under a key of their input and options
+# (see src/llm_translator/outputs.py)
+TRANSLATION_OUTPUT_ROOT = os.environ.get(
+    "TRANSLATION_OUTPUT_ROOT", os.path.join(BASE_DIR, "translation_outputs")
+)
+TRANSLATION_OUTPUT_MAX_BYTES = int(
+    os.environ.get("TRANSLATION_OUTPUT_MAX_BYTES", 1024 * 1024 * 1024)
+)
+TRANSLATION_OUTPUT_MAX_AGE_DAYS = float(
+    os.environ.get("TRANSLATION_OUTPUT_MAX_AGE_DAYS", 7)
+)
+# "nginx" (X-Accel-Redirect) or "apache" (X-Sendfile) to let the web server
+# send the files
+TRANSLATION_OUTPUT_SENDFILE = os.environ.get("TRANSLATION_OUTPUT_SENDFILE", "")
+# Internal nginx location aliased to TRANSLATION_OUTPUT_ROOT
+TRANSLATION_OUTPUT_ACCEL_PREFIX = os.environ.get(
+    "TRANSLATION_OUTPUT_ACCEL_PREFIX", "/protected-outputs/"
+)
+# Seconds between two checks of a job by its server-sent events stream
+TRANSLATION_EVENTS_POLL_INTERVAL = float(
+    os.environ.get("TRANSLATION_EVENTS_POLL_INTERVAL", 0.5)
+)
+# Embedding model of the evaluation, "<backend>:<model>" with backend "openai"
+# or "local"
+TRANSLATION_EMBEDDING_MODEL = os.environ.get(
+    "TRANSLATION_EMBEDDING_MODEL", "openai:text-embedding-3-small"
+)
+# Processes scoring the paragraphs of the "reference_text" evaluation
+TRANSLATION_METEOR_WORKERS = int(
+    os.environ.get("TRANSLATION_METEOR_WORKERS", min(4, os.cpu_count() or 1))
+)
+# Load the model, prompts and format libraries when a worker starts (see warmup.py)
+TRANSLATION_WARMUP = os.environ.get("TRANSLATION_WARMUP", "1") == "1"
+# Also load numpy and WordNet for the evaluation, which only some jobs need
+TRANSLATION_WARMUP_EVALUATION = (
+    os.environ.get("TRANSLATION_WARMUP_EVALUATION", "0") == "1"
+)
+# Also fetch the tokenizer and the Langfuse prompts, which need the network
+TRANSLATION_WARMUP_NETWORK = os.environ.get("TRANSLATION_WARMUP_NETWORK", "0") == "1"
+# Seconds a worker waits for its warm-up before serving requests anyway
+TRANSLATION_WARMUP_TIMEOUT = float(os.environ.get("TRANSLATION_WARMUP_TIMEOUT", 10))
+# Workbooks larger than this are rewritten part by part instead of loaded in memory
+TRANSLATION_XLSX_STREAMING_BYTES = int(
+    os.environ.get("TRANSLATION_XLSX_STREAMING_BYTES", 10 * 1024 * 1024)
+)
+# Last translated revision of every document lineage
+# (see src/llm_translator/revisions.py)
+TRANSLATION_REVISIONS_PATH = os.environ.get(
+    "TRANSLATION_REVISIONS_PATH",
+    os.path.join(BASE_DIR, "translation_revisions.sqlite3"),
+)
@@ -1,16 +1,75 @@
 # type: ignore
+import functools
 import io
+import os
+import json
+import threading
+import sqlite3
+import time
+import zipfile
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
 from django.urls import reverse
 from django.test import Client
 import docx
 from pptx import Presentation
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+from src.llm_translator import translator
+from src.llm_translator.docx_stream import write_docx_translations
+from src.llm_translator.manifest import TranslationManifest
+from src.llm_translator.metrics import metrics
+from src.llm_translator.outputs import OutputStore
+from src.llm_translator.revisions import DocumentRevision, RevisionStore
+from src.llm_translator.utils import write_excel_translations
+from translating_app.utils import (
+    BackTranslator,
+    evaluate_translation,
+    process_document_file,
+)
+from translating_app import jobs, utils as app_utils, views, warmup
+from translating_app.pipeline import run_job, run_translation_pipeline
+from translating_app.benchmark import measure_startup
+from translating_app.bulk import extract_archive
+from translating_app.jobs import InProcessJobQueue, SQLiteJobQueue, DONE, FAILED
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(monkeypatch, settings, tmp_path):
+    # Jobs run in this process against the fake model, and write under tmp_path
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    settings.TRANSLATION_JOB_BACKEND = "inprocess"
+    settings.TRANSLATION_MODEL = "fake:translator"
+    settings.TRANSLATION_TRACE_SAMPLE_RATE = 0
+    settings.TRANSLATION_JOB_DB_PATH = str(tmp_path / "jobs.sqlite3")
+    settings.TRANSLATION_MEMORY_PATH = str(tmp_path / "memory.sqlite3")
+    settings.TRANSLATION_CHECKPOINTS_PATH = str(tmp_path / "checkpoints.sqlite3")
+    settings.TRANSLATION_REVISIONS_PATH = str(tmp_path / "revisions.sqlite3")
+    settings.TRANSLATION_OUTPUT_ROOT = str(tmp_path / "outputs")
+    for name in ("_translation_memory", "_revision_store", "_checkpoint_store"):
+        monkeypatch.setattr(app_utils, name, None)
+    monkeypatch.setattr(jobs, "_job_queue", None)
+
+
+@pytest.fixture(autouse=True)
+def output_store(monkeypatch, tmp_path):
+    # Every test gets its own store of translated files
+    store = OutputStore(tmp_path / "outputs")
+    monkeypatch.setattr(app_utils, "_output_store", store)
+    return store
+
+
+def stored_output(store, result_url):
+    key = result_url.rstrip("/").split("/")[-2]
+    return store.get(key)["path"]
 
 
 @pytest.mark.django_db
-def test_upload_and_translate_docx():
+def test_upload_and_translate_docx(output_store):
     client = Client()
 
     # Create an in-memory DOCX file
@@ -36,10 +95,14 @@ def test_upload_and_translate_docx():
     )
 
     assert response.status_code == 200  # Expect successful translation
+    job = wait_for_job(views.get_job_queue(), response.context["job_id"])
+    assert job["status"] == DONE
+    result = docx.Document(stored_output(output_store, job["result_url"]))
+    assert result.paragraphs[0].text == "sample content"
 
 
 @pytest.mark.django_db
-def test_upload_and_translate_pptx():
+def test_upload_and_translate_pptx(output_store):
     client = Client()
 
     # Create an in-memory PPTX file
@@ -70,10 +133,14 @@ def test_upload_and_translate_pptx():
     )
 
     assert response.status_code == 200  # Expect successful translation
+    job = wait_for_job(views.get_job_queue(), response.context["job_id"])
+    assert job["status"] == DONE
+    result = Presentation(stored_output(output_store, job["result_url"]))
+    assert result.slides[0].placeholders[1].text_frame.text == "This is a powerpoint"
 
 
 @pytest.mark.django_db
-def test_read_write_excel(tmp_path):
+def test_read_write_excel(output_store):
     # Create and save an Excel file in-memory
     excel_file = io.BytesIO()
     wb = Workbook()
@@ -100,3 +167,904 @@ def test_read_write_excel(tmp_path):
     )
 
     assert response.status_code == 200  # Expect successful translation
+    job = wait_for_job(views.get_job_queue(), response.context["job_id"])
+    assert job["status"] == DONE
+    with open(stored_output(output_store, job["result_url"]), "rb") as translated:
+        result = load_workbook(translated)
+    assert [[cell.value for cell in row] for row in result.active.rows] == [
+        ["Col1", "Col2"],
+        ["Val1", "Val2"],
+    ]
+
+
+def wait_for_job(queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (DONE, FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish in time")
+
+
+@pytest.mark.parametrize("backend", ["inprocess", "sqlite"])
+def test_job_queue_runs_jobs_and_reports_progress(backend, tmp_path):
+    def handler(params, progress, on_segment):
+        for done in range(1, params["chunks"] + 1):
+            on_segment(f"chunk {done}", f"CHUNK {done}")
+            progress(done, params["chunks"])
+        if params.get("fail"):
+            raise RuntimeError("provider error")
+        return {"result_url": "/media/out.docx", "score": 0.5}
+
+    if backend == "sqlite":
+        queue = SQLiteJobQueue(handler, tmp_path / "jobs.sqlite3", poll_interval=0.05)
+    else:
+        queue = InProcessJobQueue(handler)
+
+    job = wait_for_job(queue, queue.submit({"chunks": 3}))
+    assert job["status"] == DONE
+    assert (job["chunks_done"], job["chunks_total"]) == (3, 3)
+    assert job["result_url"] == "/media/out.docx"
+    segments = queue.get_segments(job["id"])
+    assert [segment["translation"] for segment in segments] == [
+        "CHUNK 1",
+        "CHUNK 2",
+        "CHUNK 3",
+    ]
+    assert queue.get_segments(job["id"], after=segments[1]["id"]) == segments[2:]
+
+    failed_job = wait_for_job(queue, queue.submit({"chunks": 1, "fail": True}))
+    assert failed_job["status"] == FAILED
+    assert failed_job["error"] == "provider error"
+
+
+def test_sqlite_queue_picks_up_jobs_left_by_a_previous_process(settings, tmp_path):
+    settings.TRANSLATION_JOB_DB_PATH = str(tmp_path / "jobs.sqlite3")
+
+    def handler(params, progress, on_segment):
+        return {"result_url": "/outputs/left.docx", "score": None}
+
+    previous = SQLiteJobQueue(handler, settings.TRANSLATION_JOB_DB_PATH)
+    previous._start_workers = lambda: None  # The process stopped before running it
+    job_id = previous.submit({})
+
+    queue = SQLiteJobQueue.from_settings(handler)
+    assert wait_for_job(queue, job_id)["status"] == DONE
+
+
+def test_sqlite_queue_workers_survive_database_errors(monkeypatch, tmp_path):
+    def handler(params, progress, on_segment):
+        return {"result_url": "/outputs/locked.docx", "score": None}
+
+    queue = SQLiteJobQueue(handler, tmp_path / "jobs.sqlite3", poll_interval=0.01)
+    claim = queue._claim
+    failures = iter([sqlite3.OperationalError("database is locked")])
+
+    def flaky_claim():
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return claim()
+
+    monkeypatch.setattr(queue, "_claim", flaky_claim)
+    assert wait_for_job(queue, queue.submit({}))["status"] == DONE
+
+
+def test_job_events_stream_segments_progress_and_result(monkeypatch, settings):
+    settings.TRANSLATION_EVENTS_POLL_INTERVAL = 0.01
+
+    def handler(params, progress, on_segment):
+        on_segment("Bonjour", "Hello")
+        progress(1, 2)
+        on_segment("Merci", "Thank you")
+        progress(2, 2)
+        return {"result_url": "/media/translated.docx", "score": None}
+
+    queue = InProcessJobQueue(handler)
+    monkeypatch.setattr(views, "get_job_queue", lambda: queue)
+    job_id = queue.submit({})
+    wait_for_job(queue, job_id)
+
+    client = Client()
+    response = client.get(reverse("job_events", args=[job_id]))
+    assert response["Content-Type"] == "text/event-stream"
+    events = [
+        dict(line.split(": ", 1) for line in block.splitlines())
+        for block in b"".join(response.streaming_content).decode().split("\n\n")
+        if block
+    ]
+    assert [event["event"] for event in events] == [
+        "segment",
+        "segment",
+        "progress",
+        "done",
+    ]
+    assert json.loads(events[1]["data"])["translation"] == "Thank you"
+    assert json.loads(events[2]["data"])["percent"] == 100
+    assert json.loads(events[3]["data"])["result_url"] == "/media/translated.docx"
+
+    # A reconnecting client only receives the segments it has not seen yet
+    response = client.get(
+        reverse("job_events", args=[job_id]), HTTP_LAST_EVENT_ID=events[0]["id"]
+    )
+    assert b"".join(response.streaming_content).decode().count("event: segment") == 1
+
+
+def test_job_status_unknown_job():
+    client = Client()
+    response = client.get(reverse("job_status", args=["missing"]))
+    assert response.status_code == 404
+
+
+def fake_translate_text(text, model, **kwargs):
+    fake_translate_text.calls += 1
+    return text.upper()
+
+
+@pytest.fixture
+def offline_translation(monkeypatch, settings):
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    fake_translate_text.calls = 0
+    monkeypatch.setattr(translator, "translate_text", fake_translate_text)
+    return fake_translate_text
+
+
+def test_workbooks_translate_their_unique_text_cells(offline_translation, tmp_path):
+    input_file = tmp_path / "input.xlsx"
+    output_file = tmp_path / "output.xlsx"
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Data"
+    ws.append(["Label", "Amount"])
+    for amount in range(1, 51):
+        ws.append(["Label", amount])
+    ws["C1"] = "=SUM(B2:B51)"
+    ws["A1"].font = Font(bold=True)
+    wb.create_sheet("Notes").append(["Label", "other note"])
+    wb.save(input_file)
+
+    translated_content, original_input, _ = process_document_file(
+        str(input_file), None, None, "fr", ["en"], None
+    )["en"]
+    write_excel_translations(translated_content, str(output_file), str(input_file))
+
+    assert original_input.split("\n") == ["Label", "Amount", "other note"]
+    assert offline_translation.calls == 1, "Unique cells should share one request"
+    result = load_workbook(output_file)
+    assert result.sheetnames == ["Data", "Notes"]
+    assert result["Data"]["A51"].value == "LABEL"
+    assert result["Data"]["B51"].value == 50
+    assert result["Data"]["C1"].value == "=SUM(B2:B51)"
+    assert result["Data"]["A1"].font.bold
+    assert result["Notes"]["B1"].value == "OTHER NOTE"
+
+
+def test_cells_over_the_request_budget_are_split(
+    offline_translation, settings, tmp_path
+):
+    settings.TRANSLATION_BATCHING = False
+    settings.TRANSLATION_CHUNK_TOKENS = 8
+    input_file = tmp_path / "input.xlsx"
+    note = (
+        "Première phrase de la note.  Deuxième phrase, nettement plus longue "
+        "que le budget d'une requête."
+    )
+    wb = Workbook()
+    wb.active.append(["Label", note])
+    wb.save(input_file)
+
+    translated_content, _, _ = process_document_file(
+        str(input_file), None, None, "fr", ["en"], None
+    )["en"]
+
+    assert offline_translation.calls > 2, "The long cell should be split"
+    assert translated_content == {"Label": "LABEL", note: note.upper()}
+
+
+def test_docx_text_is_rewritten_in_place(offline_translation, tmp_path):
+    input_file = tmp_path / "input.docx"
+    output_file = tmp_path / "output.docx"
+    doc = docx.Document()
+    paragraph = doc.add_paragraph("Bonjour ")
+    paragraph.add_run("tout le monde").bold = True
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "Cellule"
+    table.cell(0, 1).text = "Prix & taxes"
+    doc.sections[0].header.paragraphs[0].text = "En-tête"
+    doc.save(input_file)
+
+    translated_content, original_input, translated_output_text = process_document_file(
+        str(input_file), None, None, "fr", ["en"], None
+    )["en"]
+    write_docx_translations(translated_content, str(output_file), str(input_file))
+
+    assert original_input.split("\n") == [
+        "Bonjour tout le monde",
+        "Cellule",
+        "Prix & taxes",
+        "En-tête",
+    ]
+    result = docx.Document(output_file)
+    assert result.paragraphs[0].text == "BONJOUR TOUT LE MONDE"
+    assert result.paragraphs[0].runs[1].bold, "Run formatting should be kept"
+    assert result.tables[0].cell(0, 1).text == "PRIX & TAXES"
+    assert result.sections[0].header.paragraphs[0].text == "EN-TÊTE"
+
+
+def test_split_paragraphs_keep_their_spacing(offline_translation, settings, tmp_path):
+    settings.TRANSLATION_BATCHING = False
+    settings.TRANSLATION_CHUNK_TOKENS = 8
+    input_file = tmp_path / "input.docx"
+    output_file = tmp_path / "output.docx"
+    source = (
+        "Première phrase du paragraphe.  Deuxième phrase, nettement plus longue "
+        "que le budget d'une requête, découpée en mots. Fin."
+    )
+    doc = docx.Document()
+    doc.add_paragraph(source)
+    doc.save(input_file)
+
+    translated_content, _, _ = process_document_file(
+        str(input_file), None, None, "fr", ["en"], None
+    )["en"]
+    write_docx_translations(translated_content, str(output_file), str(input_file))
+
+    assert offline_translation.calls > 2, "The paragraph should be split"
+    assert docx.Document(output_file).paragraphs[0].text == source.upper()
+
+
+@pytest.mark.django_db
+def test_benchmark_command_reports_every_format(tmp_path):
+    output_file = tmp_path / "report.json"
+    call_command("benchmark", size=3, view=True, output=str(output_file))
+
+    report = json.loads(output_file.read_text())
+    results = {
+        (result["format"], result["mode"]): result for result in report["results"]
+    }
+    assert set(results) == {
+        (file_format, mode)
+        for file_format in ("docx", "pptx", "xlsx")
+        for mode in ("functions", "view")
+    }
+    for result in results.values():
+        assert result["calls"] > 0
+        assert result["prompt_tokens"] > 0
+        assert result["peak_memory_bytes"] > 0
+        assert result["stages"]["translate"] > 0
+
+
+# Generous bound, the import takes about a second on a laptop
+STARTUP_TIME_BUDGET = 10
+
+
+def test_worker_startup_stays_lazy():
+    startup = measure_startup(runs=1)
+
+    assert startup["lazy_modules_loaded"] == []
+    assert startup["import_seconds"] < STARTUP_TIME_BUDGET
+
+
+def test_warm_up_skips_the_network_and_gives_up_after_its_timeout(
+    monkeypatch, settings
+):
+    settings.TRANSLATION_WARMUP = True
+    settings.TRANSLATION_WARMUP_TIMEOUT = 0.2
+    release = threading.Event()
+    ran = []
+    monkeypatch.setattr(warmup, "_load_formats", lambda: ran.append("formats"))
+    monkeypatch.setattr(warmup, "_load_model", lambda: release.wait(5))
+    for step in ("_load_job_queue", "_load_tokenizer", "_load_prompts"):
+        monkeypatch.setattr(warmup, step, functools.partial(ran.append, step))
+
+    start = time.perf_counter()
+    timings = warmup.warm_up()
+    release.set()
+
+    assert time.perf_counter() - start < 2
+    assert list(timings) == ["formats"] and ran == ["formats"]
+
+
+def test_back_translator_overlaps_and_scores_segments(offline_translation, settings):
+    settings.TRANSLATION_EMBEDDING_MODEL = "local:test"
+    back_translator = BackTranslator(None, "fr", "en", max_tokens=5)
+
+    back_translator.add("Bonjour", "hello")
+    back_translator.add(
+        "Un long paragraphe du document", "a long paragraph of the document"
+    )
+    # The second segment filled a batch, its back-translation started already
+    deadline = time.time() + 5
+    while offline_translation.calls < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert offline_translation.calls == 1
+    back_translator.add("Merci", "thanks")
+
+    back_translations = back_translator.results()
+    assert back_translations == [
+        ("Bonjour", "HELLO"),
+        ("Un long paragraphe du document", "A LONG PARAGRAPH OF THE DOCUMENT"),
+        ("Merci", "THANKS"),
+    ]
+    assert offline_translation.calls == 2
+
+    score = evaluate_translation(
+        "self_evaluation",
+        "Bonjour\nUn long paragraphe du document\nMerci",
+        "hello\na long paragraph of the document\nthanks",
+        "fr",
+        "en",
+        None,
+        None,
+        back_translations=back_translations,
+    )
+    # The fake model only upper-cases, so the back-translations stay in English
+    assert 0 <= score < 1
+
+
+def test_evaluation_span_only_carries_document_digests():
+    class RecordingTrace:
+        def __init__(self):
+            self.spans = []
+
+        def span(self, **fields):
+            self.spans.append(fields)
+            return self
+
+        def end(self, **fields):
+            pass
+
+    document = "Bonjour tout le monde. " * 1000
+    trace = RecordingTrace()
+    evaluate_translation(
+        "no_evaluation", document, document.upper(), "fr", "en", None, trace
+    )
+
+    span_input = trace.spans[0]["input"]
+    assert document not in json.dumps(span_input)
+    assert span_input["original_input"]["chars"] == len(document)
+    assert (
+        span_input["original_input"]["sha256"]
+        != span_input["translated_output"]["sha256"]
+    )
+    assert span_input["reference_content"] is None
+
+
+def test_back_translator_runs_its_requests_on_the_shared_pool(monkeypatch, settings):
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    threads = set()
+
+    def recording_translate_text(text, model, **kwargs):
+        threads.add(threading.current_thread().name)
+        return text.upper()
+
+    monkeypatch.setattr(translator, "translate_text", recording_translate_text)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared") as executor:
+        back_translator = BackTranslator(
+            None, "fr", "en", max_tokens=1, executor=executor
+        )
+        for text in ("un", "deux", "trois"):
+            back_translator.add(text, text)
+        assert [pair[1] for pair in back_translator.results()] == [
+            "UN",
+            "DEUX",
+            "TROIS",
+        ]
+    assert threads == {"shared_0"}
+
+
+def test_revision_only_translates_changed_segments(offline_translation, tmp_path):
+    store = RevisionStore(tmp_path / "revisions.sqlite3")
+    input_file = tmp_path / "contract.docx"
+
+    def translate_revision(paragraphs):
+        doc = docx.Document()
+        for text in paragraphs:
+            doc.add_paragraph(text)
+        doc.save(input_file)
+        revision = DocumentRevision(store, "contract", "fr", "en")
+        translated_content, _, _ = process_document_file(
+            str(input_file), None, None, "fr", ["en"], None, revision={"en": revision}
+        )["en"]
+        revision.save()
+        return list(translated_content.values()), revision.stats()
+
+    first, stats = translate_revision(["Article un", "Article deux", "Signature"])
+    assert stats == {"reused_segments": 0, "translated_segments": 3}
+    calls = offline_translation.calls
+
+    second, stats = translate_revision(
+        ["Article un", "Article deux modifié", "Signature"]
+    )
+    assert second == ["ARTICLE UN", "ARTICLE DEUX MODIFIÉ", "SIGNATURE"]
+    assert stats == {"reused_segments": 2, "translated_segments": 1}
+    assert offline_translation.calls == calls + 1
+
+
+def test_metrics_endpoint_reports_stages_to_local_clients(
+    offline_translation, tmp_path
+):
+    input_file = tmp_path / "input.docx"
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour")
+    doc.save(input_file)
+    metrics.reset()
+    process_document_file(str(input_file), None, None, "fr", ["en"], None)
+
+    client = Client()
+    response = client.get(reverse("metrics"))
+    assert response.status_code == 200
+    report = response.json()
+    assert {"parse", "segment", "translate"} <= set(report["timers"])
+    assert report["timers"]["parse"]["count"] == 1
+    assert report["rate_limit"]["queue_depth"] == 0
+
+    response = client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1")
+    assert response.status_code == 403
+
+
+def tagged_translate_text(text, model, target_lang="English", **kwargs):
+    return f"{target_lang}: {text}"
+
+
+def test_docx_fans_out_to_several_targets_after_one_parse(
+    monkeypatch, tmp_path, settings
+):
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    settings.TRANSLATION_BATCHING = False
+    monkeypatch.setattr(translator, "translate_text", tagged_translate_text)
+    input_file = tmp_path / "input.docx"
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour")
+    doc.add_paragraph("Merci")
+    doc.save(input_file)
+    metrics.reset()
+    progress = []
+
+    results = process_document_file(
+        str(input_file),
+        None,
+        None,
+        "fr",
+        ["en", "de", "es"],
+        None,
+        on_progress=lambda done, total: progress.append((done, total)),
+    )
+
+    assert metrics.snapshot()["timers"]["parse"]["count"] == 1
+    assert results["de"][2] == "de: Bonjour\nde: Merci"
+    assert results["es"][1] == "Bonjour\nMerci"
+    assert progress[-1] == (6, 6)
+
+
+@pytest.mark.django_db
+def test_pipeline_zips_one_file_per_target(
+    monkeypatch, settings, tmp_path, output_store
+):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    settings.TRANSLATION_MODEL = "fake:translator"
+    settings.TRANSLATION_TRACE_SAMPLE_RATE = 0
+    monkeypatch.setattr(translator, "translate_text", tagged_translate_text)
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour")
+    doc.save(doc_file)
+    input_path = default_storage.save(
+        "temp/report.docx", ContentFile(doc_file.getvalue())
+    )
+
+    result = run_translation_pipeline(
+        {
+            "input_path": input_path,
+            "file_name": "report.docx",
+            "source_lang": "fr",
+            "target_langs": ["en", "de"],
+            "glossary": None,
+            "evaluation_method": "no_evaluation",
+            "output": "zip",
+        }
+    )
+
+    assert result["result_url"].endswith("/translated_report.zip")
+    assert set(result["report"]["targets"]) == {"en", "de"}
+    with zipfile.ZipFile(stored_output(output_store, result["result_url"])) as archive:
+        assert sorted(archive.namelist()) == [
+            "translated_de_report.docx",
+            "translated_en_report.docx",
+        ]
+        with archive.open("translated_de_report.docx") as translated:
+            assert docx.Document(translated).paragraphs[0].text == "de: Bonjour"
+
+
+@pytest.mark.django_db
+def test_bulk_archive_translates_documents_and_streams_a_manifest(
+    monkeypatch, settings, tmp_path
+):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    settings.TRANSLATION_MODEL = "fake:translator"
+    settings.TRANSLATION_TRACE_SAMPLE_RATE = 0
+    settings.TRANSLATION_BULK_PROCESSES = 2
+    monkeypatch.setattr(translator, "translate_text", tagged_translate_text)
+
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour")
+    doc.save(doc_file)
+    workbook_file = io.BytesIO()
+    workbook = Workbook()
+    workbook.active["A1"] = "Merci"
+    workbook.save(workbook_file)
+    archive_file = io.BytesIO()
+    with zipfile.ZipFile(archive_file, "w") as archive:
+        archive.writestr("letters/hello.docx", doc_file.getvalue())
+        archive.writestr("prices.xlsx", workbook_file.getvalue())
+        archive.writestr("broken.docx", b"not a document")
+        archive.writestr("notes.txt", b"skipped")
+    input_path = default_storage.save(
+        "temp/bulk.zip", ContentFile(archive_file.getvalue())
+    )
+    archive_id = "0" * 32
+
+    result = run_job(
+        {
+            "bulk": True,
+            "input_path": input_path,
+            "output_dir": f"bulk/{archive_id}",
+            "source_lang": "fr",
+            "target_lang": "de",
+            "glossary": None,
+        }
+    )
+
+    report = result["report"]
+    assert (
+        report["translated_files"],
+        report["failed_files"],
+        report["skipped_files"],
+    ) == (2, 1, 1)
+    response = Client().get(result["result_url"])
+    assert response["Content-Type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        statuses = {entry["name"]: entry["status"] for entry in manifest["files"]}
+        assert statuses == {
+            "letters/hello.docx": "done",
+            "prices.xlsx": "done",
+            "broken.docx": "failed",
+            "notes.txt": "skipped",
+        }
+        with archive.open("letters/hello.docx") as translated:
+            assert docx.Document(translated).paragraphs[0].text == "de: Bonjour"
+        with archive.open("prices.xlsx") as translated:
+            assert load_workbook(translated).active["A1"].value == "de: Merci"
+
+
+def test_bulk_upload_refuses_colliding_paths_and_invalid_glossaries(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    archive_file = io.BytesIO()
+    with zipfile.ZipFile(archive_file, "w") as archive:
+        archive.writestr("letters/report.docx", b"first")
+        archive.writestr("letters\\Report.docx", b"second")
+    archive_path = tmp_path / "bulk.zip"
+    archive_path.write_bytes(archive_file.getvalue())
+
+    with pytest.raises(ValueError, match="Duplicate path in archive"):
+        extract_archive(str(archive_path), str(tmp_path / "input"))
+
+    for glossary, error in (
+        (b"{not json", "Invalid glossary file"),
+        (b'["invoice", "facture"]', "Glossary must map terms to their translations"),
+    ):
+        response = Client().post(
+            reverse("bulk_translate"),
+            {
+                "archive": SimpleUploadedFile("documents.zip", archive_file.getvalue()),
+                "glossary": SimpleUploadedFile("glossary.json", glossary),
+            },
+        )
+        assert response.status_code == 400
+        assert response.json() == {"error": error}
+
+
+def test_translate_tree_resumes_without_resending_finished_work(
+    offline_translation, monkeypatch, settings, tmp_path
+):
+    settings.TRANSLATION_BATCHING = False
+    settings.TRANSLATION_MODEL = "fake:translator"
+    input_dir = tmp_path / "input"
+    (input_dir / "letters").mkdir(parents=True)
+    for name, paragraphs in (
+        ("letters/a.docx", ["Bonjour", "Merci"]),
+        ("b.docx", ["Salut", "Erreur"]),
+    ):
+        doc = docx.Document()
+        for paragraph in paragraphs:
+            doc.add_paragraph(paragraph)
+        doc.save(input_dir / name)
+
+    def flaky_translate_text(text, model, **kwargs):
+        if text == "Erreur":
+            raise RuntimeError("provider error")
+        return offline_translation(text, model, **kwargs)
+
+    monkeypatch.setattr(translator, "translate_text", flaky_translate_text)
+    output = io.StringIO()
+    with pytest.raises(Exception, match="Some documents failed"):
+        call_command(
+            "translate_tree",
+            str(input_dir),
+            str(tmp_path / "out"),
+            "--target",
+            "en",
+            stdout=output,
+        )
+    assert "1 translated, 0 already done, 1 failed." in output.getvalue()
+    assert offline_translation.calls == 3
+
+    # The second run only sends the paragraph that failed
+    monkeypatch.setattr(translator, "translate_text", offline_translation)
+    max_concurrency = settings.TRANSLATION_MAX_CONCURRENCY
+    output = io.StringIO()
+    call_command(
+        "translate_tree",
+        str(input_dir),
+        str(tmp_path / "out"),
+        "--target",
+        "en",
+        "--concurrency",
+        "2",
+        stdout=output,
+    )
+    assert "1 translated, 1 already done, 0 failed." in output.getvalue()
+    assert settings.TRANSLATION_MAX_CONCURRENCY == max_concurrency
+    assert offline_translation.calls == 4
+    result = docx.Document(tmp_path / "out" / "en" / "b.docx")
+    assert [paragraph.text for paragraph in result.paragraphs] == ["SALUT", "ERREUR"]
+
+
+def test_failed_job_resumes_from_its_checkpoints(
+    offline_translation, monkeypatch, settings, tmp_path, output_store
+):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.TRANSLATION_BATCHING = False
+    settings.TRANSLATION_MODEL = "fake:translator"
+    settings.TRANSLATION_TRACE_SAMPLE_RATE = 0
+    checkpoints = TranslationManifest(tmp_path / "checkpoints.sqlite3")
+    monkeypatch.setattr(app_utils, "_checkpoint_store", checkpoints)
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    for paragraph in ("Bonjour", "Merci", "Erreur"):
+        doc.add_paragraph(paragraph)
+    doc.save(doc_file)
+    params = {
+        "input_path": default_storage.save(
+            "temp/letter.docx", ContentFile(doc_file.getvalue())
+        ),
+        "file_name": "letter.docx",
+        "source_lang": "fr",
+        "target_langs": ["en"],
+        "glossary": None,
+        "evaluation_method": "no_evaluation",
+        "job_id": "job-1",
+    }
+
+    def flaky_translate_text(text, model, **kwargs):
+        if text == "Erreur":
+            raise RuntimeError("provider error")
+        return offline_translation(text, model, **kwargs)
+
+    monkeypatch.setattr(translator, "translate_text", flaky_translate_text)
+    with pytest.raises(RuntimeError, match="provider error"):
+        run_translation_pipeline(params)
+    assert offline_translation.calls == 2
+    assert default_storage.exists(params["input_path"])
+
+    # The retried job only sends the paragraph that failed
+    monkeypatch.setattr(translator, "translate_text", offline_translation)
+    result = run_translation_pipeline(params)
+    assert offline_translation.calls == 3
+    assert result["report"]["resumed_segments"] == 2
+    translated = docx.Document(stored_output(output_store, result["result_url"]))
+    assert [paragraph.text for paragraph in translated.paragraphs] == [
+        "BONJOUR",
+        "MERCI",
+        "ERREUR",
+    ]
+    assert checkpoints.load("job-1", checkpoints.make_context("fr", "en")) == {}
+    assert not default_storage.exists(params["input_path"])
+
+
+def test_split_paragraphs_resume_from_their_checkpointed_chunks(
+    offline_translation, monkeypatch, settings, tmp_path, output_store
+):
+    settings.TRANSLATION_BATCHING = False
+    settings.TRANSLATION_CHUNK_TOKENS = 8
+    source = "Première phrase du paragraphe. Deuxième phrase du même paragraphe."
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    for paragraph in (source, "Erreur"):
+        doc.add_paragraph(paragraph)
+    doc.save(doc_file)
+    params = {
+        "input_path": default_storage.save(
+            "temp/split.docx", ContentFile(doc_file.getvalue())
+        ),
+        "file_name": "split.docx",
+        "source_lang": "fr",
+        "target_langs": ["en"],
+        "glossary": None,
+        "evaluation_method": "no_evaluation",
+        "job_id": "job-split",
+    }
+
+    def flaky_translate_text(text, model, **kwargs):
+        if text == "Erreur":
+            raise RuntimeError("provider error")
+        return offline_translation(text, model, **kwargs)
+
+    monkeypatch.setattr(translator, "translate_text", flaky_translate_text)
+    with pytest.raises(RuntimeError, match="provider error"):
+        run_translation_pipeline(params)
+    chunk_calls = offline_translation.calls
+    assert chunk_calls > 1, "The paragraph should be split"
+
+    # The chunks of the split paragraph are not sent again
+    monkeypatch.setattr(translator, "translate_text", offline_translation)
+    result = run_translation_pipeline(params)
+    assert offline_translation.calls == chunk_calls + 1
+    translated = docx.Document(stored_output(output_store, result["result_url"]))
+    assert [paragraph.text for paragraph in translated.paragraphs] == [
+        source.upper(),
+        "ERREUR",
+    ]
+
+
+def test_only_failed_jobs_can_be_retried():
+    attempts = []
+
+    def handler(params, progress, on_segment):
+        attempts.append(params["job_id"])
+        if len(attempts) == 1:
+            raise RuntimeError("provider error")
+        return {"result_url": "/media/out.docx", "score": None}
+
+    queue = InProcessJobQueue(handler)
+    job_id = queue.submit({})
+    assert wait_for_job(queue, job_id)["status"] == FAILED
+    assert queue.retry(job_id)
+    assert wait_for_job(queue, job_id)["status"] == DONE
+    assert not queue.retry(job_id)
+    assert attempts == [job_id, job_id]
+
+
+@pytest.mark.django_db
+def test_same_upload_is_served_from_the_output_store(offline_translation, output_store):
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour tout le monde")
+    doc.save(doc_file)
+
+    def upload(target_language="en"):
+        return Client().post(
+            reverse("upload_and_translate"),
+            {
+                "document": SimpleUploadedFile("report.docx", doc_file.getvalue()),
+                "source_language": "fr",
+                "target_language": target_language,
+                "evaluation_method": "no_evaluation",
+            },
+            HTTP_ACCEPT="application/json",
+        )
+
+    response = upload()
+    assert response.status_code == 202
+    job = wait_for_job(views.get_job_queue(), response.json()["job_id"])
+    assert job["status"] == DONE
+    assert offline_translation.calls == 1
+
+    # Resubmitting the same document returns the stored result without a job
+    response = upload()
+    assert response.status_code == 200
+    assert response.json()["cached"] is True
+    assert response.json()["result_url"] == job["result_url"]
+    response = upload("de")
+    assert response.status_code == 202
+    assert (
+        wait_for_job(views.get_job_queue(), response.json()["job_id"])["status"] == DONE
+    )
+
+    download = Client().get(job["result_url"], HTTP_RANGE="bytes=0-3")
+    assert download.status_code == 206
+    size = os.path.getsize(stored_output(output_store, job["result_url"]))
+    assert download["Content-Range"] == f"bytes 0-3/{size}"
+    assert b"".join(download.streaming_content) == b"PK\x03\x04"
+    assert 'filename="translated_en_report.docx"' in download["Content-Disposition"]
+
+
+def test_output_store_deduplicates_and_evicts_least_recently_used(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_bytes=12)
+    for key, content in (
+        ("a" * 64, b"12345"),
+        ("b" * 64, b"12345"),
+        ("a" * 64, b"other"),
+    ):
+        with store.staging("out.docx") as path:
+            with open(path, "wb") as f:
+                f.write(content)
+        store.put(key, path, "out.docx")
+    store.put_result("c" * 64, {"result_url": "/outputs/a"}, ["a" * 64, "b" * 64])
+    assert store.get_result("c" * 64) == {"result_url": "/outputs/a"}
+    # The second copy of "a" is dropped, the stored one is kept
+    with open(store.get("a" * 64)["path"], "rb") as f:
+        assert f.read() == b"12345"
+
+    with store.staging("new.docx") as path:
+        with open(path, "wb") as f:
+            f.write(b"123456")
+    store.put("d" * 64, path, "new.docx")
+    # "b" was used the least recently and goes over the budget first
+    assert store.get("b" * 64) is None
+    assert store.get("a" * 64) is not None
+    assert store.get_result("c" * 64) is None
+    assert store.stats()["files"] == 2
+
+
+def test_outputs_evicted_during_a_download_are_not_found(monkeypatch, output_store):
+    key = "e" * 64
+    with output_store.staging("out.docx") as path:
+        with open(path, "wb") as f:
+            f.write(b"12345")
+    output_store.put(key, path, "out.docx")
+    entry = output_store.get(key)
+    # The file goes away after the view looked it up
+    monkeypatch.setattr(output_store, "get", lambda key: entry)
+    os.remove(entry["path"])
+
+    response = Client().get(reverse("translation_output", args=[key, "out.docx"]))
+    assert response.status_code == 404
+
+
+def test_first_run_of_a_job_segments_once_for_every_target(
+    monkeypatch, settings, tmp_path
+):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.TRANSLATION_MEMORY_ENABLED = False
+    settings.TRANSLATION_MODEL = "fake:translator"
+    settings.TRANSLATION_TRACE_SAMPLE_RATE = 0
+    monkeypatch.setattr(translator, "translate_text", tagged_translate_text)
+    monkeypatch.setattr(
+        app_utils,
+        "_checkpoint_store",
+        TranslationManifest(tmp_path / "checkpoints.sqlite3"),
+    )
+    segmented = []
+    segment_texts = app_utils.segment_texts
+    monkeypatch.setattr(
+        app_utils,
+        "segment_texts",
+        lambda texts, trace: segmented.append(texts) or segment_texts(texts, trace),
+    )
+    doc_file = io.BytesIO()
+    doc = docx.Document()
+    doc.add_paragraph("Bonjour")
+    doc.save(doc_file)
+
+    result = run_translation_pipeline(
+        {
+            "input_path": default_storage.save(
+                "temp/memo.docx", ContentFile(doc_file.getvalue())
+            ),
+            "file_name": "memo.docx",
+            "source_lang": "fr",
+            "target_langs": ["en", "de"],
+            "glossary": None,
+            "evaluation_method": "no_evaluation",
+            "job_id": "job-2",
+        }
+    )
+
+    assert segmented == [["Bonjour"]]
+    assert "resumed_segments" not in result["report"]["targets"]["de"]["report"]
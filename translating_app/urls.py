@@ -9,4 +9,16 @@ from . import views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("upload/", views.upload_and_translate, name="upload_and_translate"),
+    path("jobs/<str:job_id>/", views.job_status, name="job_status"),
+    path("jobs/<str:job_id>/events/", views.job_events, name="job_events"),
+    path("jobs/<str:job_id>/result/", views.job_result, name="job_result"),
+    path("jobs/<str:job_id>/retry/", views.job_retry, name="job_retry"),
+    path(
+        "outputs/<str:key>/<str:name>",
+        views.translation_output,
+        name="translation_output",
+    ),
+    path("bulk/", views.bulk_translate, name="bulk_translate"),
+    path("bulk/<str:archive_id>/archive/", views.bulk_archive, name="bulk_archive"),
+    path("metrics/", views.metrics_view, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,115 +1,453 @@
 # type: ignore
-from src.llm_translator.translator import translate_text
-from src.llm_translator.utils import (
-    read_docx,
-    read_pptx,
-    read_excel,
-    calculate_meteor_score,
-    embedding_similarity,
+import contextlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from src.llm_translator.batching import translate_batched
+from src.llm_translator.documents import (
+    build_translated_content,
+    parse_document,
+    write_document,
 )
+from src.llm_translator.embeddings import (
+    get_embedding_service,
+    segment_similarity,
+    similarity_scores,
+)
+from src.llm_translator.manifest import TranslationManifest
+from src.llm_translator.memory import TranslationMemory
+from src.llm_translator.meteor import meteor_scores
+from src.llm_translator.metrics import metrics
+from src.llm_translator.outputs import OutputStore
+from src.llm_translator.revisions import RevisionStore
+from src.llm_translator.scheduler import RequestScheduler
+from src.llm_translator.segmenter import Segmenter, estimate_tokens, split_segments
+from src.llm_translator.tracing import text_digest
+from src.llm_translator.translator import get_translation_prompt, translate_chunks
 
-def chunk_text(text, max_length=10000):
-    paragraphs = text.split("\n")  
-    chunks = []
-    current_chunk = ""
+# Number of lowest scoring paragraphs reported with the evaluation score
+EVALUATION_WORST_SEGMENTS = 10
 
-    for paragraph in paragraphs:
-        if len(current_chunk) + len(paragraph) <= max_length:
-            current_chunk += paragraph + "\n\n"
-        else:
-            chunks.append(current_chunk.strip())
-            current_chunk = paragraph + "\n\n"
+_translation_memory = None
+_translation_memory_lock = threading.Lock()
 
-    if current_chunk:
-        chunks.append(current_chunk.strip())
 
-    return chunks
+def get_translation_memory():
+    """Return the process-wide translation memory, or None when it is disabled."""
+    global _translation_memory
+    if not settings.TRANSLATION_MEMORY_ENABLED:
+        return None
+    with _translation_memory_lock:
+        if _translation_memory is None:
+            _translation_memory = TranslationMemory(
+                settings.TRANSLATION_MEMORY_PATH,
+                max_entries=settings.TRANSLATION_MEMORY_MAX_ENTRIES,
+                max_age=settings.TRANSLATION_MEMORY_MAX_AGE_DAYS * 24 * 3600,
+            )
+    return _translation_memory
 
 
-def process_docx_file(input_file_path, model, glossary, source_lang, target_lang, trace):
-    input_text = read_docx(input_file_path)
-    chunks = chunk_text(input_text)  # Split input into manageable chunks
+_revision_store = None
 
-    translated_text = ""
-    for chunk in chunks:
-        translated_chunk = translate_text(
-            chunk,
-            model=model,
-            glossary=glossary,
-            source_lang=source_lang,
-            target_lang=target_lang,
-            trace=trace,
-        )
-        translated_text += translated_chunk + "\n"
-
-    return translated_text.strip(), input_text
-
-
-def process_pptx_file(input_file_path, model, glossary, source_lang, target_lang, trace):
-    slides_content = read_pptx(input_file_path)
-    translated_content = []
-    original_texts = []
-    translated_texts = []
-
-    for slide_texts in slides_content:
-        translated_slide_texts = []
-        for shape_idx, text in slide_texts:
-            original_texts.append(text)
-            chunks = chunk_text(text)
-
-            translated_chunk_text = ""
-            for chunk in chunks:
-                translated_chunk = translate_text(
-                    chunk,
-                    model=model,
-                    glossary=glossary,
-                    source_lang=source_lang,
-                    target_lang=target_lang,
-                    trace=trace,
-                )
-                translated_chunk_text += translated_chunk + "\n"
 
-            translated_slide_texts.append((shape_idx, translated_chunk_text.strip()))
-            translated_texts.append(translated_chunk_text.strip())
-        translated_content.append(translated_slide_texts)
+def get_revision_store():
+    """Return the process-wide store of the last revision of every document lineage."""
+    global _revision_store
+    with _translation_memory_lock:
+        if _revision_store is None:
+            _revision_store = RevisionStore(settings.TRANSLATION_REVISIONS_PATH)
+    return _revision_store
 
-    original_input = "\n".join(original_texts)
-    translated_output_text = "\n".join(translated_texts)
 
-    return translated_content, original_input, translated_output_text
+_checkpoint_store = None
 
 
+def get_checkpoint_store():
+    """Return the process-wide store of the segments translated by running jobs."""
+    global _checkpoint_store
+    with _translation_memory_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = TranslationManifest(
+                settings.TRANSLATION_CHECKPOINTS_PATH
+            )
+    return _checkpoint_store
 
-def process_xlsx_file(
-    input_file_path, model, glossary, source_lang, target_lang, trace
-):
-    # Read .xlsx content as a list of lists of cell content
-    excel_content = read_excel(input_file_path)
 
-    # Flatten the Excel content into a single string, preserving row and cell structure
-    flattened_text = "".join(
-        ["\t".join(str(cell) if cell else "" for cell in row) for row in excel_content]
+_output_store = None
+
+
+def get_output_store():
+    """Return the process-wide store of the translated files."""
+    global _output_store
+    with _translation_memory_lock:
+        if _output_store is None:
+            _output_store = OutputStore(
+                settings.TRANSLATION_OUTPUT_ROOT,
+                max_bytes=settings.TRANSLATION_OUTPUT_MAX_BYTES,
+                max_age=settings.TRANSLATION_OUTPUT_MAX_AGE_DAYS * 24 * 3600,
+            )
+    return _output_store
+
+
+def output_key(input_digest, source_lang, target_lang, glossary=None, **options):
+    """Key of a translation in the output store.
+
+    It covers what the translated file depends on: the uploaded bytes, the
+    languages, the glossary, the model and the version of the prompt.
+    `options` are the other choices a stored result depends on.
+    """
+    prompt = get_translation_prompt(glossary)
+    return OutputStore.make_key(
+        input=input_digest,
+        source_lang=source_lang,
+        target_lang=target_lang,
+        glossary=glossary,
+        model=settings.TRANSLATION_MODEL,
+        prompt_version=getattr(prompt, "version", None),
+        **options,
+    )
+
+
+def make_request_scheduler():
+    """Build the scheduler pacing the model requests of this process."""
+    return RequestScheduler(
+        requests_per_minute=settings.TRANSLATION_RATE_LIMIT_RPM,
+        tokens_per_minute=settings.TRANSLATION_RATE_LIMIT_TPM,
+        max_retries=settings.TRANSLATION_RATE_LIMIT_RETRIES,
+        shared_path=settings.TRANSLATION_RATE_LIMIT_SHARED_PATH,
     )
 
-    # Translate the entire content at once
-    translated_text = translate_text(
-        flattened_text,
+
+def write_translated_document(translated_content, file_path, template_path):
+    """Write the translated copy of a document, see `write_document`.
+
+    Workbooks are streamed above TRANSLATION_XLSX_STREAMING_BYTES.
+    """
+    return write_document(
+        translated_content,
+        file_path,
+        template_path,
+        xlsx_streaming_bytes=settings.TRANSLATION_XLSX_STREAMING_BYTES,
+    )
+
+
+def translate_segments(
+    segments,
+    model,
+    glossary,
+    source_lang,
+    target_lang,
+    trace,
+    on_progress=None,
+    on_segment=None,
+    executor=None,
+):
+    """Translate independent segments, returning their translations in order.
+
+    Short segments are packed into shared requests unless batching is disabled,
+    in which case every segment is its own request. `on_segment(source,
+    translation)` is called as soon as each segment is translated.
+    """
+    if settings.TRANSLATION_BATCHING:
+        translate = functools.partial(
+            translate_batched, max_tokens=settings.TRANSLATION_CHUNK_TOKENS
+        )
+    else:
+        translate = translate_chunks
+    return translate(
+        segments,
         model=model,
         glossary=glossary,
         source_lang=source_lang,
         target_lang=target_lang,
         trace=trace,
+        memory=get_translation_memory(),
+        max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+        on_progress=on_progress,
+        on_segment=on_segment,
+        executor=executor,
+    )
+
+
+def translate_texts(
+    texts,
+    model,
+    glossary,
+    source_lang,
+    target_lang,
+    trace,
+    on_progress=None,
+    on_segment=None,
+    executor=None,
+    text_chunks=None,
+):
+    """Translate texts of any length, e.g. paragraphs or shape texts, in order.
+
+    Texts larger than the token budget are split into chunks first, and the
+    translated chunks of a text are joined back together with the whitespace
+    they were split on. `text_chunks`, the (chunk, separator) pairs of every
+    text from `segment_texts`, skips the splitting when it is already done.
+    """
+    if text_chunks is None:
+        text_chunks = segment_texts(texts, trace)
+
+    with metrics.stage("translate"):
+        translated_chunks = iter(
+            translate_segments(
+                [chunk for chunks in text_chunks for chunk, _ in chunks],
+                model,
+                glossary,
+                source_lang,
+                target_lang,
+                trace,
+                on_progress,
+                on_segment,
+                executor,
+            )
+        )
+    return [
+        "".join(next(translated_chunks) + separator for _, separator in chunks).strip()
+        for chunks in text_chunks
+    ]
+
+
+def segment_texts(texts, trace=None):
+    """Split every text into (chunk, separator) pairs within the budget of a request."""
+    with metrics.stage("segment"):
+        segmenter = Segmenter(settings.TRANSLATION_CHUNK_TOKENS)
+        text_chunks = [list(segmenter.segment_with_separators(text)) for text in texts]
+    if trace is not None:
+        trace.update(metadata={"segmenter": segmenter.stats.as_dict()})
+    return text_chunks
+
+
+def translate_revised(texts, translate, revision=None, on_segment=None):
+    """Translate `texts` with `translate(texts)`, reusing an earlier revision.
+
+    With a `DocumentRevision`, the texts unchanged since the last revision of
+    the document keep their translation and only the others are translated.
+    Long texts are also found from the chunks they were checkpointed as.
+    """
+    if revision is None:
+        return translate(texts)
+    segmenter = Segmenter(settings.TRANSLATION_CHUNK_TOKENS)
+    return revision.translate(texts, translate, on_segment, segmenter)
+
+
+def _has_unrevised_target(target_langs, revision):
+    # Texts are segmented once up front, unless every target diffs against a revision
+    return any(lang not in (revision or {}) for lang in target_langs)
+
+
+def translate_targets(
+    target_langs,
+    translate,
+    on_progress=None,
+    on_segment=None,
+    revision=None,
+    executor=None,
+):
+    """Run `translate` for every target language of a document at once.
+
+    `translate(target_lang, on_progress, on_segment, revision, executor)`
+    translates the already parsed document into one language. Every target
+    sends its requests to one shared pool of TRANSLATION_MAX_CONCURRENCY
+    threads, so translating into ten languages does not open ten times the
+    connections, or to `executor` when the caller already has one. `on_segment`
+    and `revision` are dicts keyed by target language, and
+    `on_progress(done, total)` counts the chunks of every target. Returns the
+    result of each target, keyed by language.
+    """
+    progress = {}
+    progress_lock = threading.Lock()
+
+    def target_progress(target_lang):
+        if on_progress is None:
+            return None
+
+        def report(done, total):
+            with progress_lock:
+                progress[target_lang] = (done, total)
+                on_progress(
+                    sum(done for done, _ in progress.values()),
+                    sum(total for _, total in progress.values()),
+                )
+
+        return report
+
+    with contextlib.ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(
+                ThreadPoolExecutor(
+                    max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+                    thread_name_prefix="translation",
+                )
+            )
+        targets = stack.enter_context(
+            ThreadPoolExecutor(
+                max_workers=len(target_langs), thread_name_prefix="target"
+            )
+        )
+        futures = {
+            target_lang: targets.submit(
+                translate,
+                target_lang,
+                target_progress(target_lang),
+                (on_segment or {}).get(target_lang),
+                (revision or {}).get(target_lang),
+                executor,
+            )
+            for target_lang in target_langs
+        }
+        return {target_lang: future.result() for target_lang, future in futures.items()}
+
+
+def process_document_file(
+    input_file_path,
+    model,
+    glossary,
+    source_lang,
+    target_langs,
+    trace,
+    on_progress=None,
+    on_segment=None,
+    revision=None,
+    executor=None,
+):
+    """Translate the texts of a .docx, .pptx or .xlsx file into `target_langs`.
+
+    The file is parsed by `parse_document`, the paragraphs of a .docx, the
+    shape texts of a .pptx or the unique text cells of a .xlsx, and segmented
+    once for every language (see `translate_targets`). Returns the
+    (translated_content, original_input, translated_output_text) of every
+    language, keyed by language, the content being what
+    `write_translated_document` expects. `on_segment` and `revision` are
+    dicts keyed by language.
+    """
+    with metrics.stage("parse"):
+        layout, original_texts = parse_document(input_file_path)
+    original_input = "\n".join(original_texts)
+    text_chunks = None
+    if _has_unrevised_target(target_langs, revision):
+        text_chunks = segment_texts(original_texts, trace)
+
+    def translate(target_lang, on_progress, on_segment, revision, executor):
+        # Short texts from across the document are packed into shared requests,
+        # texts over the budget of a request are split first
+        def translate_all(texts):
+            return translate_texts(
+                texts,
+                model,
+                glossary,
+                source_lang,
+                target_lang,
+                trace,
+                on_progress,
+                on_segment,
+                executor,
+                text_chunks if revision is None else None,
+            )
+
+        translated_texts = translate_revised(
+            original_texts, translate_all, revision, on_segment
+        )
+        translated_content = build_translated_content(
+            input_file_path, layout, original_texts, translated_texts
+        )
+        translated_output_text = "\n".join(translated_texts)
+        return translated_content, original_input, translated_output_text
+
+    return translate_targets(
+        target_langs, translate, on_progress, on_segment, revision, executor
     )
 
-    # Split translated text back into rows and cells
-    translated_content = [row.split("\t") for row in translated_text.split("\n")]
 
-    # Ensure all rows have the same number of cells as the original content
-    for i, row in enumerate(translated_content):
-        while len(row) < len(excel_content[i]):
-            row.append("")
+class BackTranslator:
+    """Back-translates the segments of a document while the rest is translated.
+
+    Pass `add` as the `on_segment` callback of the forward translation: the
+    translated segments are buffered and, once a buffer reaches the chunk
+    token budget, sent back to the source language in the background, so
+    the self-evaluation mostly overlaps with the forward pass and the writing
+    of the output file. `results` waits for the last requests and returns
+    (source, back-translation) pairs. The requests run on `executor`, the
+    pool of the forward pass, so both share one concurrency budget.
+    """
+
+    def __init__(
+        self,
+        model,
+        source_lang,
+        target_lang,
+        trace=None,
+        max_tokens=None,
+        executor=None,
+    ):
+        self.model = model
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.trace = trace
+        self.max_tokens = max_tokens or settings.TRANSLATION_CHUNK_TOKENS
+        self._pending = []
+        self._pending_tokens = 0
+        self._batches = []
+        self._lock = threading.Lock()
+        self._own_executor = None
+        if executor is None:
+            executor = self._own_executor = ThreadPoolExecutor(
+                max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+                thread_name_prefix="back-translation",
+            )
+        self.executor = executor
+        # Batches wait for their requests here, outside of the request pool
+        self._dispatcher = ThreadPoolExecutor(
+            max_workers=settings.TRANSLATION_MAX_CONCURRENCY,
+            thread_name_prefix="back-translation-batch",
+        )
+
+    def add(self, source, translation):
+        with self._lock:
+            self._pending.append((source, translation))
+            self._pending_tokens += estimate_tokens(translation)
+            if self._pending_tokens >= self.max_tokens:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        future = self._dispatcher.submit(
+            translate_segments,
+            [translation for _, translation in batch],
+            self.model,
+            None,
+            self.target_lang,
+            self.source_lang,
+            self.trace,
+            executor=self.executor,
+        )
+        self._batches.append((batch, future))
+
+    def results(self):
+        with self._lock:
+            self._flush()
+            batches = list(self._batches)
+        pairs = []
+        try:
+            for batch, future in batches:
+                pairs.extend(
+                    (source, back_translation)
+                    for (source, _), back_translation in zip(batch, future.result())
+                )
+        finally:
+            self.close()
+        return pairs
 
-    return translated_content, flattened_text, translated_text
+    def close(self):
+        self._dispatcher.shutdown(wait=False, cancel_futures=True)
+        if self._own_executor is not None:
+            self._own_executor.shutdown(wait=False, cancel_futures=True)
 
 
 def evaluate_translation(
@@ -121,38 +459,80 @@ def evaluate_translation(
     model,
     trace,
     reference_content=None,
+    back_translations=None,
 ):
-    span = trace.span(
-        name="Evaluating translation",
-        input={
-            "original_input": original_input,
-            "translated_output": translated_output_text,
-            "reference_content": reference_content,
-            "evaluation method": evaluation_method,
-        },
-    )
+    """Score a translation with `evaluation_method`, None for "no_evaluation".
+
+    For "self_evaluation", `back_translations` are the (source,
+    back-translation) pairs of a `BackTranslator` run alongside the forward
+    translation. Without them the output is back-translated here, paragraph
+    by paragraph.
+    """
+    span = None
+    if trace is not None:
+        span = trace.span(
+            name="Evaluating translation",
+            # The documents are already in the trace, chunk by chunk
+            input={
+                "original_input": text_digest(original_input),
+                "translated_output": text_digest(translated_output_text),
+                "reference_content": text_digest(reference_content),
+                "evaluation method": evaluation_method,
+            },
+        )
+    segment_scores = None
     if evaluation_method == "reference_file":
-        score = embedding_similarity(reference_content, translated_output_text)
+        similarity = segment_similarity(
+            reference_content,
+            translated_output_text,
+            get_embedding_service(settings.TRANSLATION_EMBEDDING_MODEL),
+        )
+        score, segment_scores = similarity["score"], similarity["segments"]
     elif evaluation_method == "reference_text":
-        # Compare translated output with reference content
-        score = calculate_meteor_score(reference_content, translated_output_text)
-    elif evaluation_method == "self_evaluation":
-        # Back-translate the translated output
-        back_translated_text = translate_text(
+        # Compare translated output with reference content, paragraph by paragraph
+        meteor = meteor_scores(
+            reference_content,
             translated_output_text,
-            model=model,
-            source_lang=target_lang,
-            target_lang=source_lang,
-            trace=trace,
+            workers=settings.TRANSLATION_METEOR_WORKERS,
         )
-        # Compare back-translated text with original input
-        score = embedding_similarity(original_input, back_translated_text)
+        score, segment_scores = meteor["score"], meteor["segments"]
+    elif evaluation_method == "self_evaluation":
+        embedding_service = get_embedding_service(settings.TRANSLATION_EMBEDDING_MODEL)
+        if back_translations is None:
+            # Back-translate the translated output, paragraph by paragraph
+            back_translated_text = "\n".join(
+                translate_texts(
+                    split_segments(translated_output_text),
+                    model,
+                    None,
+                    target_lang,
+                    source_lang,
+                    trace,
+                )
+            )
+            similarity = segment_similarity(
+                original_input, back_translated_text, embedding_service
+            )
+        else:
+            # Compare every back-translated segment with its original
+            similarity = similarity_scores(
+                [source for source, _ in back_translations],
+                [back_translation for _, back_translation in back_translations],
+                embedding_service,
+            )
+        score, segment_scores = similarity["score"], similarity["segments"]
     elif evaluation_method == "no_evaluation":
         score = None
     else:
         # Handle invalid evaluation method
         score = None
     if span:
-        span.end(output=score)
+        # The worst paragraphs are the first ones to review
+        worst_segments = sorted(
+            segment_scores or [], key=lambda segment: segment["score"]
+        )
+        span.end(
+            output=score,
+            metadata={"worst_segments": worst_segments[:EVALUATION_WORST_SEGMENTS]},
+        )
     return score
-
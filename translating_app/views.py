@@ -1,29 +1,85 @@
 # type: ignore
+import hashlib
+import mimetypes
 import os
 import json
-from langfuse import Langfuse
+import re
+import time
+import uuid
 from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.http import content_disposition_header
 from django.views.decorators.csrf import csrf_protect
-from src.llm_translator.translator import initialize_model
-from src.llm_translator.utils import (
-    read_docx,
-    write_docx,
-    read_pptx,
-    write_pptx,
-    read_excel,
-    write_excel,
-)
+from django.views.decorators.http import require_POST
+from src.llm_translator.documents import DOCUMENT_EXTENSIONS
+from src.llm_translator.metrics import metrics
+from src.llm_translator.scheduler import get_scheduler
+from src.llm_translator.translator import prompt_registry
+from .bulk import MANIFEST_NAME, stream_archive
+from .jobs import get_job_queue, DONE, FAILED
 from .utils import (
-    process_docx_file,
-    process_pptx_file,
-    process_xlsx_file,
-    evaluate_translation,
+    get_output_store,
+    get_translation_memory,
+    output_key,
 )
 
-langfuse = Langfuse()
+ARCHIVE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+OUTPUT_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Seconds without events after which a comment keeps the connection open
+EVENTS_HEARTBEAT_INTERVAL = 15
+
+EVALUATION_METHODS = (
+    "reference_file",
+    "reference_text",
+    "self_evaluation",
+    "no_evaluation",
+)
+
+
+def file_sha256(uploaded_file):
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_glossary(glossary_file):
+    """Return the glossary of an uploaded JSON file, a mapping of terms to translations.
+
+    Raises ValueError for a file that is not one, and returns None without a file.
+    """
+    if not glossary_file:
+        return None
+    try:
+        glossary = json.load(glossary_file)
+    except ValueError:
+        raise ValueError("Invalid glossary file") from None
+    if not isinstance(glossary, dict) or not all(
+        isinstance(translation, str) for translation in glossary.values()
+    ):
+        raise ValueError("Glossary must map terms to their translations")
+    return glossary
+
+
+def result_context(result):
+    """Context of translation_complete.html for the result of a job."""
+    return {
+        "translated_file_url": result["result_url"],
+        "score": result["score"],
+        "report": result["report"] or {},
+        "message": "The document has been translated.",
+    }
 
 
 @csrf_protect
@@ -34,8 +90,19 @@ def upload_and_translate(request):
             uploaded_file = request.FILES["document"]
             evaluation_method = request.POST.get("evaluation_method")
             source_lang = request.POST.get("source_language", "auto")
-            target_lang = request.POST.get("target_language", "en")
+            # Several target languages translate the document into each of them
+            target_langs = list(
+                dict.fromkeys(
+                    lang.strip()
+                    for value in request.POST.getlist("target_language")
+                    for lang in value.split(",")
+                    if lang.strip()
+                )
+            ) or ["en"]
+            output = request.POST.get("output", "files")
             glossary_file = request.FILES.get("glossary")
+            # Name shared by the revisions of a document, to reuse earlier translations
+            lineage = request.POST.get("document_lineage", "").strip() or None
 
             # Validate file size (10MB limit)
             if uploaded_file.size > 10 * 1024 * 1024:
@@ -43,176 +110,418 @@ def upload_and_translate(request):
                     {"error": "File size exceeds 10MB limit"}, status=400
                 )
 
-            # Set up temporary directory
-            temp_dir = os.path.join(settings.MEDIA_ROOT, "temp")
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # Save the uploaded file
-            temp_file_name = os.path.join("temp", uploaded_file.name)
-            temp_file_path = default_storage.save(temp_file_name, uploaded_file)
-            temp_file_full_path = default_storage.path(temp_file_path)
-
             file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-
-            # Initialize model
-            model = initialize_model("gpt-4o")
-
-            # Load glossary if provided
-            if glossary_file:
-                glossary = json.load(glossary_file)
-            else:
-                glossary = None
-
-            # Initialize langfuse tracing
-            trace = langfuse.trace(name="AI Document Translator")
-
-            # Process based on file type
-            if file_extension == ".docx":
-                translated_output, original_input = process_docx_file(
-                    temp_file_full_path,
-                    model,
-                    glossary,
-                    source_lang,
-                    target_lang,
-                    trace,
-                )
-
-                # Save translated .docx file
-                output_file_name = f"translated_{target_lang}_{uploaded_file.name}"
-                output_file_path = os.path.join(settings.MEDIA_ROOT, output_file_name)
-                write_docx(translated_output, output_file_path)
-
-                translated_output_text = translated_output  # For evaluation
-
-            elif file_extension == ".pptx":
-                (
-                    translated_content,
-                    original_input,
-                    translated_output_text,
-                ) = process_pptx_file(
-                    temp_file_full_path,
-                    model,
-                    glossary,
-                    source_lang,
-                    target_lang,
-                    trace,
-                )
-
-                # Save translated .pptx file
-                output_file_name = f"translated_{target_lang}_{uploaded_file.name}"
-                output_file_path = os.path.join(settings.MEDIA_ROOT, output_file_name)
-                write_pptx(translated_content, output_file_path, temp_file_full_path)
-
-            elif file_extension == ".xlsx":
-                (
-                    translated_content,
-                    original_input,
-                    translated_output_text,
-                ) = process_xlsx_file(
-                    temp_file_full_path,
-                    model,
-                    glossary,
-                    source_lang,
-                    target_lang,
-                    trace,
-                )
-
-                # Save translated .xlsx file
-                output_file_name = f"translated_{target_lang}_{uploaded_file.name}"
-                output_file_path = os.path.join(settings.MEDIA_ROOT, output_file_name)
-                write_excel(translated_content, output_file_path)
-
-            else:
+            if file_extension not in DOCUMENT_EXTENSIONS:
                 return JsonResponse({"error": "Unsupported file format"}, status=400)
 
-            # Handle evaluation method
-            reference_content = None
+            # Validate the evaluation inputs before queueing any work
+            if evaluation_method not in EVALUATION_METHODS:
+                return JsonResponse({"error": "Invalid evaluation method"}, status=400)
+
+            reference_file = request.FILES.get("reference_file")
+            reference_text = request.POST.get("reference_text")
             if evaluation_method == "reference_file":
-                reference_file = request.FILES.get("reference_file")
                 if not reference_file:
                     return JsonResponse(
                         {"error": "Reference file not provided"}, status=400
                     )
-
-                # Save and read the reference file
-                ref_file_name = os.path.join("temp", reference_file.name)
-                ref_file_path = default_storage.save(ref_file_name, reference_file)
-                ref_file_full_path = default_storage.path(ref_file_path)
                 ref_file_extension = os.path.splitext(reference_file.name)[1].lower()
-
-                # Read reference content based on file type
-                if ref_file_extension == ".docx":
-                    reference_content = read_docx(ref_file_full_path)
-                elif ref_file_extension == ".pptx":
-                    slides_content = read_pptx(ref_file_full_path)
-                    reference_texts = [
-                        text for slide in slides_content for _, text in slide
-                    ]
-                    reference_content = "\n".join(reference_texts)
-                elif ref_file_extension == ".xlsx":
-                    excel_content = read_excel(ref_file_full_path)
-                    reference_texts = [
-                        str(cell) for row in excel_content for cell in row
-                    ]
-                    reference_content = "\n".join(reference_texts)
-                else:
+                if ref_file_extension not in DOCUMENT_EXTENSIONS:
                     return JsonResponse(
                         {"error": "Unsupported reference file format"}, status=400
                     )
+            elif evaluation_method == "reference_text" and not reference_text:
+                return JsonResponse(
+                    {"error": "Reference text not provided"}, status=400
+                )
+            if evaluation_method.startswith("reference_") and len(target_langs) > 1:
+                return JsonResponse(
+                    {"error": "Reference evaluation needs a single target language"},
+                    status=400,
+                )
+            if output not in ("files", "zip"):
+                return JsonResponse({"error": "Invalid output"}, status=400)
 
-                # Clean up reference file
-                default_storage.delete(ref_file_path)
-
-            elif evaluation_method == "reference_text":
-                reference_content = request.POST.get("reference_text")
-                if not reference_content:
-                    return JsonResponse(
-                        {"error": "Reference text not provided"}, status=400
-                    )
-            elif evaluation_method == "self_evaluation":
-                # No additional data needed for self-evaluation
-                pass
-            elif evaluation_method == "no_evaluation":
-                # No evaluation needed
-                pass
-            else:
-                return JsonResponse({"error": "Invalid evaluation method"}, status=400)
-
-            # Evaluate translation
-            score = evaluate_translation(
-                evaluation_method,
-                original_input,
-                translated_output_text,
+            # Load glossary if provided
+            try:
+                glossary = read_glossary(glossary_file)
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # The same upload with the same options is served from the output store
+            input_digest = file_sha256(uploaded_file)
+            cache_key = output_key(
+                input_digest,
                 source_lang,
-                target_lang,
-                model,
-                trace,
-                reference_content=reference_content,
+                target_langs,
+                glossary,
+                evaluation_method=evaluation_method,
+                reference=(
+                    file_sha256(reference_file)
+                    if evaluation_method == "reference_file"
+                    else reference_text
+                    if evaluation_method == "reference_text"
+                    else None
+                ),
+                lineage=lineage,
+                output=output,
             )
+            cached = get_output_store().get_result(cache_key)
+            if cached is not None:
+                metrics.increment("output_cache_hits")
+                if "application/json" in request.headers.get("Accept", ""):
+                    return JsonResponse({**cached, "cached": True})
+                return render(
+                    request,
+                    "translating_app/translation_complete.html",
+                    result_context(cached),
+                )
 
-            langfuse.score(trace_id=trace.trace_id, name=evaluation_method, value=score)
+            # Set up temporary directory
+            temp_dir = os.path.join(settings.MEDIA_ROOT, "temp")
+            os.makedirs(temp_dir, exist_ok=True)
 
-            translated_file_url = settings.MEDIA_URL + output_file_name
+            # Save the uploaded files, the worker deletes them once it is done
+            temp_file_name = os.path.join("temp", uploaded_file.name)
+            temp_file_path = default_storage.save(temp_file_name, uploaded_file)
+            ref_file_path = None
+            if evaluation_method == "reference_file":
+                ref_file_name = os.path.join("temp", reference_file.name)
+                ref_file_path = default_storage.save(ref_file_name, reference_file)
 
-            context = {
-                "translated_file_url": translated_file_url,
-                "score": score,
-                "message": "The document has been translated.",
-            }
+            # Translation runs in the background, the page polls the job status
+            job_id = get_job_queue().submit(
+                {
+                    "input_path": temp_file_path,
+                    "file_name": uploaded_file.name,
+                    "evaluation_method": evaluation_method,
+                    "source_lang": source_lang,
+                    "target_langs": target_langs,
+                    "glossary": glossary,
+                    "reference_path": ref_file_path,
+                    "reference_text": reference_text,
+                    "lineage": lineage,
+                    "output": output,
+                    "input_digest": input_digest,
+                    "cache_key": cache_key,
+                }
+            )
 
-            # Clean up temporary files
-            default_storage.delete(temp_file_path)
-            # Note: Do not delete output_file_path yet, as it's needed for download
+            status_url = reverse("job_status", args=[job_id])
+            events_url = reverse("job_events", args=[job_id])
+            if "application/json" in request.headers.get("Accept", ""):
+                return JsonResponse(
+                    {
+                        "job_id": job_id,
+                        "status_url": status_url,
+                        "events_url": events_url,
+                    },
+                    status=202,
+                )
 
-            return render(request, "translating_app/translation_complete.html", context)
+            context = {
+                "job_id": job_id,
+                "status_url": status_url,
+                "events_url": events_url,
+                "result_url": reverse("job_result", args=[job_id]),
+                "retry_url": reverse("job_retry", args=[job_id]),
+            }
+            return render(request, "translating_app/translation_progress.html", context)
 
         except Exception as e:
             # Log the exception (optional)
             import logging
 
             logger = logging.getLogger(__name__)
-            logger.exception("An error occurred during file upload and translation.")
+            logger.exception("An error occurred during file upload.")
 
             return JsonResponse({"error": str(e)}, status=500)
 
     return render(request, "translating_app/upload.html")
+
+
+@csrf_protect
+def bulk_translate(request):
+    """Queue the translation of every document of an uploaded zip archive.
+
+    The job status is polled like the one of a single document, and its
+    result URL streams a zip of the translated documents with a manifest
+    giving the status of every file.
+    """
+    if request.method != "POST" or not request.FILES.get("archive"):
+        return JsonResponse({"error": "Archive not provided"}, status=400)
+
+    archive = request.FILES["archive"]
+    if archive.size > settings.TRANSLATION_BULK_MAX_UPLOAD_BYTES:
+        return JsonResponse({"error": "Archive exceeds the size limit"}, status=400)
+    if os.path.splitext(archive.name)[1].lower() != ".zip":
+        return JsonResponse({"error": "Unsupported archive format"}, status=400)
+    try:
+        glossary = read_glossary(request.FILES.get("glossary"))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    archive_id = uuid.uuid4().hex
+    output_dir = os.path.join("bulk", archive_id)
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, output_dir), exist_ok=True)
+    input_path = default_storage.save(
+        os.path.join("temp", f"{archive_id}.zip"), archive
+    )
+    job_id = get_job_queue().submit(
+        {
+            "bulk": True,
+            "input_path": input_path,
+            "output_dir": output_dir,
+            "source_lang": request.POST.get("source_language", "auto"),
+            "target_lang": request.POST.get("target_language", "en"),
+            "glossary": glossary,
+        }
+    )
+    return JsonResponse(
+        {
+            "job_id": job_id,
+            "status_url": reverse("job_status", args=[job_id]),
+            "archive_url": reverse("bulk_archive", args=[archive_id]),
+        },
+        status=202,
+    )
+
+
+def bulk_archive(request, archive_id):
+    if not ARCHIVE_ID_PATTERN.match(archive_id):
+        raise Http404("Unknown archive")
+    output_dir = os.path.join(settings.MEDIA_ROOT, "bulk", archive_id)
+    # The manifest is written last, once every document is done
+    if not os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        return JsonResponse({"error": "Archive not ready"}, status=409)
+
+    response = StreamingHttpResponse(
+        stream_archive(output_dir), content_type="application/zip"
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="translated_{archive_id}.zip"'
+    )
+    return response
+
+
+def job_status(request, job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    return JsonResponse(job)
+
+
+@require_POST
+def job_retry(request, job_id):
+    """Queue a failed job again, it resumes from the segments it checkpointed."""
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    if not queue.retry(job_id):
+        return JsonResponse({"error": "Only failed jobs can be retried"}, status=409)
+    return JsonResponse(
+        {"job_id": job_id, "status_url": reverse("job_status", args=[job_id])},
+        status=202,
+    )
+
+
+def format_event(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_job_events(queue, job_id, last_segment_id=0):
+    """Yield the server-sent events of a job until it is done or has failed.
+
+    Every translated segment is sent as a "segment" event as soon as it is
+    stored on the job, followed by a "progress" event whenever the number of
+    translated chunks changes. The stream ends with a "done" event holding the
+    result links, or an "error" event.
+    """
+    last_progress = None
+    last_sent = time.monotonic()
+    while True:
+        job = queue.get(job_id)
+        events = []
+        for segment in queue.get_segments(job_id, after=last_segment_id):
+            last_segment_id = segment["id"]
+            events.append(format_event("segment", segment, event_id=segment["id"]))
+
+        progress = (job["chunks_done"], job["chunks_total"])
+        if progress != last_progress and job["chunks_total"]:
+            last_progress = progress
+            events.append(
+                format_event(
+                    "progress",
+                    {
+                        "chunks_done": job["chunks_done"],
+                        "chunks_total": job["chunks_total"],
+                        "percent": round(
+                            100 * job["chunks_done"] / job["chunks_total"]
+                        ),
+                    },
+                )
+            )
+
+        if job["status"] == DONE:
+            events.append(
+                format_event(
+                    "done",
+                    {
+                        "result_url": job["result_url"],
+                        "result_page_url": reverse("job_result", args=[job_id]),
+                        "score": job["score"],
+                    },
+                )
+            )
+        elif job["status"] == FAILED:
+            events.append(format_event("error", {"error": job["error"]}))
+
+        if events:
+            last_sent = time.monotonic()
+            yield "".join(events)
+        elif time.monotonic() - last_sent > EVENTS_HEARTBEAT_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": heartbeat\n\n"
+
+        if job["status"] in (DONE, FAILED):
+            return
+        time.sleep(settings.TRANSLATION_EVENTS_POLL_INTERVAL)
+
+
+def job_events(request, job_id):
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+
+    # A reconnecting EventSource resumes after the last segment it received
+    try:
+        last_segment_id = int(request.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        last_segment_id = 0
+
+    response = StreamingHttpResponse(
+        stream_job_events(queue, job_id, last_segment_id),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Stop nginx from buffering the stream
+    return response
+
+
+def job_result(request, job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    if job["status"] != DONE:
+        return JsonResponse(job, status=409)
+
+    return render(
+        request, "translating_app/translation_complete.html", result_context(job)
+    )
+
+
+class _FileRange:
+    """The `length` bytes of an open file from its current position.
+
+    FileResponse reads it block by block, and servers with sendfile support
+    send it straight from the file descriptor.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def translation_output(request, key, name):
+    """Download a translated file of the output store, in part with a Range header.
+
+    With TRANSLATION_OUTPUT_SENDFILE set, the web server sends the file.
+    """
+    store = get_output_store()
+    entry = store.get(key) if OUTPUT_KEY_PATTERN.match(key) else None
+    if entry is None:
+        raise Http404("Unknown or expired output")
+
+    mode = settings.TRANSLATION_OUTPUT_SENDFILE
+    if mode in ("nginx", "apache"):
+        response = HttpResponse(
+            content_type=mimetypes.guess_type(entry["name"])[0]
+            or "application/octet-stream"
+        )
+        response["Content-Disposition"] = content_disposition_header(
+            True, entry["name"]
+        )
+        if mode == "nginx":
+            response["X-Accel-Redirect"] = (
+                f"{settings.TRANSLATION_OUTPUT_ACCEL_PREFIX}{key[:2]}/{key}"
+            )
+        else:
+            response["X-Sendfile"] = entry["path"]
+        return response
+
+    size = entry["size"]
+    start, end, status = 0, size - 1, 200
+    match = RANGE_PATTERN.match(request.headers.get("Range", ""))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+        if start > end:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        status = 206
+
+    try:
+        file = open(entry["path"], "rb")
+    except FileNotFoundError:
+        # Evicted between the lookup and now
+        raise Http404("Unknown or expired output")
+    file.seek(start)
+    response = FileResponse(
+        _FileRange(file, end - start + 1),
+        status=status,
+        as_attachment=True,
+        filename=entry["name"],
+    )
+    response["Content-Length"] = end - start + 1
+    response["Accept-Ranges"] = "bytes"
+    # Outputs are stored by content, a key always names the same bytes
+    response["ETag"] = f'"{key}"'
+    response["Cache-Control"] = "private, max-age=86400, immutable"
+    if status == 206:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def metrics_view(request):
+    """Counters and stage timers of this worker process, for local monitoring."""
+    if request.META.get("REMOTE_ADDR") not in settings.TRANSLATION_METRICS_ALLOWED_IPS:
+        return JsonResponse({"error": "Forbidden"}, status=403)
+
+    snapshot = metrics.snapshot()
+    snapshot["rate_limit"] = get_scheduler().stats()
+    snapshot["prompts"] = prompt_registry.stats()
+    snapshot["outputs"] = get_output_store().stats()
+    memory = get_translation_memory()
+    if memory is not None:
+        snapshot["translation_memory"] = memory.stats()
+    return JsonResponse(snapshot)
@@ -0,0 +1,104 @@
+# type: ignore
+import importlib
+import logging
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily by the request code, loaded ahead of the first request here
+FORMAT_MODULES = ("docx", "pptx", "openpyxl", "langchain_community.callbacks")
+
+
+def _load_formats():
+    for name in FORMAT_MODULES:
+        importlib.import_module(name)
+
+
+def _load_model():
+    from src.llm_translator.translator import initialize_model
+
+    initialize_model(settings.TRANSLATION_MODEL)
+
+
+def _load_tokenizer():
+    from src.llm_translator.segmenter import get_token_counter
+    from src.llm_translator.translator import initialize_model
+
+    # tiktoken downloads the encoding on its first use
+    model = initialize_model(settings.TRANSLATION_MODEL)
+    get_token_counter(getattr(model, "model_name", "gpt-4o"))
+
+
+def _load_prompts():
+    from src.llm_translator.translator import prompt_registry
+
+    prompt_registry.preload()
+
+
+def _load_job_queue():
+    from .jobs import get_job_queue
+
+    get_job_queue()
+
+
+def _load_evaluation():
+    import numpy  # noqa: F401
+    from src.llm_translator.meteor import init_scorer
+
+    init_scorer()
+
+
+def _run_steps(steps, timings, stop):
+    for name, step in steps:
+        if stop.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %s failed.", name)
+        timings[name] = time.perf_counter() - start
+
+
+def warm_up():
+    """Load what the first request of a worker would otherwise wait for.
+
+    Run once per worker process, after the application is created. The steps
+    run on a background thread for at most TRANSLATION_WARMUP_TIMEOUT
+    seconds, after which the worker starts anyway and the remaining steps
+    are skipped. Steps reaching the network (the tokenizer download and the
+    Langfuse prompts) only run with TRANSLATION_WARMUP_NETWORK. Every step is
+    timed, and a failing step is logged without stopping the worker. Returns
+    the seconds spent in each step finished in time.
+    """
+    if not settings.TRANSLATION_WARMUP:
+        return {}
+    steps = [
+        ("formats", _load_formats),
+        ("model", _load_model),
+        ("job_queue", _load_job_queue),
+    ]
+    if settings.TRANSLATION_WARMUP_NETWORK:
+        steps += [("tokenizer", _load_tokenizer), ("prompts", _load_prompts)]
+    if settings.TRANSLATION_WARMUP_EVALUATION:
+        steps.append(("evaluation", _load_evaluation))
+
+    timings = {}
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_run_steps, args=(steps, timings, stop), name="warm-up", daemon=True
+    )
+    thread.start()
+    thread.join(settings.TRANSLATION_WARMUP_TIMEOUT)
+    if thread.is_alive():
+        stop.set()
+        logger.warning(
+            "Worker warm-up stopped after %ss: %s",
+            settings.TRANSLATION_WARMUP_TIMEOUT,
+            dict(timings),
+        )
+    else:
+        logger.info("Worker warmed up in %.2fs: %s", sum(timings.values()), timings)
+    return dict(timings)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application  # type: ignore
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "translating_app.settings")
 
 application = get_wsgi_application()
+
+# Load the model, prompts and libraries once per worker, before the first request
+from translating_app.warmup import warm_up  # noqa: E402
+
+warm_up()